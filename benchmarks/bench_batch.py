@@ -0,0 +1,66 @@
+"""
+Benchmark batched lookups.
+
+Compares calling xrefs_to, xrefs_from, funcs_by_line and get_line for every
+address with the batch methods xrefs_to_many, xrefs_from_many, funcs_by_lines
+and get_lines.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_batch [num_lines] [num_lookups]
+"""
+import os
+import sys
+import random
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from benchmarks.common import gen_line_rows, gen_xref_rows, \
+    gen_func_rows, measure, BASE_ADDRESS
+
+
+def main():
+    num_lines = 500000
+    num_lookups = 20000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        num_lookups = int(sys.argv[2])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.add_xrefs(gen_xref_rows(num_lines))
+        sdbgen.add_functions(gen_func_rows(num_lines))
+        sdbgen.close(optimize=False)
+
+        sdb = SearchDB(sdb_path)
+        random.seed(0)
+        addresses = [BASE_ADDRESS + random.randrange(num_lines) * 4
+                for _ in xrange(num_lookups)]
+
+        measure('xrefs_to single',lambda:sum(
+            len(list(sdb.xrefs_to(a))) for a in addresses))
+        measure('xrefs_to_many',lambda:sum(
+            len(x) for x in sdb.xrefs_to_many(addresses).values()))
+        measure('xrefs_from single',lambda:sum(
+            len(list(sdb.xrefs_from(a))) for a in addresses))
+        measure('xrefs_from_many',lambda:sum(
+            len(x) for x in sdb.xrefs_from_many(addresses).values()))
+        measure('funcs_by_line single',lambda:sum(
+            len(list(sdb.funcs_by_line(a))) for a in addresses))
+        measure('funcs_by_lines',lambda:sum(
+            len(f) for f in sdb.funcs_by_lines(addresses).values()))
+        measure('get_line single',lambda:len(
+            [sdb.get_line(a) for a in addresses]))
+        measure('get_lines',lambda:len(sdb.get_lines(addresses)))
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
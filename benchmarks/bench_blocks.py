@@ -0,0 +1,93 @@
+"""
+Benchmark block level search.
+
+Measures filling the blocks table (All of it, only around an eighth of the
+lines, and only around 100 scattered lines, like incremental updates of the
+sdb do), and finding the blocks that contain lines
+with all of some text tokens: With one query over the blocks table
+(SearchDB.blocks_text_tokens), and the way it is written by hand, checking
+the block of every line that matches the first tokens in python (Using
+SearchDB.code_flow_block).
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_blocks [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.types import XrefTypes
+from benchmarks.common import gen_line_rows, gen_func_rows, measure, \
+        BASE_ADDRESS
+
+# Every BLOCK_SIZE lines end with a branch:
+BLOCK_SIZE = 8
+
+def gen_xref_rows(num_lines):
+    """
+    Generate synthetic xref rows: Flow between consecutive lines, and a
+    branch at the end of every block.
+    """
+    for i in xrange(num_lines - 1):
+        yield (XrefTypes.CODE_FLOW, BASE_ADDRESS + i*4,
+                BASE_ADDRESS + (i + 1)*4)
+        if i % BLOCK_SIZE == BLOCK_SIZE - 1:
+            yield (XrefTypes.CODE_JUMP, BASE_ADDRESS + i*4,
+                    BASE_ADDRESS + ((i * 7919) % num_lines) * 4)
+
+
+def python_blocks(sdb,first_tokens,other_tokens):
+    """
+    Blocks with all the tokens, checking the block of every line that
+    matches first_tokens in python.
+    """
+    starts = set()
+    for line in sdb.lines_text_tokens(first_tokens,fields=['address']):
+        block = list(sdb.code_flow_block(line.address))
+        if all(any(tokens in l.text.split() for l in block)
+                for tokens in other_tokens):
+            starts.add(block[0].address)
+    return len(starts)
+
+
+def main():
+    num_lines = 200000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.add_xrefs(gen_xref_rows(num_lines))
+        sdbgen.add_functions(gen_func_rows(num_lines))
+        sdbgen.fill_lines_fts()
+        measure('fill blocks',lambda:sdbgen.fill_blocks())
+        measure('fill blocks of 1/8 of the lines',lambda:sdbgen.fill_blocks(
+            [(BASE_ADDRESS,BASE_ADDRESS + num_lines // 2)]))
+        measure('fill blocks of 100 lines',lambda:sdbgen.fill_blocks(
+            [(BASE_ADDRESS + i*4,BASE_ADDRESS + i*4 + 1)
+                for i in xrange(0,num_lines,num_lines // 100)]))
+        sdbgen.close()
+
+        sdb = SearchDB(sdb_path,FuncIter)
+        measure('cmp+jz blocks python',
+                lambda:python_blocks(sdb,'cmp',['jz']))
+        measure('cmp+jz blocks sql',
+                lambda:len(list(sdb.blocks_text_tokens(['cmp','jz']))))
+        measure('push+pop+xor blocks python',
+                lambda:python_blocks(sdb,'push',['pop','xor']))
+        measure('push+pop+xor blocks sql',lambda:len(list(
+            sdb.blocks_text_tokens(['push','pop','xor']))))
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
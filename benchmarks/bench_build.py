@@ -0,0 +1,61 @@
+"""
+Benchmark full sdb generation with different connection profiles.
+
+Profiles:
+- safe: Default sqlite pragmas, indexes created before the load.
+- gen: GEN_PRAGMAS, indexes created before the load.
+- bulk: BULK_PRAGMAS, indexes created after the load (The default of a new
+  sdb).
+
+Every build inserts lines, xrefs and functions, fills the fts index and
+closes the sdb without optimizing it.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_build [num_lines]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen, SAFE_PRAGMAS, GEN_PRAGMAS, BULK_PRAGMAS
+from benchmarks.common import gen_line_rows, gen_xref_rows, gen_func_rows
+
+# Profiles: (name,pragmas,defer_indexes):
+PROFILES = [
+    ('safe',SAFE_PRAGMAS,False),
+    ('gen',GEN_PRAGMAS,False),
+    ('bulk',BULK_PRAGMAS,True),
+]
+
+def build(sdb_path,num_lines,pragmas,defer_indexes):
+    sdbgen = SDBGen(sdb_path,pragmas=pragmas,defer_indexes=defer_indexes)
+    sdbgen.add_lines(gen_line_rows(num_lines))
+    sdbgen.add_xrefs(gen_xref_rows(num_lines,code_flow=True))
+    sdbgen.add_functions(gen_func_rows(num_lines))
+    sdbgen.fill_lines_fts()
+    sdbgen.close(optimize=False)
+
+
+def main():
+    num_lines = 1000000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    for name,pragmas,defer_indexes in PROFILES:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            start = time.time()
+            build(os.path.join(tmp_dir,'bench.sdb'),num_lines,pragmas,
+                    defer_indexes)
+            elapsed = time.time() - start
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        print('{:<10} {:>10} lines {:>8.2f} sec {:>12.0f} lines/sec'.format(
+            name,num_lines,elapsed,num_lines / elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark byte pattern search.
+
+Measures filling the data pages and their ngram index (All of them, and only
+the pages of one of NUM_SEGMENTS segments, like an incremental update of the
+sdb does), and finding byte
+patterns: By joining the data of all the lines in python and running a
+regular expression, by scanning all the data pages
+(SearchDB.data_pattern_addresses with use_index=False), and with the ngram
+index.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_bytes [num_lines]
+"""
+import os
+import sys
+import random
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.byte_search import BytePattern, iter_data_runs
+from idsearch.types import LineTypes
+from benchmarks.common import measure, BASE_ADDRESS
+
+PATTERNS = ['E8 ?? ?? ?? ?? 85 C0 74','8B 45 ?? 8B 4D','DE AD BE EF',
+        '55 8B EC 83 EC ?? 53 56']
+
+# The lines are split into segments of equal size:
+NUM_SEGMENTS = 8
+
+def gen_line_rows(num_lines):
+    """
+    Generate synthetic line rows with random data of random lengths. Some
+    lines contain the patterns.
+    """
+    rnd = random.Random(0)
+    address = BASE_ADDRESS
+    for i in xrange(num_lines):
+        if i % 100000 == 0:
+            data = '\x55\x8b\xec\x83\xec\x10\x53\x56'
+        elif i % 77777 == 0:
+            data = '\xe8\x01\x02\x03\x04\x85\xc0\x74'
+        else:
+            data = ''.join(chr(rnd.randrange(0x100))
+                    for _ in xrange(rnd.randrange(1,8)))
+        yield (address,LineTypes.CODE,'line_{:x}'.format(i),data)
+        address += len(data)
+        # Leave gaps between some lines:
+        if i % 5000 == 0:
+            address += 0x100
+
+
+def python_search(sdb,pattern):
+    """
+    Join the data of all the lines in python and search it.
+    """
+    regex = BytePattern(pattern).regex
+    runs = iter_data_runs((line.address,line.data) for line in
+            sdb.all_lines(fields=['address','data']))
+    return sum(len(regex.findall(data)) for _,data in runs)
+
+
+def main():
+    num_lines = 200000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        line_rows = list(gen_line_rows(num_lines))
+        sdbgen.add_lines(line_rows)
+        end_address = line_rows[-1][0] + len(line_rows[-1][3])
+        del line_rows
+        seg_size = (end_address - BASE_ADDRESS + NUM_SEGMENTS - 1) // \
+                NUM_SEGMENTS
+        sdbgen.add_segments((BASE_ADDRESS + i * seg_size,
+            BASE_ADDRESS + (i + 1) * seg_size,'')
+            for i in xrange(NUM_SEGMENTS))
+        measure('fill data pages',lambda:sdbgen.fill_data_pages())
+        measure('fill data pages of one segment',lambda:sdbgen.fill_data_pages(
+            [(BASE_ADDRESS + seg_size,BASE_ADDRESS + 2 * seg_size)]))
+        sdbgen.close()
+
+        sdb = SearchDB(sdb_path,FuncIter)
+        for pattern in PATTERNS:
+            measure('{} python'.format(pattern),
+                    lambda:python_search(sdb,pattern))
+            measure('{} scan'.format(pattern),lambda:len(
+                sdb.data_pattern_addresses(pattern,use_index=False)))
+            measure('{} index'.format(pattern),lambda:len(
+                sdb.data_pattern_addresses(pattern)))
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark the query result cache.
+
+Runs a few searches without a cache, then with a cache: Once to fill it, once
+more in the same session, and once in a new session (A new SearchDB over the
+same cache file). Searches: Exact text (SearchDB.lines_text), exact data
+(SearchDB.lines_data), an intersection of two token searches, and a pipeline
+with a python filter over all the lines (SearchDB.cached_lines).
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_cache [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from benchmarks.common import gen_line_rows, measure
+
+def run_searches(sdb):
+    """
+    Run all the searches. Returns the amounts of their results.
+    """
+    pipeline = sdb.all_lines().filter(lambda line:line.text.endswith('ff]'))
+    return (sum(1 for _ in sdb.lines_text('xor eax, [ebp+var_1')),
+            sum(1 for _ in sdb.lines_data('\x45\x17\x90')),
+            sum(1 for _ in sdb.lines_text_tokens('cmp') &
+                sdb.lines_text_tokens('var_17')),
+            sum(1 for _ in sdb.cached_lines('ends with ff',pipeline)))
+
+
+def main():
+    num_lines = 1000000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.fill_lines_fts()
+        sdbgen.close()
+
+        sdb = SearchDB(sdb_path,FuncIter,query_builder=True)
+        measure('no cache',lambda:run_searches(sdb))
+        sdb.open_cache()
+        measure('fill cache',lambda:run_searches(sdb))
+        measure('cached',lambda:run_searches(sdb))
+        sdb.close()
+
+        sdb = SearchDB(sdb_path,FuncIter,query_builder=True)
+        sdb.open_cache()
+        measure('cached, new session',lambda:run_searches(sdb))
+        measure('cache size',lambda:sdb.open_cache().get_size())
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark combined searches.
+
+Every combination is run twice: With nested python loops over the results of
+SearchDB methods, and with the LineQuery combinators (&, |, -,
+within_function_of) that run as one sql query.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_combine [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from benchmarks.common import gen_line_rows, gen_xref_rows, \
+    gen_func_rows, measure
+
+
+def main():
+    num_lines = 500000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.add_xrefs(gen_xref_rows(num_lines))
+        sdbgen.add_functions(gen_func_rows(num_lines))
+        sdbgen.fill_lines_fts()
+        sdbgen.close()
+
+        sdb = SearchDB(sdb_path,FuncIter)
+        qsdb = SearchDB(sdb_path,FuncIter,query_builder=True)
+
+        # Lines with 'var_1f' in functions that also contain 'var_2f':
+        def within_python():
+            return sum(1 for _ in sdb.lines_text('var_1f]').filter(
+                lambda l:any(sdb.lines_in_func(f.address).any(
+                    lambda fl:'var_2f]' in fl.text)
+                    for f in sdb.funcs_by_line(l.address))))
+        measure('within function python',within_python)
+        measure('within function sql',lambda:sum(1 for _ in
+            qsdb.lines_text('var_1f]').within_function_of(
+                qsdb.lines_text('var_2f]'))))
+
+        def union_python():
+            seen = set()
+            for l in sdb.lines_text('var_1f]'):
+                seen.add(l.address)
+            for l in sdb.lines_text('var_2f]'):
+                seen.add(l.address)
+            return len(seen)
+        measure('union python',union_python)
+        measure('union sql',lambda:sum(1 for _ in
+            qsdb.lines_text('var_1f]') | qsdb.lines_text('var_2f]')))
+
+        def difference_python():
+            mov_addrs = set(l.address for l in sdb.lines_text_tokens('mov'))
+            return sum(1 for _ in sdb.lines_text('var_1f]')
+                    .filter(lambda l:l.address not in mov_addrs))
+        measure('difference python',difference_python)
+        measure('difference sql',lambda:sum(1 for _ in
+            qsdb.lines_text('var_1f]') - qsdb.lines_text_tokens('mov')))
+
+        sdb.close()
+        qsdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
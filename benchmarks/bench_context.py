@@ -0,0 +1,66 @@
+"""
+Benchmark context windows of search results.
+
+Gets 3 lines before and after every line that matches a text query:
+Over-fetching a range of addresses (3 times the longest x86 instruction) and
+trimming it in python, counting lines with SearchDB.lines_around for every
+hit, and with one SearchDB.lines_context call for all the hits.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_context [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from benchmarks.common import gen_line_rows, measure
+
+# Lines of context before and after every hit:
+CONTEXT = 3
+# Length of the longest x86 instruction:
+MAX_LINE_SIZE = 15
+
+def trimmed_range(sdb,address):
+    """
+    Context of a line, from a range of addresses that surely contains it.
+    """
+    lines = list(sdb.lines_in_range(address - CONTEXT * MAX_LINE_SIZE,
+        address + CONTEXT * MAX_LINE_SIZE))
+    index = [line.address for line in lines].index(address)
+    return lines[max(index - CONTEXT,0):index + CONTEXT + 1]
+
+
+def main():
+    num_lines = 500000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.fill_lines_fts()
+        sdbgen.close()
+
+        sdb = SearchDB(sdb_path,FuncIter)
+        hits = [line.address for line in
+                sdb.lines_text_tokens('var_17',fields=['address'])]
+
+        measure('trimmed ranges',lambda:sum(len(trimmed_range(sdb,address))
+            for address in hits))
+        measure('lines_around per hit',lambda:sum(
+            len(list(sdb.lines_around(address,CONTEXT))) for address in hits))
+        measure('lines_context',lambda:sum(len(lines) for lines in
+            sdb.lines_context(hits,CONTEXT).itervalues()))
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
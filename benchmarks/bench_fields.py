@@ -0,0 +1,55 @@
+"""
+Benchmark column projection of line queries.
+
+Measures fetching all the lines of an sdb, and lines in a range, with all the
+fields and with the address field only (fields=['address']). Both a current
+sdb and an sdb of the old HEX version are measured.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_fields [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.tests.legacy_sdb import gen_hex_sdb
+from benchmarks.common import gen_line_rows, measure, BASE_ADDRESS
+
+def bench_sdb(name,sdb_path,num_lines):
+    sdb = SearchDB(sdb_path)
+    end_address = BASE_ADDRESS + num_lines * 4
+    for fields_name,fields in [('all fields',None),('address',['address'])]:
+        measure('{} all_lines {}'.format(name,fields_name),
+                lambda:len(list(sdb.all_lines(fields=fields))))
+        measure('{} lines_in_range {}'.format(name,fields_name),
+                lambda:len(list(sdb.lines_in_range(BASE_ADDRESS,
+                    (BASE_ADDRESS + end_address) // 2,fields=fields))))
+    sdb.close()
+
+
+def main():
+    num_lines = 1000000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.close(optimize=False)
+
+        hex_sdb_path = os.path.join(tmp_dir,'bench_hex.sdb')
+        gen_hex_sdb(hex_sdb_path,gen_line_rows(num_lines),[],[])
+
+        bench_sdb('current',sdb_path,num_lines)
+        bench_sdb('hex',hex_sdb_path,num_lines)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
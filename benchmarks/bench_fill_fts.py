@@ -0,0 +1,79 @@
+"""
+Benchmark filling the fts index of the lines table.
+
+Compares the old fill (Default connection pragmas, every fts table filled in
+its own transaction) with SDBGen.fill_lines_fts (Generation pragmas, all the
+fts tables filled in one transaction).
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_fill_fts [num_lines]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from benchmarks.common import gen_line_rows
+
+# Queries of the old fill:
+LEGACY_FILL_QUERIES = [
+    """INSERT INTO lines_text_fts(docid,line_text_hex)
+        SELECT rowid,line_text_hex FROM lines_hex""",
+    """INSERT INTO lines_text_tokens_fts(rowid,line_text)
+        SELECT address,line_text FROM lines""",
+    """INSERT INTO lines_data_fts(docid,line_data_hex)
+        SELECT rowid,line_data_hex FROM lines_hex""",
+]
+
+def fill_legacy(sdbgen):
+    """
+    Fill every fts table in its own transaction (autocommit).
+    """
+    sdbgen.flush()
+    sdbgen._commit_transaction()
+    for query in LEGACY_FILL_QUERIES:
+        sdbgen._conn.execute(query)
+    sdbgen._begin_transaction()
+
+
+def fill_bulk(sdbgen):
+    sdbgen.fill_lines_fts()
+
+
+def measure_fill(name,fill_func,pragmas,num_lines):
+    """
+    Measure the generation of an sdb, and the fill of its fts index.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        kwargs = {} if pragmas is None else {'pragmas':pragmas}
+        sdbgen = SDBGen(os.path.join(tmp_dir,'bench.sdb'),**kwargs)
+        start = time.time()
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.flush()
+        insert_elapsed = time.time() - start
+
+        start = time.time()
+        fill_func(sdbgen)
+        fill_elapsed = time.time() - start
+        sdbgen.close(optimize=False)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print('{:<10} {:>10} lines: insert {:>8.2f} sec, fill fts {:>8.2f} sec'\
+            .format(name,num_lines,insert_elapsed,fill_elapsed))
+
+
+def main():
+    num_lines = 300000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    measure_fill('legacy',fill_legacy,[],num_lines)
+    measure_fill('bulk',fill_bulk,None,num_lines)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark storage of function membership.
+
+Compares the old layout (One funcs_lines row for every byte of every function)
+with the funcs_chunks layout (One row for every chunk of every function).
+Measures the sdb file size, and the latency of lines_in_func and funcs_by_line.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_funcs [num_funcs] [func_size]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB, raw_row_to_line
+from idsearch.types import LineTypes, Function
+from benchmarks.common import BASE_ADDRESS
+
+# Amount of queries for every latency measurement:
+NUM_QUERIES = 2000
+
+def gen_sdb(sdb_path,num_funcs,func_size):
+    """
+    Generate an sdb with num_funcs functions of func_size bytes each.
+    All lines are 4 bytes long.
+    """
+    sdbgen = SDBGen(sdb_path)
+    end_address = BASE_ADDRESS + num_funcs * func_size
+    sdbgen.add_lines((addr,LineTypes.CODE,'nop','\x90\x90\x90\x90')
+            for addr in xrange(BASE_ADDRESS,end_address,4))
+    sdbgen.add_functions((func_addr,'sub_{:X}'.format(func_addr),
+        [(func_addr,func_addr + func_size)])
+            for func_addr in xrange(BASE_ADDRESS,end_address,func_size))
+    sdbgen.close()
+
+
+def convert_to_bytes_layout(sdb_path):
+    """
+    Replace the funcs_chunks table with the old per byte funcs_lines table.
+    """
+    conn = SearchDB(sdb_path)._conn
+    conn.execute("""CREATE TABLE funcs_lines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        line REFERENCES lines(address),
+        func REFERENCES funcs(address))""")
+    conn.execute('CREATE INDEX index_line_address ON funcs_lines(line)')
+    conn.execute('CREATE INDEX index_func_line ON funcs_lines(func)')
+    conn.execute('CREATE UNIQUE INDEX line_func ON funcs_lines(line,func)')
+
+    for func,start,end in conn.execute(
+            'SELECT func,start_address,end_address FROM funcs_chunks')\
+                    .fetchall():
+        conn.executemany('INSERT INTO funcs_lines (line,func) VALUES (?,?)',
+            ((line,func) for line in xrange(start,end)))
+
+    conn.execute('DROP TABLE funcs_chunks')
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def bytes_lines_in_func(conn,func_addr):
+    """
+    lines_in_func over the old layout.
+    """
+    rows = conn.execute("""SELECT address,type,line_text,line_data
+        FROM lines INNER JOIN funcs_lines ON
+        lines.address = funcs_lines.line WHERE funcs_lines.func = ?""",
+        (func_addr,))
+    return [raw_row_to_line(row) for row in rows]
+
+def bytes_funcs_by_line(conn,line_address):
+    """
+    funcs_by_line over the old layout.
+    """
+    rows = conn.execute("""SELECT address,name
+        FROM funcs INNER JOIN funcs_lines ON
+        funcs.address = funcs_lines.func
+        WHERE funcs_lines.line = ?""",
+        (line_address,))
+    return [Function(row[0],row[1]) for row in rows]
+
+
+def measure_latency(name,func,args_list):
+    """
+    Measure average latency of a query function.
+    """
+    start = time.time()
+    for args in args_list:
+        func(*args)
+    elapsed = time.time() - start
+    print('{:<30} {:>10.1f} usec/query'.format(
+        name,elapsed * 1e6 / len(args_list)))
+
+
+def main():
+    num_funcs = 20000
+    func_size = 0x100
+    if len(sys.argv) > 1:
+        num_funcs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        func_size = int(sys.argv[2])
+
+    end_address = BASE_ADDRESS + num_funcs * func_size
+    func_addrs = [(BASE_ADDRESS + random.randrange(num_funcs) * func_size,)
+            for _ in xrange(NUM_QUERIES)]
+    line_addrs = [(random.randrange(BASE_ADDRESS,end_address,4),)
+            for _ in xrange(NUM_QUERIES)]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        chunks_path = os.path.join(tmp_dir,'chunks.sdb')
+        bytes_path = os.path.join(tmp_dir,'bytes.sdb')
+        gen_sdb(chunks_path,num_funcs,func_size)
+        gen_sdb(bytes_path,num_funcs,func_size)
+        convert_to_bytes_layout(bytes_path)
+
+        print('bytes layout size:  {:>12} bytes'.format(
+            os.path.getsize(bytes_path)))
+        print('chunks layout size: {:>12} bytes'.format(
+            os.path.getsize(chunks_path)))
+
+        sdb = SearchDB(bytes_path)
+        measure_latency('bytes lines_in_func',
+            lambda addr:bytes_lines_in_func(sdb._conn,addr),func_addrs)
+        measure_latency('bytes funcs_by_line',
+            lambda addr:bytes_funcs_by_line(sdb._conn,addr),line_addrs)
+        sdb.close()
+
+        sdb = SearchDB(chunks_path)
+        measure_latency('chunks lines_in_func',
+            lambda addr:list(sdb.lines_in_func(addr)),func_addrs)
+        measure_latency('chunks funcs_by_line',
+            lambda addr:list(sdb.funcs_by_line(addr)),line_addrs)
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
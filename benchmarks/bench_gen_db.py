@@ -0,0 +1,84 @@
+"""
+Benchmark sdb generation insertion speed.
+
+Compares the old insertion path (One execute per row, commit every 1024
+operations) with the buffered executemany path of SDBGen. Only the insertion
+itself is measured.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_gen_db [num_lines]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen, INSERT_LINE, INSERT_XREF
+from benchmarks.common import gen_line_rows, gen_xref_rows
+
+# Amount of operations in one batch, in the old insertion path:
+LEGACY_BATCH_OPERS = 1024
+
+def insert_legacy(sdbgen,line_rows,xref_rows):
+    """
+    Insert rows one execute at a time, committing every LEGACY_BATCH_OPERS
+    operations.
+    """
+    conn = sdbgen._conn
+    pending = 0
+    for query,rows in [(INSERT_LINE,line_rows),(INSERT_XREF,xref_rows)]:
+        for row in rows:
+            conn.execute(query,row)
+            pending += 1
+            if pending >= LEGACY_BATCH_OPERS:
+                pending = 0
+                conn.execute('COMMIT')
+                conn.execute('BEGIN TRANSACTION')
+
+
+def insert_bulk(sdbgen,line_rows,xref_rows):
+    """
+    Insert rows using the buffered bulk api.
+    """
+    sdbgen._buffer_rows(INSERT_LINE,line_rows)
+    sdbgen.add_xrefs(xref_rows)
+    sdbgen.flush()
+
+
+def measure_insert(name,func,line_rows,xref_rows):
+    """
+    Measure the rows/sec of one insertion function.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdbgen = SDBGen(os.path.join(tmp_dir,'bench.sdb'))
+        start = time.time()
+        func(sdbgen,line_rows,xref_rows)
+        elapsed = time.time() - start
+        sdbgen.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    num_rows = len(line_rows) + len(xref_rows)
+    print('{:<10} {:>10} rows {:>8.2f} sec {:>12.0f} rows/sec'.format(
+        name,num_rows,elapsed,num_rows / elapsed))
+
+
+def main():
+    num_lines = 200000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    # Rows are prepared in advance, so that only the insertion itself is
+    # measured:
+    line_rows = [(addr,line_type,line_text,buffer(line_data))
+        for addr,line_type,line_text,line_data in gen_line_rows(num_lines)]
+    xref_rows = list(gen_xref_rows(num_lines,code_flow=True))
+
+    measure_insert('legacy',insert_legacy,line_rows,xref_rows)
+    measure_insert('bulk',insert_bulk,line_rows,xref_rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark graph queries over xrefs.
+
+Queries are run by walking the xrefs with one sql query per node
+(SearchDB.xrefs_from), with one recursive sql query
+(SearchDB.xrefs_from_transitive, SearchDB.code_flow_block) and over an in
+memory graph (SearchDB.xref_graph, SearchDB.call_graph). The time of loading
+the graphs is measured separately.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_graph [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import collections
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.types import XrefTypes
+from benchmarks.common import gen_line_rows, gen_func_rows, measure, \
+        BASE_ADDRESS, FUNC_SIZE
+
+def gen_xref_rows(num_lines):
+    """
+    Generate synthetic xref rows: Flow between the lines of every function,
+    and two calls from every function to other functions.
+    """
+    num_funcs = num_lines // FUNC_SIZE
+    for i in xrange(num_lines):
+        if (i + 1) % FUNC_SIZE != 0:
+            yield (XrefTypes.CODE_FLOW, BASE_ADDRESS + i*4,
+                    BASE_ADDRESS + (i + 1)*4)
+
+    for f in xrange(num_funcs):
+        for k,callee in enumerate([(f * 3 + 1) % num_funcs,
+                (f * 7919 + 5) % num_funcs]):
+            yield (XrefTypes.CODE_JUMP,
+                    BASE_ADDRESS + (f * FUNC_SIZE + 8 + k*8)*4,
+                    BASE_ADDRESS + callee * FUNC_SIZE * 4)
+
+
+def sql_reachable(sdb,address):
+    """
+    Lines reachable from a line, with one sql query per line.
+    """
+    visited = set([address])
+    queue = collections.deque([address])
+    while len(queue) > 0:
+        for xref in sdb.xrefs_from(queue.popleft()):
+            if xref.line_to not in visited:
+                visited.add(xref.line_to)
+                queue.append(xref.line_to)
+    return len(visited)
+
+def sql_callees(sdb,func_addr,depth):
+    """
+    Functions called from a function up to some depth, with sql queries per
+    function and per line.
+    """
+    func_addrs = set(func.address for func in sdb.all_functions())
+    visited = set()
+    frontier = [func_addr]
+    for _ in xrange(depth):
+        next_frontier = []
+        for addr in frontier:
+            for line in sdb.lines_in_func(addr,fields=['address']):
+                for xref in sdb.xrefs_from(line.address):
+                    if xref.xref_type != XrefTypes.CODE_JUMP:
+                        continue
+                    if xref.line_to in func_addrs and \
+                            xref.line_to not in visited:
+                        visited.add(xref.line_to)
+                        next_frontier.append(xref.line_to)
+        frontier = next_frontier
+    return len(visited)
+
+
+def main():
+    num_lines = 200000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.add_xrefs(gen_xref_rows(num_lines))
+        sdbgen.add_functions(gen_func_rows(num_lines))
+        sdbgen.close(optimize=False)
+
+        sdb = SearchDB(sdb_path,FuncIter)
+        graphs = {}
+
+        def load(name,func):
+            graphs[name] = func()
+            return len(graphs[name])
+
+        measure('load xref graph',lambda:load('xrefs',sdb.xref_graph))
+        measure('load call graph',lambda:load('calls',sdb.call_graph))
+
+        measure('reachable lines sql',
+                lambda:sql_reachable(sdb,BASE_ADDRESS))
+        measure('reachable lines recursive sql',lambda:len(
+            set([BASE_ADDRESS]) | set(xref.line_to for xref in
+                sdb.xrefs_from_transitive(BASE_ADDRESS))))
+        measure('reachable lines graph',
+                lambda:len(graphs['xrefs'].reachable(BASE_ADDRESS)))
+
+        measure('callees depth 3 sql',
+                lambda:sql_callees(sdb,BASE_ADDRESS,3))
+        measure('callees depth 3 graph',
+                lambda:len(graphs['calls'].callees(BASE_ADDRESS,3)))
+
+        measure('code flow block recursive sql',lambda:len(list(
+            sdb.code_flow_block(BASE_ADDRESS + 0x10*4))))
+
+        last_func = BASE_ADDRESS + \
+                ((num_lines // FUNC_SIZE) - 1) * FUNC_SIZE * 4
+        measure('shortest path graph',lambda:len(
+            graphs['xrefs'].shortest_path(BASE_ADDRESS,last_func) or []))
+        measure('scc of functions graph',lambda:len(
+            graphs['calls'].strongly_connected_components()))
+
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
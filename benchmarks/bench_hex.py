@@ -0,0 +1,74 @@
+"""
+Microbenchmark of the hex codec (data_to_hex, hex_to_data).
+
+Compares the old per byte implementation with the binascii based one. Inputs
+follow typical line sizes: 1-15 data bytes (x86 instructions) and 10-60
+characters of text.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_hex [num_items]
+"""
+import sys
+import time
+import random
+
+from idsearch.types import data_to_hex, hex_to_data
+
+def legacy_data_to_hex(data):
+    """
+    The old per byte data_to_hex.
+    """
+    return " ".join(map(lambda c:c.encode('hex').lower(),data))
+
+def legacy_hex_to_data(data_hex):
+    """
+    The old per byte hex_to_data.
+    """
+    return ''.join(
+        map(lambda chex:chex.decode('hex'),data_hex.split(' '))
+    )
+
+
+def gen_items(num_items,min_len,max_len):
+    """
+    Generate random strings with lengths in a given range.
+    """
+    return [''.join(chr(random.randrange(256))
+        for _ in xrange(random.randint(min_len,max_len)))
+            for _ in xrange(num_items)]
+
+
+def measure_rate(name,func,items):
+    """
+    Measure the time of converting all the items.
+    """
+    start = time.time()
+    func(items)
+    elapsed = time.time() - start
+    print('{:<40} {:>10.0f} items/sec'.format(name,len(items) / elapsed))
+
+
+def bench(kind,items):
+    items_hex = [data_to_hex(item) for item in items]
+    measure_rate(kind + ' legacy data_to_hex',
+            lambda items:[legacy_data_to_hex(item) for item in items],items)
+    measure_rate(kind + ' data_to_hex',
+            lambda items:[data_to_hex(item) for item in items],items)
+    measure_rate(kind + ' legacy hex_to_data',
+            lambda items:[legacy_hex_to_data(item) for item in items],
+            items_hex)
+    measure_rate(kind + ' hex_to_data',
+            lambda items:[hex_to_data(item) for item in items],items_hex)
+
+
+def main():
+    num_items = 200000
+    if len(sys.argv) > 1:
+        num_items = int(sys.argv[1])
+
+    bench('data',gen_items(num_items,1,15))
+    bench('text',gen_items(num_items,10,60))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark byte scans over the segment image.
+
+Finds data and regular expressions over bytes in the whole program: By
+joining the data of all the lines in python (SearchDB.all_lines), with the
+data pages (SearchDB.data_pattern_addresses) and by scanning the memory
+mapped segment image (SearchDB.image_find_data and image_find_regex).
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_image [num_lines]
+"""
+import os
+import re
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.byte_search import iter_data_runs
+from idsearch.segment_image import gen_image_path
+from benchmarks.common import measure
+from benchmarks.bench_bytes import gen_line_rows
+
+DATA = '\x55\x8b\xec\x83\xec\x10\x53\x56'
+PATTERN = '55 8B EC 83 EC 10 53 56'
+# A call followed by a test of its result:
+REGEX = re.compile('\xe8.{4}\x85\xc0[\x74\x75]',re.DOTALL)
+
+
+def python_find(sdb,data):
+    """
+    Join the data of all the lines in python and search it.
+    """
+    runs = iter_data_runs((line.address,line.data) for line in
+            sdb.all_lines(fields=['address','data']))
+    return sum(run_data.count(data) for _,run_data in runs)
+
+
+def main():
+    num_lines = 1000000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.fill_data_pages()
+        measure('write image',lambda:sdbgen.write_image(
+            gen_image_path(sdb_path)))
+        sdbgen.close()
+
+        sdb = SearchDB(sdb_path,FuncIter)
+        measure('open image',lambda:len(sdb.open_image().segments))
+        measure('find data python',lambda:python_find(sdb,DATA))
+        measure('find data pages scan',lambda:len(
+            sdb.data_pattern_addresses(PATTERN,use_index=False)))
+        measure('find data pages index',lambda:len(
+            sdb.data_pattern_addresses(PATTERN)))
+        measure('find data image',lambda:len(list(
+            sdb.image_find_data(DATA))))
+        measure('find regex pages scan',lambda:len(
+            sdb.data_pattern_addresses('E8 ?? ?? ?? ?? 85 C0 7?',
+                use_index=False)))
+        measure('find regex image',lambda:len(list(
+            sdb.image_find_regex(REGEX))))
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
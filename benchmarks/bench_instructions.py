@@ -0,0 +1,102 @@
+"""
+Benchmark searches of instructions.
+
+Finds immediate constants, mnemonics and calls through registers: By
+filtering the text of lines in python (After an fts search where possible),
+and with the instructions and operands tables (SearchDB.lines_with_immediate,
+SearchDB.lines_by_mnemonic and line_query conditions).
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_instructions [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.line_query import mnemonic_is, has_operand
+from idsearch.types import LineTypes, OperandTypes
+from benchmarks.common import measure, BASE_ADDRESS
+
+REGISTERS = ['eax','ecx','edx','ebx','esi','edi']
+# A crypto constant (MD5, SHA1):
+CONSTANT = 0x67452301
+
+def gen_rows(num_lines):
+    """
+    Generate synthetic line rows and instruction rows. One of every 1000 lines
+    loads the constant.
+    """
+    line_rows = []
+    instruction_rows = []
+    for i in xrange(num_lines):
+        address = BASE_ADDRESS + i*4
+        reg = REGISTERS[i % len(REGISTERS)]
+        if i % 1000 == 1:
+            value = CONSTANT
+        else:
+            value = (i * 7919) & 0xffffffff
+        if i % 5 == 0:
+            mnemonic = 'call'
+            if i % 3 == 0:
+                operands = [(OperandTypes.REG,reg,0)]
+            else:
+                operands = [(OperandTypes.NEAR,'sub_{:X}'.format(value),
+                    value)]
+        else:
+            mnemonic = ['mov','add','xor','cmp'][i % 4]
+            operands = [(OperandTypes.REG,reg,0),
+                    (OperandTypes.IMM,'{:X}h'.format(value),value)]
+        text = '{} {}'.format(mnemonic,', '.join(op[1] for op in operands))
+        line_rows.append((address,LineTypes.CODE,text,'\x90\x90\x90\x90'))
+        instruction_rows.append((address,mnemonic,operands))
+    return line_rows,instruction_rows
+
+
+def main():
+    num_lines = 500000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        line_rows,instruction_rows = gen_rows(num_lines)
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(line_rows)
+        measure('add instructions',
+                lambda:sdbgen.add_instructions(instruction_rows))
+        sdbgen.fill_lines_fts()
+        sdbgen.close()
+
+        sdb = SearchDB(sdb_path,FuncIter,query_builder=True)
+        constant_text = '{:X}h'.format(CONSTANT)
+        measure('immediate python',lambda:len(list(sdb.all_lines().filter(
+            lambda line:line.text.endswith(', ' + constant_text)))))
+        measure('immediate fts',lambda:len(list(
+            sdb.lines_text_tokens(constant_text))))
+        measure('immediate operands',lambda:len(list(
+            sdb.lines_with_immediate(CONSTANT,fields=['address']))))
+        measure('mnemonic python',lambda:len(list(sdb.all_lines().filter(
+            lambda line:line.text.split(' ')[0] == 'call'))))
+        measure('mnemonic fts',lambda:len(list(
+            sdb.lines_text_tokens('call').filter(
+                lambda line:line.text.split(' ')[0] == 'call'))))
+        measure('mnemonic instructions',lambda:len(list(
+            sdb.lines_by_mnemonic('call',fields=['address']))))
+        measure('call register fts',lambda:len(list(
+            sdb.lines_text_tokens('call').filter(
+                lambda line:line.text.split(' ')[1] in REGISTERS))))
+        measure('call register operands',lambda:len(list(
+            sdb.query(fields=['address']).filter(mnemonic_is('call') &
+                has_operand(0,OperandTypes.REG)))))
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark lazy line decoding.
+
+Runs an address only pipeline (Filter lines by type, collect their addresses)
+over all the lines of an sdb, with eager lines and with lazy lines
+(SearchDB(...,lazy_lines=True)). Both a current sdb and an sdb of the old HEX
+version are measured.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_lazy [num_lines]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.types import LineTypes
+from idsearch.tests.legacy_sdb import gen_hex_sdb
+from benchmarks.common import gen_line_rows
+
+# Every DATA_EVERY line is data:
+DATA_EVERY = 8
+
+def data_line_addresses(sdb):
+    return list(sdb.all_lines()\
+            .filter(lambda line:line.line_type == LineTypes.DATA)\
+            .map(lambda line:line.address))
+
+
+def measure_pipeline(name,sdb_path,lazy_lines):
+    """
+    Measure the address only pipeline.
+    """
+    sdb = SearchDB(sdb_path,FuncIter,lazy_lines)
+    start = time.time()
+    data_line_addresses(sdb)
+    elapsed = time.time() - start
+    sdb.close()
+    print('{:<30} {:>10.3f} sec'.format(name,elapsed))
+
+
+def main():
+    num_lines = 1000000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines,DATA_EVERY))
+        sdbgen.close(optimize=False)
+
+        hex_sdb_path = os.path.join(tmp_dir,'bench_hex.sdb')
+        gen_hex_sdb(hex_sdb_path,gen_line_rows(num_lines,DATA_EVERY),[],[])
+
+        for name,path in [('current',sdb_path),('hex',hex_sdb_path)]:
+            measure_pipeline(name + ' eager',path,False)
+            measure_pipeline(name + ' lazy',path,True)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
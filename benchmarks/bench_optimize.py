@@ -0,0 +1,102 @@
+"""
+Benchmark the finalization of an sdb (SDBGen.optimize).
+
+Generates an sdb without finalization, measures query latency, finalizes it
+(Merging fts segments, ANALYZE and VACUUM) and measures again.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_optimize [num_lines]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.types import LineTypes
+from benchmarks.common import BASE_ADDRESS, MNEMONICS
+
+# Amount of lines inserted to the fts index together. Sdbs that are updated
+# incrementally get their fts index in many small parts:
+FTS_PART_SIZE = 0x1000
+
+# Amount of runs of every query:
+NUM_RUNS = 20
+
+REGISTERS = ['eax','ebx','ecx','edx','esi','edi','ebp','esp']
+
+def gen_line_rows(num_lines):
+    """
+    Generate synthetic line rows.
+    """
+    for i in xrange(num_lines):
+        yield (BASE_ADDRESS + i*4,LineTypes.CODE,'{} {}, {:X}h'.format(
+            MNEMONICS[i % len(MNEMONICS)],REGISTERS[(i // 7) % len(REGISTERS)],
+            i & 0xffff),
+            chr(i & 0xff) + chr((i >> 8) & 0xff) + '\x00\x90')
+
+
+def gen_sdb(sdb_path,num_lines):
+    """
+    Generate an sdb without finalizing it.
+    """
+    sdbgen = SDBGen(sdb_path)
+    addresses = []
+    for line_row in gen_line_rows(num_lines):
+        sdbgen.add_lines([line_row])
+        addresses.append(line_row[0])
+        if len(addresses) >= FTS_PART_SIZE:
+            sdbgen.fill_lines_fts(addresses)
+            addresses = []
+    sdbgen.fill_lines_fts(addresses)
+    sdbgen.close(optimize=False)
+
+
+def measure_average(name,func):
+    """
+    Measure the average time of a query.
+    """
+    start = time.time()
+    for _ in xrange(NUM_RUNS):
+        func()
+    elapsed = time.time() - start
+    print('{:<40} {:>10.2f} msec'.format(name,elapsed * 1000 / NUM_RUNS))
+
+
+def bench_queries(name,sdb_path):
+    print('{:<40} {:>10} bytes'.format(name + ' size',
+        os.path.getsize(sdb_path)))
+    sdb = SearchDB(sdb_path)
+    measure_average(name + ' match_text_fts',
+            lambda:list(sdb.match_text_fts('"63 61 6c 6c 20 65 73 69"')))
+    measure_average(name + ' lines_text_tokens',
+            lambda:list(sdb.lines_text_tokens('push edx')))
+    measure_average(name + ' lines_data',
+            lambda:list(sdb.lines_data('\x12\x34')))
+    sdb.close()
+
+
+def main():
+    num_lines = 300000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        gen_sdb(sdb_path,num_lines)
+        bench_queries('before',sdb_path)
+
+        start = time.time()
+        SDBGen(sdb_path,update=True).close(optimize=True)
+        print('{:<40} {:>10.2f} sec'.format('optimize',time.time() - start))
+
+        bench_queries('after',sdb_path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark composed line queries.
+
+Every query is run twice: Filtering in python with FuncIter lambdas over the
+results of a SearchDB method, and filtering with line_query conditions that
+are compiled into the sql query (query builder mode).
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_query [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.line_query import line_type_is, address_in_range, \
+    has_xrefs_to, text_tokens
+from idsearch.types import LineTypes
+from benchmarks.common import gen_line_rows, gen_xref_rows, gen_func_rows, \
+    measure, BASE_ADDRESS
+
+def main():
+    num_lines = 500000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.add_xrefs(gen_xref_rows(num_lines))
+        sdbgen.add_functions(gen_func_rows(num_lines))
+        sdbgen.fill_lines_fts()
+        sdbgen.close()
+
+        sdb = SearchDB(sdb_path,FuncIter)
+        qsdb = SearchDB(sdb_path,FuncIter,query_builder=True)
+        start = BASE_ADDRESS + num_lines
+        end = BASE_ADDRESS + num_lines * 2
+
+        measure('text+type+range python',lambda:sum(1 for _ in
+            sdb.lines_text_tokens('call')
+            .filter(lambda l:l.line_type == LineTypes.CODE)
+            .filter(lambda l:start <= l.address <= end)))
+        measure('text+type+range sql',lambda:sum(1 for _ in
+            qsdb.lines_text_tokens('call')
+            .filter(line_type_is(LineTypes.CODE))
+            .filter(address_in_range(start,end))))
+
+        measure('text+xrefs to python',lambda:sum(1 for _ in
+            sdb.lines_text_tokens('mov')
+            .filter(lambda l:any(True for _ in sdb.xrefs_to(l.address)))))
+        measure('text+xrefs to sql',lambda:sum(1 for _ in
+            qsdb.lines_text_tokens('mov')
+            .filter(has_xrefs_to())))
+
+        measure('range+text python',lambda:sum(1 for _ in
+            sdb.lines_in_range(start,end)
+            .filter(lambda l:'lea' in l.text.split())))
+        measure('range+text sql',lambda:sum(1 for _ in
+            qsdb.lines_in_range(start,end)
+            .filter(text_tokens('lea'))))
+
+        sdb.close()
+        qsdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
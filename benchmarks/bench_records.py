@@ -0,0 +1,70 @@
+"""
+Benchmark the memory and creation time of result records.
+
+Compares records with a per instance __dict__ (The old Line class) with the
+__slots__ records of idsearch.types, and measures iterating and listing
+SearchDB.all_lines() of a big sdb.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_records [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.types import Line
+from benchmarks.common import gen_line_rows, measure
+
+class DictLine(object):
+    """
+    The old Line record, with a per instance __dict__.
+    """
+    def __init__(self,address,line_type,text,data):
+        self.address = address
+        self.line_type = line_type
+        self.text = text
+        self.data = data
+
+
+def record_size(record):
+    """
+    Size in bytes of a record object, without the values it points to.
+    """
+    size = sys.getsizeof(record)
+    if hasattr(record,'__dict__'):
+        size += sys.getsizeof(record.__dict__)
+    return size
+
+
+def main():
+    num_lines = 2000000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    line_rows = list(gen_line_rows(num_lines))
+    for name,record_type in [('dict',DictLine),('slots',Line)]:
+        print('{:<30} {:>10} bytes'.format(name + ' record size',
+            record_size(record_type(*line_rows[0]))))
+        measure(name + ' create records',
+                lambda:len([record_type(*row) for row in line_rows]))
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(line_rows)
+        sdbgen.close(optimize=False)
+
+        sdb = SearchDB(sdb_path)
+        measure('all_lines iterate',lambda:sum(1 for _ in sdb.all_lines()))
+        measure('all_lines list',lambda:len(list(sdb.all_lines())))
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
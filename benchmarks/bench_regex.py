@@ -0,0 +1,64 @@
+"""
+Benchmark regular expression search over the text of lines.
+
+Every regular expression is searched by filtering all the lines in python,
+with the sqlite REGEXP function on all the lines (SearchDB.lines_regex with
+prefilter=False), and with SearchDB.lines_regex, that runs the regular
+expression only on the candidates found using the fts tables.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_regex [num_lines]
+"""
+import os
+import re
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from benchmarks.common import gen_line_rows, measure
+
+REGEXES = [
+    # Tokens inside a literal:
+    r'cmp\s+eax, \[ebp\+var_ff\]',
+    # Literals without complete tokens:
+    r'call\s+\w+, \[ebp\+var_1\d\]',
+    # Alternatives:
+    r'^(?:push|pop) eax, \[ebp\+var_[0-9a-f]\]',
+    # Ignoring case, without complete tokens:
+    r'(?i)XOR\s+EAX',
+]
+
+
+def main():
+    num_lines = 500000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        sdb_path = os.path.join(tmp_dir,'bench.sdb')
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(gen_line_rows(num_lines))
+        sdbgen.fill_lines_fts()
+        sdbgen.close()
+
+        sdb = SearchDB(sdb_path,FuncIter)
+        for regex in REGEXES:
+            compiled = re.compile(regex)
+            measure('{} python'.format(regex[:24]),lambda:len(list(
+                sdb.all_lines(fields=['address','text']).filter(
+                    lambda line:compiled.search(line.text) is not None))))
+            measure('{} regexp'.format(regex[:24]),lambda:len(list(
+                sdb.lines_regex(regex,fields=['address'],prefilter=False))))
+            measure('{} prefilter'.format(regex[:24]),lambda:len(list(
+                sdb.lines_regex(regex,fields=['address']))))
+        sdb.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark line storage formats.
+
+Compares sdbs of version SDBVersions.HEX (Space separated hex columns) with
+sdbs of version SDBVersions.RAW (TEXT and BLOB columns). Measures the sdb file
+size, and the time of reading lines through SearchDB.
+
+Run as follows (From the root of the repository):
+
+python -m benchmarks.bench_storage [num_lines]
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.types import LineTypes
+from idsearch.tests.legacy_sdb import gen_hex_sdb
+from benchmarks.common import measure, BASE_ADDRESS
+
+def gen_line_rows(num_lines):
+    """
+    Generate synthetic line rows, with typical x86 text and data lengths.
+    """
+    line_rows = []
+    addr = BASE_ADDRESS
+    for i in xrange(num_lines):
+        line_data = ('\x48\x8b\x85' + chr(i & 0xff) + '\xff\xff\xff')[:1 + i % 7]
+        line_rows.append((addr,LineTypes.CODE,
+            'mov rax, [rbp+var_{:X}]'.format(i & 0xfff),line_data))
+        addr += len(line_data)
+    return line_rows
+
+
+def gen_raw_sdb(sdb_path,line_rows):
+    """
+    Generate an sdb of the current version.
+    """
+    sdbgen = SDBGen(sdb_path)
+    sdbgen.add_lines(line_rows)
+    sdbgen.fill_lines_fts()
+    sdbgen.close()
+
+
+def bench_sdb(name,sdb_path,line_rows):
+    """
+    Measure size and read times of one sdb.
+    """
+    print('{:<30} {:>10} bytes'.format(name + ' size',
+        os.path.getsize(sdb_path)))
+
+    sdb = SearchDB(sdb_path)
+    end_address = line_rows[-1][0]
+    measure(name + ' all_lines',lambda:len(list(sdb.all_lines())))
+    measure(name + ' lines_in_range',
+        lambda:len(list(sdb.lines_in_range(BASE_ADDRESS,
+            (BASE_ADDRESS + end_address) // 2))))
+    measure(name + ' lines_text',lambda:len(list(sdb.lines_text('var_1'))))
+    measure(name + ' lines_data',
+        lambda:len(list(sdb.lines_data('\x8b\x85'))))
+    sdb.close()
+
+
+def main():
+    num_lines = 500000
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    line_rows = gen_line_rows(num_lines)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        hex_path = os.path.join(tmp_dir,'hex.sdb')
+        raw_path = os.path.join(tmp_dir,'raw.sdb')
+        gen_hex_sdb(hex_path,line_rows,[],[])
+        gen_raw_sdb(raw_path,line_rows)
+
+        bench_sdb('hex',hex_path,line_rows)
+        bench_sdb('raw',raw_path,line_rows)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Synthetic sdb contents and timing, shared by the benchmarks.
+"""
+import time
+
+from idsearch.types import LineTypes, XrefTypes
+
+BASE_ADDRESS = 0x400000
+
+# Size in lines of every synthetic function:
+FUNC_SIZE = 0x40
+
+MNEMONICS = ['mov','lea','call','push','pop','add','sub','cmp','jz','xor']
+
+def gen_line_rows(num_lines,data_every=16):
+    """
+    Generate synthetic line rows. Every data_every line is data.
+    """
+    for i in xrange(num_lines):
+        line_type = LineTypes.DATA if i % data_every == 0 else LineTypes.CODE
+        yield (BASE_ADDRESS + i*4, line_type,
+                '{} eax, [ebp+var_{:x}]'.format(MNEMONICS[i % len(MNEMONICS)],
+                    i & 0xff),
+                '\x8b\x45' + chr(i & 0xff) + '\x90')
+
+def gen_xref_rows(num_lines,code_flow=False):
+    """
+    Generate synthetic jump xref rows. If code_flow is True, also generate
+    code flow xref rows between consecutive lines.
+    """
+    for i in xrange(num_lines):
+        if code_flow and (i < num_lines - 1):
+            yield (XrefTypes.CODE_FLOW, BASE_ADDRESS + i*4,
+                    BASE_ADDRESS + (i + 1)*4)
+        if i % 8 == 0:
+            yield (XrefTypes.CODE_JUMP, BASE_ADDRESS + i*4,
+                    BASE_ADDRESS + ((i * 7919) % num_lines) * 4)
+
+def gen_func_rows(num_lines):
+    """
+    Generate synthetic function rows.
+    """
+    for i in xrange(0,num_lines,FUNC_SIZE):
+        start = BASE_ADDRESS + i*4
+        yield (start,'sub_{:X}'.format(start),[(start,start + FUNC_SIZE*4)])
+
+
+def measure(name,func):
+    """
+    Measure the time of one function call. func may return the amount of
+    its results.
+    """
+    start = time.time()
+    res = func()
+    elapsed = time.time() - start
+    if res is None:
+        print('{:<40} {:>10.3f} sec'.format(name,elapsed))
+        return
+    print('{:<40} {:>10.3f} sec {:>8} results'.format(name,elapsed,res))
@@ -3,7 +3,10 @@ from idsearch.idb_util import gen_sdb as _gen_sdb, \
         gen_sdb_path as _gen_sdb_path
 from idsearch.exceptions import IDBUtilError as _IDBUtilError
 from idsearch.searcher import load_sdb as _load_sdb, print_lines
-from idsearch.types import LineTypes, XrefTypes
+from idsearch.types import LineTypes, XrefTypes, OperandTypes
+from idsearch.line_query import line_type_is, address_in_range, in_function, \
+        has_xrefs_from, has_xrefs_to, text_contains, text_tokens, \
+        data_contains, text_regex, mnemonic_is, has_immediate, has_operand
 
 # Generate sdb if non existent:
 try:
@@ -11,11 +14,19 @@ try:
 except _IDBUtilError:
     pass
 
-def load_this_sdb():
+def load_this_sdb(query_builder=False):
     """
     Load the idsearch index for this IDB.
+    If query_builder is True, searches can be filtered and combined in sql.
     """
     idb_path = idaapi.cvar.database_idb
     sdb_path = _gen_sdb_path(idb_path)
-    return _load_sdb(sdb_path)
+    return _load_sdb(sdb_path,query_builder=query_builder)
 
+
+def update_this_sdb():
+    """
+    Update the idsearch index for this IDB, after the IDB was changed.
+    Only the changed parts of the index are rewritten.
+    """
+    _gen_sdb(incremental=True)
@@ -0,0 +1,286 @@
+"""
+Batch indexer (Works from outside IDA).
+Indexes many IDBs using a bounded pool of headless IDA processes.
+Run as follows:
+
+python -m idsearch.batch_index --ida "...\path\to\idaq.exe" <idb_or_dir> ...
+
+Progress and failures are kept in a manifest file, so that an interrupted
+batch can be continued. IDBs whose sdb is up to date are skipped.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import subprocess
+
+from .exceptions import BatchIndexError
+from .partial_sdb import is_sdb_partial
+
+logger = logging.getLogger(__name__)
+
+# Extensions of IDB files:
+IDB_EXTENSIONS = ['.idb','.i64']
+
+# The script that IDA runs to index one IDB:
+STANDALONE_SCRIPT = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'standalone_index.py')
+
+DEFAULT_MANIFEST_NAME = 'idsearch_manifest.json'
+
+class IndexStatus(object):
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+def gen_sdb_path(idb_path):
+    """
+    If idb is c:\\temp\\my_proj.idb, the sdb will be c:\\temp\\my_proj.sdb
+    (Same as idb_util.gen_sdb_path, which can only be imported inside IDA)
+    """
+    # Change the last .idb to .sdb:
+    return '.'.join(idb_path.split('.')[:-1] + ['sdb'])
+
+
+def get_idb_stamp(idb_path):
+    """
+    Get the size and the modification time of an IDB, as kept in the manifest.
+    """
+    stat = os.stat(idb_path)
+    return {'idb_size':stat.st_size,'idb_mtime':stat.st_mtime}
+
+
+def find_idbs(paths):
+    """
+    Find all IDBs in a list of paths. Every path is an IDB file or a
+    directory that is searched recursively.
+    """
+    idb_paths = []
+    for path in paths:
+        if not os.path.isdir(path):
+            idb_paths.append(os.path.abspath(path))
+            continue
+
+        for dir_path,dir_names,file_names in os.walk(path):
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1].lower() in IDB_EXTENSIONS:
+                    idb_paths.append(
+                            os.path.abspath(os.path.join(dir_path,file_name)))
+
+    return idb_paths
+
+
+class CommandLauncher(object):
+    """
+    Launches a worker process that indexes one IDB.
+    The IDB path is appended to a command prefix.
+    Any object with a launch(idb_path) method that returns a subprocess.Popen
+    like object can be used as a launcher.
+    """
+    def __init__(self,command_prefix):
+        self._command_prefix = list(command_prefix)
+
+    def command(self,idb_path):
+        return self._command_prefix + [idb_path]
+
+    def launch(self,idb_path):
+        with open(os.devnull,'wb') as devnull:
+            return subprocess.Popen(self.command(idb_path),
+                    stdout=devnull,stderr=devnull)
+
+
+def ida_launcher(ida_path,script_path=STANDALONE_SCRIPT):
+    """
+    Get a launcher that runs headless IDA with the standalone indexer.
+    """
+    # The script path is quoted, as IDA splits the -S switch on spaces:
+    return CommandLauncher([ida_path,'-A','-S"{}"'.format(script_path)])
+
+
+class Manifest(object):
+    """
+    Keeps the indexing status of every IDB in a json file.
+    """
+    def __init__(self,manifest_path):
+        self._manifest_path = manifest_path
+        # Entries by idb path. Every entry is a dictionary with the keys
+        # status, attempts and error. Entries of indexed IDBs also keep the
+        # stamp of the IDB (See get_idb_stamp):
+        self._entries = {}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path,'rb') as f:
+                self._entries = json.load(f)
+
+    def get_status(self,idb_path):
+        entry = self._entries.get(idb_path)
+        if entry is None:
+            return None
+        return entry['status']
+
+    def get_entry(self,idb_path):
+        return self._entries.get(idb_path)
+
+    def set_status(self,idb_path,status,error=None):
+        """
+        Set the status of an IDB, and save the manifest. When the IDB is
+        done, its current stamp is recorded.
+        """
+        entry = self._entries.setdefault(idb_path,
+                {'status':None,'attempts':0,'error':None})
+        if status == IndexStatus.RUNNING:
+            entry['attempts'] += 1
+        entry['status'] = status
+        entry['error'] = error
+        for key in get_idb_stamp(idb_path):
+            entry.pop(key,None)
+        if status == IndexStatus.DONE:
+            entry.update(get_idb_stamp(idb_path))
+        self.save()
+
+    def save(self):
+        """
+        Save the manifest. We first write a temporary file, so that the
+        manifest is never left half written.
+        """
+        tmp_path = self._manifest_path + '.tmp'
+        with open(tmp_path,'wb') as f:
+            json.dump(self._entries,f,indent=2,sort_keys=True)
+        if os.path.isfile(self._manifest_path):
+            os.remove(self._manifest_path)
+        os.rename(tmp_path,self._manifest_path)
+
+
+def is_sdb_up_to_date(idb_path,manifest):
+    """
+    Check if the sdb of an IDB exists, was fully generated and the IDB did
+    not change since.
+    """
+    sdb_path = gen_sdb_path(idb_path)
+    if (not os.path.isfile(sdb_path)) or is_sdb_partial(sdb_path):
+        return False
+
+    entry = manifest.get_entry(idb_path)
+    if entry is None:
+        # An sdb that was not generated by a batch:
+        return os.path.getmtime(sdb_path) >= os.path.getmtime(idb_path)
+
+    # An sdb of a failed or interrupted indexing might be partial:
+    if entry['status'] != IndexStatus.DONE:
+        return False
+
+    # IDA writes the IDB again when it exits, after the sdb was generated, so
+    # the IDB is compared to its stamp when it was done, and not to the sdb:
+    stamp = get_idb_stamp(idb_path)
+    return all(entry.get(key) == value for key,value in stamp.iteritems())
+
+
+def batch_index(idb_paths,launcher,manifest,max_workers=4,max_attempts=3,
+        timeout=None,poll_interval=0.5):
+    """
+    Index many IDBs, running at most max_workers workers at the same time.
+    Failed IDBs are retried up to max_attempts times. Workers that run longer
+    than timeout seconds are killed.
+    Returns a list of the IDBs that failed.
+    """
+    pending = []
+    for idb_path in idb_paths:
+        if is_sdb_up_to_date(idb_path,manifest):
+            logger.info('Skipping {}: sdb is up to date'.format(idb_path))
+            continue
+        pending.append(idb_path)
+
+    # Attempts in this batch, by idb path:
+    attempts = {}
+    # Running workers: idb path -> (process,start time):
+    running = {}
+    failed = []
+    num_total = len(pending)
+    num_finished = 0
+
+    while (len(pending) > 0) or (len(running) > 0):
+        # Launch new workers:
+        while (len(pending) > 0) and (len(running) < max_workers):
+            idb_path = pending.pop(0)
+            attempts[idb_path] = attempts.get(idb_path,0) + 1
+            manifest.set_status(idb_path,IndexStatus.RUNNING)
+            logger.info('Indexing {} (Attempt {})'.format(
+                idb_path,attempts[idb_path]))
+            running[idb_path] = (launcher.launch(idb_path),time.time())
+
+        time.sleep(poll_interval)
+
+        # Collect finished workers:
+        for idb_path,(process,start_time) in running.items():
+            error = None
+            if process.poll() is None:
+                if (timeout is None) or (time.time() - start_time < timeout):
+                    continue
+                process.kill()
+                process.wait()
+                error = 'Timeout after {} seconds'.format(timeout)
+            elif process.returncode != 0:
+                error = 'Exit code {}'.format(process.returncode)
+            elif not os.path.isfile(gen_sdb_path(idb_path)):
+                error = 'sdb was not created'
+            elif is_sdb_partial(gen_sdb_path(idb_path)):
+                error = 'sdb is partial'
+
+            del running[idb_path]
+
+            if error is None:
+                manifest.set_status(idb_path,IndexStatus.DONE)
+                num_finished += 1
+                logger.info('[{}/{}] Indexed {}'.format(
+                    num_finished,num_total,idb_path))
+                continue
+
+            manifest.set_status(idb_path,IndexStatus.FAILED,error)
+            if attempts[idb_path] < max_attempts:
+                logger.warning('Failed indexing {}: {}. Retrying.'.format(
+                    idb_path,error))
+                pending.append(idb_path)
+                continue
+
+            num_finished += 1
+            failed.append(idb_path)
+            logger.error('[{}/{}] Failed indexing {}: {}'.format(
+                num_finished,num_total,idb_path,error))
+
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Index many IDBs using headless IDA.')
+    parser.add_argument('paths',nargs='+',
+            help='IDB files, or directories to search for IDBs.')
+    parser.add_argument('--ida',required=True,
+            help='Path of the IDA executable (idaq.exe / idaq64.exe).')
+    parser.add_argument('--jobs',type=int,default=4,
+            help='Maximum amount of IDA processes at the same time.')
+    parser.add_argument('--attempts',type=int,default=3,
+            help='Maximum amount of attempts to index every IDB.')
+    parser.add_argument('--timeout',type=float,default=None,
+            help='Maximum seconds for indexing one IDB.')
+    parser.add_argument('--manifest',default=DEFAULT_MANIFEST_NAME,
+            help='Path of the manifest file.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s')
+
+    idb_paths = find_idbs(args.paths)
+    if len(idb_paths) == 0:
+        raise BatchIndexError('No IDBs were found.')
+
+    failed = batch_index(idb_paths,ida_launcher(args.ida),
+            Manifest(args.manifest),max_workers=args.jobs,
+            max_attempts=args.attempts,timeout=args.timeout)
+
+    return 1 if len(failed) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
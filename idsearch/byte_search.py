@@ -0,0 +1,196 @@
+import re
+import array
+import bisect
+import binascii
+import collections
+
+from .exceptions import SearchDBError
+
+# Search of byte patterns over the data of all the lines.
+# The data of consecutive lines is joined into contiguous runs of bytes, and
+# the runs are split into pages of at most DATA_PAGE_SIZE bytes. Every ngram
+# (NGRAM_SIZE consecutive bytes) has a posting list of the pages where it
+# starts. Pages that contain all the ngrams of a pattern are candidates, and
+# are verified using a regular expression.
+# Runs are cut at the starts and ends of segments, and the posting lists are
+# kept per chunk of pages inside one segment. The pages of a segment can then
+# be replaced without touching the others, and the posting lists are built
+# with bounded memory.
+
+NGRAM_SIZE = 3
+DATA_PAGE_SIZE = 0x1000
+
+# Maximum amount of pages in a chunk:
+DATA_CHUNK_PAGES = 0x100
+
+# Maximum amount of posting lists that are intersected for one pattern. The
+# rarest ngrams of the pattern are used:
+MAX_PATTERN_NGRAMS = 4
+
+def iter_data_runs(line_rows):
+    """
+    Join the data of consecutive lines. line_rows is an iterable of
+    (address,data) pairs, ordered by address.
+    Yields (address,data) pairs of contiguous runs of bytes.
+    """
+    run_address = None
+    run_end = None
+    run_parts = []
+    for address,data in line_rows:
+        if len(data) == 0:
+            continue
+        if address != run_end:
+            if len(run_parts) > 0:
+                yield (run_address,''.join(run_parts))
+            run_address = address
+            run_parts = []
+        run_parts.append(data)
+        run_end = address + len(data)
+
+    if len(run_parts) > 0:
+        yield (run_address,''.join(run_parts))
+
+def iter_region_runs(runs,boundaries):
+    """
+    Cut runs of bytes at boundary addresses (Like the starts and ends of
+    segments). runs is an iterable of (address,data) pairs, and boundaries
+    is a sorted list of addresses.
+    Yields (region,address,data) triples, where region is the amount of
+    boundaries at or before the address.
+    """
+    for address,data in runs:
+        while len(data) > 0:
+            region = bisect.bisect_right(boundaries,address)
+            size = len(data)
+            if region < len(boundaries):
+                size = min(size,boundaries[region] - address)
+            yield (region,address,data[:size])
+            address += size
+            data = data[size:]
+
+def iter_page_chunks(region_runs,first_page_id):
+    """
+    Split runs (See iter_region_runs) into pages, and group the pages into
+    chunks of at most DATA_CHUNK_PAGES pages of one region. Pages get
+    consecutive ids, starting from first_page_id.
+    Yields (page_rows,postings) for every chunk: page_rows is a list of
+    (page_id,address,data) triples, and postings is a dictionary: ngram ->
+    array of the ids of the pages of the chunk where it starts.
+    """
+    page_id = first_page_id
+    page_rows = []
+    postings = collections.defaultdict(lambda:array.array('I'))
+    chunk_region = None
+    for region,run_address,run_data in region_runs:
+        for offset in xrange(0,len(run_data),DATA_PAGE_SIZE):
+            if (len(page_rows) > 0) and ((region != chunk_region) or
+                    (len(page_rows) >= DATA_CHUNK_PAGES)):
+                yield (page_rows,postings)
+                page_rows = []
+                postings = collections.defaultdict(lambda:array.array('I'))
+            chunk_region = region
+            page_rows.append((page_id,run_address + offset,
+                run_data[offset:offset + DATA_PAGE_SIZE]))
+            for ngram in page_ngrams(run_data,offset):
+                postings[ngram].append(page_id)
+            page_id += 1
+
+    if len(page_rows) > 0:
+        yield (page_rows,postings)
+
+def ngram_key(ngram):
+    """
+    Get the integer key of an ngram.
+    """
+    return int(binascii.hexlify(ngram),16)
+
+def page_ngrams(run_data,offset):
+    """
+    Get the set of ngrams that start inside the page at a given offset of a
+    run. The last ngrams may end after the page.
+    """
+    end = min(offset + DATA_PAGE_SIZE,len(run_data) - NGRAM_SIZE + 1)
+    return set(run_data[i:i + NGRAM_SIZE] for i in xrange(offset,end))
+
+def pack_pages(page_ids):
+    """
+    Pack a posting list of page ids into a string.
+    """
+    return array.array('I',page_ids).tostring()
+
+def unpack_pages(pages_str):
+    """
+    Unpack a posting list of page ids.
+    """
+    page_ids = array.array('I')
+    page_ids.fromstring(str(pages_str))
+    return page_ids
+
+###########################################################################
+
+def _nibble_bytes(high,low):
+    """
+    Get all the byte values that match a byte token, where high and low are
+    hex digits or '?'.
+    """
+    highs = range(0x10) if high == '?' else [int(high,16)]
+    lows = range(0x10) if low == '?' else [int(low,16)]
+    return [(h << 4) | l for h in highs for l in lows]
+
+class BytePattern(object):
+    """
+    A parsed byte pattern, like 'E8 ?? ?? ?? ?? 85 C0'. Every byte is two hex
+    digits, any of which could be the wildcard '?'. Whitespace is ignored.
+    """
+    def __init__(self,pattern):
+        tokens = ''.join(pattern.split()).upper()
+        if (len(tokens) == 0) or (len(tokens) % 2 != 0) or \
+                (re.match('^[0-9A-F?]*$',tokens) is None):
+            raise SearchDBError('Invalid byte pattern: {!r}'.format(pattern))
+
+        regex_parts = []
+        # Exact bytes, or None for bytes with wildcards:
+        exact = []
+        for i in xrange(0,len(tokens),2):
+            values = _nibble_bytes(tokens[i],tokens[i + 1])
+            if len(values) == 1:
+                exact.append(chr(values[0]))
+                regex_parts.append('\\x{:02x}'.format(values[0]))
+            elif len(values) == 0x100:
+                exact.append(None)
+                regex_parts.append('.')
+            else:
+                exact.append(None)
+                regex_parts.append('[{}]'.format(''.join(
+                    '\\x{:02x}'.format(value) for value in values)))
+
+        self.size = len(exact)
+        # A lookahead finds overlapping matches too:
+        self.regex = re.compile('(?=' + ''.join(regex_parts) + ')',re.DOTALL)
+        self.ngrams = []
+        for offset in xrange(self.size - NGRAM_SIZE + 1):
+            ngram = exact[offset:offset + NGRAM_SIZE]
+            if None not in ngram:
+                self.ngrams.append((offset,ngram_key(''.join(ngram))))
+
+    def start_pages(self,offset,page_ids):
+        """
+        Get the ids of the pages where a match could start, given the pages
+        of the ngram at some offset of the pattern. Pages of the same run
+        have consecutive ids.
+        """
+        deltas = set([offset // DATA_PAGE_SIZE,
+            (offset + DATA_PAGE_SIZE - 1) // DATA_PAGE_SIZE])
+        return set(page_id - delta for page_id in page_ids
+                for delta in deltas)
+
+    def find(self,page_address,page_data,next_data):
+        """
+        Get the addresses of the matches that start inside a page.
+        next_data is the data that follows the page in its run (At least
+        size - 1 bytes, if the run is long enough).
+        """
+        data = page_data + next_data[:self.size - 1]
+        return [page_address + match.start()
+                for match in self.regex.finditer(data)
+                if match.start() < len(page_data)]
@@ -3,3 +3,4 @@ class SetupError(IDSearchError): pass
 class GenDBError(IDSearchError): pass
 class SearchDBError(IDSearchError): pass
 class IDBUtilError(IDSearchError): pass
+class BatchIndexError(IDSearchError): pass
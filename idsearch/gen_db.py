@@ -1,14 +1,97 @@
 import logging
 import os
-from functools import wraps
 from .usqlite3 import sqlite3
 from .exceptions import GenDBError
-from .types import XrefTypes, LineTypes, data_to_hex, hex_to_data
+from .partial_sdb import gen_partial_path, is_sdb_partial
+from .types import XrefTypes, LineTypes, SDBVersions, data_to_hex, \
+        int_to_sdb
+from .line_query import STARTS_BLOCK_SQL, ENDS_BLOCK_SQL, block_sql
+from . import byte_search
+from . import segment_image
 
 logger = logging.getLogger(__name__)
 
-# Amount of operations in one batch.
-BATCH_OPERS = 1024
+# Amount of buffered rows that are inserted together in one transaction.
+BATCH_OPERS = 0x10000
+
+# Insertion queries. Rows are buffered per query, and flushed together using
+# executemany:
+INSERT_LINE = """INSERT INTO lines
+    (address,type,line_text,line_data) VALUES (?, ?, ?, ?)"""
+INSERT_XREF = """INSERT INTO xrefs (xref_type,line_from,line_to)
+    VALUES (?, ?, ?)"""
+INSERT_FUNC = """INSERT INTO funcs (address,name) VALUES (?, ?)"""
+INSERT_FUNC_CHUNK = """INSERT INTO funcs_chunks (func,start_address,end_address)
+    VALUES (?, ?, ?)"""
+INSERT_SEGMENT = """INSERT OR REPLACE INTO segments
+    (start_address,end_address,checksum) VALUES (?, ?, ?)"""
+INSERT_BLOCK = """INSERT INTO blocks (start_address,end_address)
+    VALUES (?, ?)"""
+INSERT_DATA_PAGE = """INSERT INTO data_pages (id,address,data)
+    VALUES (?, ?, ?)"""
+INSERT_DATA_NGRAM = """INSERT INTO data_ngrams (ngram,chunk,pages)
+    VALUES (?, ?, ?)"""
+INSERT_INSTRUCTION = """INSERT INTO instructions
+    (address,mnemonic,num_operands) VALUES (?, ?, ?)"""
+INSERT_OPERAND = """INSERT INTO operands (line,op_index,type,text,value)
+    VALUES (?, ?, ?, ?, ?)"""
+
+# Order of flushing the buffers:
+INSERT_QUERIES = [INSERT_LINE, INSERT_XREF, INSERT_FUNC, INSERT_FUNC_CHUNK,
+        INSERT_SEGMENT, INSERT_INSTRUCTION, INSERT_OPERAND]
+
+# Pragmas of the connection while updating an existing sdb. An update is
+# made of many transactions, so a journal would not keep the sdb consistent
+# anyway: An interrupted update leaves the partial marker of the sdb behind
+# (See partial_sdb), and the sdb is then generated again from scratch.
+# This lets us give up on durability for speed:
+GEN_PRAGMAS = [
+    ('journal_mode','MEMORY'),
+    ('synchronous','OFF'),
+    # Negative size is in KiB:
+    ('cache_size',-0x10000),
+]
+
+# Pragmas of the connection while generating a new sdb. This is a throwaway
+# bulk load: If it fails, the sdb is generated again from scratch. Without a
+# journal a failed transaction can not be rolled back.
+BULK_PRAGMAS = [
+    # Must be set before any table is created:
+    ('page_size',0x2000),
+    ('journal_mode','OFF'),
+    ('synchronous','OFF'),
+    ('cache_size',-0x40000),
+    ('locking_mode','EXCLUSIVE'),
+    ('temp_store','MEMORY'),
+]
+
+# Default sqlite behaviour:
+SAFE_PRAGMAS = []
+
+# Amount of fts index pages that are merged by an update of an sdb (See
+# SDBGen.merge):
+FTS_MERGE_PAGES = 0x100
+
+# Names of the fts tables of the lines table:
+LINES_FTS_TABLES = ['lines_text_fts','lines_text_tokens_fts','lines_data_fts']
+
+def sql_data_to_hex(data):
+    """
+    data_to_hex for use inside sql queries. Blobs are given as buffers.
+    """
+    if isinstance(data,buffer):
+        data = str(data)
+    return data_to_hex(data)
+
+def get_sdb_version(sdb_path):
+    """
+    Get the version of an existing sdb.
+    """
+    conn = sqlite3.connect(sdb_path)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
 
 def get_enum_opts(enum):
     """
@@ -21,45 +104,73 @@ def get_enum_opts(enum):
     return opts
 
 
-def sdb_oper(f):
-    """
-    Decorator for sdb insertion operation.
-    Allows to easily batch insertions for better performance.
-    """
-    @wraps(f)
-    def wrapper(self,*args,**kwargs):
-        f(self,*args,**kwargs)
-        self._pending_opers += 1
-        if self._pending_opers >= self._batch_opers:
-            self._pending_opers = 0
-            self._commit_transaction()
-            self._begin_transaction()
-
-    return wrapper
-
-
 class SDBGen(object):
-    def __init__(self,sdb_path,batch_opers=BATCH_OPERS):
+    def __init__(self,sdb_path,batch_opers=BATCH_OPERS,update=False,
+            pragmas=None,defer_indexes=True):
+        """
+        Generate a new sdb at sdb_path. If update is True, an existing sdb is
+        opened for updating instead.
+        pragmas is a list of (name,value) pairs, set on the connection. By
+        default BULK_PRAGMAS are used for a new sdb, and GEN_PRAGMAS for an
+        update.
+        If defer_indexes is True, the indexes of a new sdb are only created
+        after all the rows were inserted (See create_indexes).
+        """
         self._sdb_path = sdb_path
-        # Amount of pending operations (To be commited)
+        # Buffered rows for every insertion query (To be commited):
+        self._buffers = {query:[] for query in INSERT_QUERIES}
+        # Amount of rows currently buffered:
         self._pending_opers = 0
-        # Maximum amount of operations in one batch:
+        # Maximum amount of buffered rows before a flush:
         self._batch_opers = batch_opers
         # Are we currently inside a transaction?
         self._inside_transaction = False
-
-        if sdb_path != ':memory:':
+        # Were the indexes created? An existing sdb already has them:
+        self._indexes_created = update
+
+        if pragmas is None:
+            pragmas = GEN_PRAGMAS if update else BULK_PRAGMAS
+
+        if update:
+            if not os.path.isfile(sdb_path):
+                raise GenDBError('File does not exist. Aborting.')
+            if is_sdb_partial(sdb_path):
+                raise GenDBError('Can not update a partial sdb')
+            version = get_sdb_version(sdb_path)
+            if version != SDBVersions.CURRENT:
+                raise GenDBError('Can not update sdb of version {}'\
+                        .format(version))
+
+        elif sdb_path != ':memory:':
             if os.path.isfile(sdb_path):
                 raise GenDBError('File already exists. Aborting.')
 
+        # Mark the sdb as partial until it is closed:
+        self._partial_path = None
+        if sdb_path != ':memory:':
+            self._partial_path = gen_partial_path(sdb_path)
+            open(self._partial_path,'wb').close()
+
         self._conn = sqlite3.connect(self._sdb_path,isolation_level=None)
+        self._conn.create_function('data_to_hex',1,sql_data_to_hex)
+        # Line text is plain ascii, we don't want to decode it to unicode:
+        self._conn.text_factory = str
 
-        self._create_enum_tables()
-        self._create_main_tables()
-        self._create_indexes()
+        for name,value in pragmas:
+            self._conn.execute('PRAGMA {} = {}'.format(name,value))
+
+        if not update:
+            self._conn.execute('PRAGMA user_version = {}'.format(
+                SDBVersions.CURRENT))
+
+            self._create_enum_tables()
+            self._create_main_tables()
 
         self._begin_transaction()
 
+        if not defer_indexes:
+            self.create_indexes()
+
     def _create_enum_tables(self):
         """
         Create enum tables: line_types and xref_types
@@ -100,24 +211,37 @@ class SDBGen(object):
         self._conn.execute("""CREATE TABLE lines (
             address INTEGER PRIMARY KEY,
             type REFERENCES line_types(id),
-            line_text_hex TEXT NOT NULL,
-            line_data_hex TEXT NOT NULL)""")
+            line_text TEXT NOT NULL,
+            line_data BLOB NOT NULL)""")
+
+        # The hex forms of the line text and data are not stored. They are
+        # calculated by this view, which is the external content of the hex
+        # fts tables. This allows deleting rows from the fts tables, which is
+        # impossible for contentless fts tables:
+        self._conn.execute("""CREATE VIEW lines_hex AS SELECT
+            address AS rowid,
+            data_to_hex(line_text) AS line_text_hex,
+            data_to_hex(line_data) AS line_data_hex
+            FROM lines""")
 
         # Create External content table:
         # See 6.2.2 in sqlite fts3.html documentation.
         self._conn.execute("""CREATE VIRTUAL TABLE lines_text_fts USING fts4(
-            content="lines",  line_text_hex)""")
+            content="lines_hex",  line_text_hex)""")
 
         self._conn.execute("""CREATE VIRTUAL TABLE lines_text_tokens_fts USING fts4(
             content="lines",  line_text)""")
 
         self._conn.execute("""CREATE VIRTUAL TABLE lines_data_fts USING fts4(
-            content="lines", line_data_hex)""")
+            content="lines_hex", line_data_hex)""")
 
-        self._conn.execute("""CREATE TABLE funcs_lines (
+        # Every function is made of one or more chunks. A chunk is a range of
+        # addresses: start_address inclusive, end_address exclusive.
+        self._conn.execute("""CREATE TABLE funcs_chunks (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            line REFERENCES lines(address),
-            func REFERENCES funcs(address))""")
+            func REFERENCES funcs(address),
+            start_address INTEGER NOT NULL,
+            end_address INTEGER NOT NULL)""")
 
         self._conn.execute("""CREATE TABLE xrefs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -125,24 +249,89 @@ class SDBGen(object):
             line_from REFERENCES lines(id),
             line_to REFERENCES lines(id))""")
 
-    def _create_indexes(self):
+        # Checksums of the lines and xrefs of every segment in the IDB. Allows
+        # to find the segments that changed since the sdb was generated.
+        self._conn.execute("""CREATE TABLE segments (
+            start_address INTEGER PRIMARY KEY,
+            end_address INTEGER NOT NULL,
+            checksum TEXT NOT NULL)""")
+
+        # Basic blocks of code lines, derived from the xrefs (See
+        # fill_blocks). start_address inclusive, end_address exclusive.
+        self._conn.execute("""CREATE TABLE blocks (
+            start_address INTEGER PRIMARY KEY,
+            end_address INTEGER NOT NULL)""")
+
+        # The data of the lines, joined into contiguous runs and split into
+        # pages. Pages of the same run have consecutive ids (See
+        # byte_search):
+        self._conn.execute("""CREATE TABLE data_pages (
+            id INTEGER PRIMARY KEY,
+            address INTEGER NOT NULL,
+            data BLOB NOT NULL)""")
+
+        # Posting lists of the data pages where every ngram starts, for every
+        # chunk of pages. pages is a packed array of page ids, and chunk is
+        # the id of the first page of the chunk:
+        self._conn.execute("""CREATE TABLE data_ngrams (
+            ngram INTEGER NOT NULL,
+            chunk INTEGER NOT NULL,
+            pages BLOB NOT NULL)""")
+
+        # The instructions of the code lines. Mnemonics are lowercase:
+        self._conn.execute("""CREATE TABLE instructions (
+            address INTEGER PRIMARY KEY,
+            mnemonic TEXT NOT NULL,
+            num_operands INTEGER NOT NULL)""")
+
+        # The operands of every instruction, by their index in it. type is
+        # one of OperandTypes:
+        self._conn.execute("""CREATE TABLE operands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            line INTEGER NOT NULL,
+            op_index INTEGER NOT NULL,
+            type INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            value INTEGER NOT NULL)""")
+
+    def create_indexes(self):
         """
-        Create search relevant search indexes.
+        Create search relevant search indexes, if they were not created yet.
+        Creating the indexes once after a bulk load is faster than updating
+        them on every insertion. Called by optimize and close.
         """
+        if self._indexes_created:
+            return
+        self._indexes_created = True
+        # Pending insertions must be done before creating the indexes:
+        self.flush()
+
         self._conn.execute('CREATE INDEX index_line_from ON xrefs(line_from)')
         self._conn.execute('CREATE INDEX index_line_to ON xrefs(line_to)')
-        self._conn.execute('CREATE INDEX index_line_address ON '
-            'funcs_lines(line)')
+        self._conn.execute('CREATE INDEX index_chunk_range ON '
+            'funcs_chunks(start_address,end_address)')
         self._conn.execute('CREATE INDEX index_func_address ON '
-            'funcs_lines(func)')
+            'funcs_chunks(func)')
+        self._conn.execute('CREATE INDEX index_mnemonic ON '
+            'instructions(mnemonic)')
+        self._conn.execute('CREATE INDEX index_operand_line ON '
+            'operands(line)')
+        self._conn.execute('CREATE INDEX index_operand_value ON '
+            'operands(value,type)')
+
+        # Rows that were inserted before the unique indexes existed might be
+        # duplicated. We keep the first of them:
+        self._conn.execute("""DELETE FROM xrefs WHERE id NOT IN (
+            SELECT MIN(id) FROM xrefs GROUP BY xref_type,line_from,line_to)""")
+        self._conn.execute("""DELETE FROM funcs_chunks WHERE id NOT IN (
+            SELECT MIN(id) FROM funcs_chunks GROUP BY func,start_address)""")
 
         # Avoid duplication of rows in xrefs:
         self._conn.execute('CREATE UNIQUE INDEX index_xrefs ON '
             'xrefs(xref_type,line_from,line_to)')
-        # Avoid duplication of rows in line_func:
-        self._conn.execute('CREATE UNIQUE INDEX line_func ON '
-            'funcs_lines(line,func)')
-
+        # Avoid duplication of rows in funcs_chunks:
+        self._conn.execute('CREATE UNIQUE INDEX func_chunk ON '
+            'funcs_chunks(func,start_address)')
 
     def _begin_transaction(self):
         """
@@ -169,73 +358,502 @@ class SDBGen(object):
             self._conn.execute('ROLLBACK')
             raise GenDBError('Failed to commit transaction')
 
-    @sdb_oper
-    def add_line(self,addr,line_type,line_text,line_data):
+    def _buffer_rows(self,query,rows):
         """
-        Returns line id
+        Buffer rows for insertion using a given query.
+        Buffers are flushed whenever they grow beyond the batch size.
         """
-        # Convert line data to hex:
-        line_data_hex = data_to_hex(line_data)
-        line_text_hex = data_to_hex(line_text)
+        buf = self._buffers[query]
+        for row in rows:
+            buf.append(row)
+            self._pending_opers += 1
+            if self._pending_opers >= self._batch_opers:
+                self.flush()
 
-        self._conn.execute("""INSERT INTO lines 
-            (address,type,line_text_hex,line_data_hex) VALUES
-            (?, ?, ?, ?)""",(addr,line_type,line_text_hex,line_data_hex,))
+    def flush(self):
+        """
+        Insert all the buffered rows into the database, and commit.
+        """
+        for query in INSERT_QUERIES:
+            buf = self._buffers[query]
+            if len(buf) == 0:
+                continue
+            self._conn.executemany(query,buf)
+            del buf[:]
 
-    @sdb_oper
-    def add_xref(self,xref_type,line_from,line_to):
+        self._pending_opers = 0
+        self._commit_transaction()
+        self._begin_transaction()
+
+    def add_lines(self,lines):
         """
-        Returns xref id
+        Add many lines. lines is an iterable of
+        (addr,line_type,line_text,line_data) tuples.
         """
-        self._conn.execute("""INSERT INTO xrefs (xref_type,line_from,line_to)
-            VALUES (?, ?, ?)""",(xref_type,line_from,line_to,))
+        self._buffer_rows(INSERT_LINE,
+            ((addr,line_type,line_text,buffer(line_data))
+                for addr,line_type,line_text,line_data in lines))
 
-    @sdb_oper
-    def add_function(self,address,name,line_addresses):
+    def add_xrefs(self,xrefs):
         """
-        Add a function. line_addresses are the addresses of all the lines that
-        belong to the function.
+        Add many xrefs. xrefs is an iterable of
+        (xref_type,line_from,line_to) tuples.
         """
-        # Insert function:
-        self._conn.execute("""INSERT INTO funcs (address,name)
-            VALUES (?, ?)""",(address,name,))
+        self._buffer_rows(INSERT_XREF,xrefs)
 
-        # Insert all func_line connections:
-        for line_addr in line_addresses:
-            self._conn.execute("""INSERT INTO funcs_lines (line,func)
-                VALUES (?, ?)""",(line_addr,address,))
+    def add_functions(self,functions):
+        """
+        Add many functions. functions is an iterable of
+        (address,name,chunks) tuples.
+        """
+        for address,name,chunks in functions:
+            self._buffer_rows(INSERT_FUNC,[(address,name)])
+            self._buffer_rows(INSERT_FUNC_CHUNK,
+                ((address,start,end) for start,end in chunks))
 
-    def fill_lines_fts(self):
+    def add_instructions(self,instructions):
+        """
+        Add the instructions of many code lines. instructions is an iterable
+        of (address,mnemonic,operands) tuples, where operands is a list of
+        (op_type,text,value) tuples.
+        """
+        for address,mnemonic,operands in instructions:
+            self._buffer_rows(INSERT_INSTRUCTION,
+                    [(address,mnemonic.lower(),len(operands))])
+            self._buffer_rows(INSERT_OPERAND,
+                ((address,op_index,op_type,text,int_to_sdb(value))
+                    for op_index,(op_type,text,value) in enumerate(operands)))
+
+    def add_segments(self,segments):
+        """
+        Add many segments. segments is an iterable of
+        (start_address,end_address,checksum) tuples. Existing segments with
+        the same start_address are replaced.
+        """
+        self._buffer_rows(INSERT_SEGMENT,segments)
+
+    def add_line(self,addr,line_type,line_text,line_data):
+        """
+        Add a line.
+        """
+        self.add_lines([(addr,line_type,line_text,line_data)])
+
+    def add_xref(self,xref_type,line_from,line_to):
+        """
+        Add an xref.
+        """
+        self.add_xrefs([(xref_type,line_from,line_to)])
+
+    def add_function(self,address,name,chunks):
+        """
+        Add a function. chunks is a list of (start_address,end_address) pairs
+        of all the address ranges that belong to the function. start_address
+        is inclusive and end_address is exclusive.
+        """
+        self.add_functions([(address,name,chunks)])
+
+    def fill_lines_fts(self,addresses=None):
         """
         Fill in the fts index for the lines table.
         Should be called after no more insertions are expected.
+        If addresses is given, only the lines at those addresses are added to
+        the fts index. This is used when updating an existing sdb.
         """
+        self.flush()
+
+        # The three fts tables are filled inside sqlite, in one transaction.
+        # Text is never passed through python:
+        fill_queries = ["""INSERT INTO lines_text_fts(
+            docid,line_text_hex) SELECT
+            rowid, line_text_hex FROM lines_hex""",
+            """INSERT INTO lines_text_tokens_fts(
+            rowid,line_text) SELECT
+            address, line_text FROM lines""",
+            """INSERT INTO lines_data_fts(
+            docid,line_data_hex) SELECT
+            rowid, line_data_hex FROM lines_hex"""]
+
+        if addresses is None:
+            for query in fill_queries:
+                self._conn.execute(query)
+        else:
+            addr_rows = [(addr,) for addr in addresses]
+            for query,addr_column in zip(fill_queries,
+                    ['rowid','address','rowid']):
+                self._conn.executemany('{} WHERE {} = ?'.format(
+                    query,addr_column),addr_rows)
+
         self._commit_transaction()
+        self._begin_transaction()
 
-        self._conn.execute("""INSERT INTO lines_text_fts(
-            rowid,line_text_hex) SELECT 
-            address, line_text_hex FROM lines""")
+    def _block_range(self,start_address,end_address):
+        """
+        Extend a range of addresses to all the blocks that could change with
+        the lines inside it: From the block that starts before it (The first
+        lines of the range may join it), up to the end of the first block
+        that starts at its end or after it.
+        """
+        low = self._conn.execute("""SELECT MAX(start_address) FROM blocks
+            WHERE start_address < ?""",(start_address,)).fetchone()[0]
+        if low is None:
+            low = start_address
+
+        row = self._conn.execute("""SELECT end_address FROM blocks
+            WHERE start_address >= ? ORDER BY start_address LIMIT 1""",
+            (end_address,)).fetchone()
+        if row is not None:
+            return (low,row[0])
+        # The last block may continue after the range:
+        high = self._conn.execute("""SELECT MAX(end_address) FROM blocks
+            WHERE start_address < ?""",(end_address,)).fetchone()[0]
+        return (low,max(end_address,high))
+
+    def fill_blocks(self,ranges=None):
+        """
+        Fill in the blocks table from the code lines and xrefs. Should be
+        called after no more insertions are expected, including functions: A
+        jump to the start of a function is a call, and does not end a block.
+        If ranges is None, all the blocks are replaced. Otherwise, only the
+        blocks around the given (start_address,end_address) ranges (end_address
+        exclusive) are replaced. The ranges should contain every line that
+        changed, and every line whose xrefs to it changed.
+        """
+        self.create_indexes()
+        self.flush()
+
+        if ranges is None:
+            self._conn.execute('DELETE FROM blocks')
+            self._insert_blocks(None,None)
+        else:
+            # Merge the ranges of blocks, so that every block is derived once:
+            block_ranges = sorted(self._block_range(start_address,end_address)
+                    for start_address,end_address in ranges)
+            merged = []
+            for low,high in block_ranges:
+                if (len(merged) > 0) and (low <= merged[-1][1]):
+                    merged[-1][1] = max(merged[-1][1],high)
+                else:
+                    merged.append([low,high])
+
+            for low,high in merged:
+                self._conn.execute("""DELETE FROM blocks
+                    WHERE start_address >= ? AND start_address < ?""",
+                    (low,high))
+                self._insert_blocks(low,high)
 
-        rows = self._conn.execute(
-            """SELECT address,line_text_hex FROM lines""")
+        self._commit_transaction()
+        self._begin_transaction()
 
-        # Converting all hexified line text back to the real text, to allow
-        # quick token based fts search:
+    def _insert_blocks(self,start_address,end_address):
+        """
+        Derive the blocks of the code lines in a range of addresses
+        (end_address exclusive), or of all the code lines if the range is
+        None. The first line of the range starts a block.
+        """
+        range_sql = ''
+        range_params = ()
+        if start_address is not None:
+            range_sql = 'AND address >= ? AND address < ?'
+            range_params = (start_address,end_address)
+
+        # Block boundaries are the same as in line_query.in_code_flow_block.
+        # The unary + removes the affinity of lines.address (See
+        # line_query.has_xrefs_to):
+        rows = self._conn.execute("""SELECT address, length(line_data),
+            {starts}, {ends},
+            (SELECT line_to FROM xrefs WHERE line_from = +lines.address AND
+            xref_type = ?)
+            FROM lines WHERE type = ? {range_sql} ORDER BY address""".format(
+                starts=block_sql(STARTS_BLOCK_SQL,'+lines.address'),
+                ends=block_sql(ENDS_BLOCK_SQL,'+lines.address'),
+                range_sql=range_sql),
+            (XrefTypes.CODE_FLOW,LineTypes.CODE) + range_params)
+
+        blocks = []
+        start = None
+        for address,size,starts_block,ends_block,flow_to in rows:
+            # A line continues the block of the previous code line only if
+            # it is the single flow target of that line:
+            if (start is not None) and \
+                    (starts_block or prev_ends or (prev_flow_to != address)):
+                blocks.append((start,prev_end))
+                start = None
+            if start is None:
+                start = address
+            prev_end = address + max(size,1)
+            prev_ends = ends_block
+            prev_flow_to = flow_to
+
+        if start is not None:
+            blocks.append((start,prev_end))
+
+        self._conn.executemany(INSERT_BLOCK,blocks)
+
+    def fill_data_pages(self,ranges=None):
+        """
+        Fill in the data pages and their ngram index, from the data of the
+        lines. Pages are cut at the starts and ends of segments.
+        If ranges is None, all the pages are replaced. Otherwise, only the
+        pages inside the given (start_address,end_address) ranges (end_address
+        exclusive) are replaced. The ranges must not cut segments.
+        Should be called after no more insertions are expected.
+        """
+        self.flush()
+        if ranges is None:
+            self._conn.execute('DELETE FROM data_pages')
+            self._conn.execute('DELETE FROM data_ngrams')
+            # The indexes are created again after the insertion:
+            for index_name in ['index_data_ngram','index_data_chunk',
+                    'index_data_page_address']:
+                self._conn.execute('DROP INDEX IF EXISTS {}'.format(
+                    index_name))
+            ranges = [None]
+        else:
+            # The chunks inside a range start with a page inside it:
+            for start_address,end_address in ranges:
+                self._conn.execute("""DELETE FROM data_ngrams WHERE chunk IN
+                    (SELECT id FROM data_pages
+                    WHERE address >= ? AND address < ?)""",
+                    (start_address,end_address))
+                self._conn.execute("""DELETE FROM data_pages
+                    WHERE address >= ? AND address < ?""",
+                    (start_address,end_address))
+
+        boundaries = sorted(set(address for row in self._conn.execute(
+            'SELECT start_address,end_address FROM segments')
+            for address in row))
+        page_id = self._conn.execute(
+                'SELECT COALESCE(MAX(id) + 1,0) FROM data_pages').fetchone()[0]
+
+        for address_range in ranges:
+            if address_range is None:
+                rows = self._conn.execute("""SELECT address,line_data
+                    FROM lines WHERE length(line_data) > 0
+                    ORDER BY address""")
+            else:
+                rows = self._conn.execute("""SELECT address,line_data
+                    FROM lines WHERE address >= ? AND address < ? AND
+                    length(line_data) > 0 ORDER BY address""",address_range)
+            runs = byte_search.iter_data_runs(
+                    (address,str(data)) for address,data in rows)
+
+            # Only one chunk of posting lists is kept in memory:
+            for page_rows,postings in byte_search.iter_page_chunks(
+                    byte_search.iter_region_runs(runs,boundaries),page_id):
+                chunk = page_rows[0][0]
+                self._conn.executemany(INSERT_DATA_PAGE,
+                        ((row_id,address,buffer(data))
+                            for row_id,address,data in page_rows))
+                self._conn.executemany(INSERT_DATA_NGRAM,
+                        ((byte_search.ngram_key(ngram),chunk,
+                            buffer(byte_search.pack_pages(page_ids)))
+                            for ngram,page_ids in postings.iteritems()))
+                page_id = page_rows[-1][0] + 1
+
+        # Indexes are created after the bulk insertion of a new sdb:
+        self._conn.execute("""CREATE INDEX IF NOT EXISTS index_data_ngram
+            ON data_ngrams(ngram)""")
+        self._conn.execute("""CREATE INDEX IF NOT EXISTS index_data_chunk
+            ON data_ngrams(chunk)""")
+        self._conn.execute("""CREATE INDEX IF NOT EXISTS
+            index_data_page_address ON data_pages(address)""")
+        self._commit_transaction()
         self._begin_transaction()
-        for row in rows:
-            self._conn.execute("""INSERT INTO lines_text_tokens_fts(
-                rowid,line_text) VALUES (?,?)""",(row[0],hex_to_data(row[1])))
+
+    def write_image(self,image_path):
+        """
+        Write a segment image of the sdb to image_path (See segment_image).
+        If the sdb has no segments, every contiguous run of data is a segment.
+        """
+        self.flush()
+        segments = [(row[0],row[1]) for row in self._conn.execute(
+            'SELECT start_address,end_address FROM segments')]
+        if len(segments) == 0:
+            rows = self._conn.execute("""SELECT address,line_data FROM lines
+                WHERE length(line_data) > 0 ORDER BY address""")
+            segments = [(address,address + len(data)) for address,data in
+                    byte_search.iter_data_runs(
+                        (address,str(data)) for address,data in rows)]
+
+        # Contiguous lines are written together:
+        rows = self._conn.execute("""SELECT address,line_data FROM lines
+            WHERE length(line_data) > 0 ORDER BY address""")
+        segment_image.write_image(image_path,segments,
+                byte_search.iter_data_runs(
+                    (address,str(data)) for address,data in rows))
+
+    ###################################################################
+    # Updating an existing sdb:
+
+    def get_segments(self):
+        """
+        Get all segments in the sdb.
+        Returns a dictionary: start_address -> (end_address,checksum)
+        """
+        rows = self._conn.execute("""SELECT start_address,end_address,checksum
+            FROM segments""")
+        return {row[0]:(row[1],row[2]) for row in rows}
+
+    def get_functions(self):
+        """
+        Get all functions in the sdb.
+        Returns a dictionary: address -> (name,chunks), where chunks is a
+        sorted list of (start_address,end_address) pairs.
+        """
+        functions = {}
+        for address,name in self._conn.execute(
+                'SELECT address,name FROM funcs'):
+            functions[address] = (name,[])
+
+        for func,start,end in self._conn.execute("""SELECT
+            func,start_address,end_address FROM funcs_chunks
+            ORDER BY func,start_address"""):
+            functions[func][1].append((start,end))
+
+        return functions
+
+    def get_jump_sources(self,addresses):
+        """
+        Get the addresses of the lines that jump to (Or call) any of the
+        given addresses.
+        """
+        sources = set()
+        for address in addresses:
+            sources.update(row[0] for row in self._conn.execute(
+                """SELECT line_from FROM xrefs
+                WHERE line_to = ? AND +xref_type = ?""",
+                (address,XrefTypes.CODE_JUMP)))
+        return sources
+
+    def iter_line_infos(self,start_address,end_address):
+        """
+        Iterate through all lines in a range of addresses (end_address
+        exclusive), ordered by address.
+        Yields (line_row,xref_rows) pairs, like idb_indexer.iter_line_infos.
+        """
+        lines = self._conn.execute("""SELECT address,type,line_text,line_data
+            FROM lines WHERE address >= ? AND address < ? ORDER BY address""",
+            (start_address,end_address))
+        xrefs = self._conn.execute("""SELECT xref_type,line_from,line_to
+            FROM xrefs WHERE line_from >= ? AND line_from < ?
+            ORDER BY line_from""",(start_address,end_address))
+
+        xref = next(xrefs,None)
+        for addr,line_type,line_text,line_data in lines:
+            xref_rows = []
+            # Skip xrefs from nonexistent lines:
+            while (xref is not None) and (xref[1] < addr):
+                xref = next(xrefs,None)
+            while (xref is not None) and (xref[1] == addr):
+                xref_rows.append(xref)
+                xref = next(xrefs,None)
+
+            yield ((addr,line_type,line_text,str(line_data)),xref_rows)
+
+    def delete_lines(self,addresses):
+        """
+        Delete the lines at the given addresses, together with their fts
+        index entries, their instructions and all the xrefs from them.
+        """
+        addr_rows = [(addr,) for addr in addresses]
+        if len(addr_rows) == 0:
+            return
+
+        # Pending insertions must be done before deleting:
+        self.flush()
+
+        # The fts tables read the deleted content from the lines table, so
+        # they must be updated before it:
+        for fts_table in LINES_FTS_TABLES:
+            self._conn.executemany(
+                'DELETE FROM {} WHERE docid = ?'.format(fts_table),addr_rows)
+        self._conn.executemany('DELETE FROM lines WHERE address = ?',addr_rows)
+        self._conn.executemany('DELETE FROM xrefs WHERE line_from = ?',
+                addr_rows)
+        self._conn.executemany('DELETE FROM instructions WHERE address = ?',
+                addr_rows)
+        self._conn.executemany('DELETE FROM operands WHERE line = ?',
+                addr_rows)
+
+    def delete_xrefs_from(self,addresses):
+        """
+        Delete all xrefs from lines at the given addresses.
+        """
+        self.flush()
+        self._conn.executemany('DELETE FROM xrefs WHERE line_from = ?',
+                ((addr,) for addr in addresses))
+
+    def delete_lines_in_range(self,start_address,end_address):
+        """
+        Delete all lines in a range of addresses (end_address exclusive).
+        """
+        rows = self._conn.execute("""SELECT address FROM lines
+            WHERE address >= ? AND address < ?""",(start_address,end_address))
+        self.delete_lines([row[0] for row in rows])
+
+    def delete_functions(self,addresses):
+        """
+        Delete the functions at the given addresses.
+        """
+        addr_rows = [(addr,) for addr in addresses]
+        self.flush()
+        self._conn.executemany('DELETE FROM funcs_chunks WHERE func = ?',
+                addr_rows)
+        self._conn.executemany('DELETE FROM funcs WHERE address = ?',
+                addr_rows)
+
+    def delete_segments(self,start_addresses):
+        """
+        Delete the segments that start at the given addresses. Only the
+        segments rows are deleted, not the lines inside them.
+        """
+        self.flush()
+        self._conn.executemany('DELETE FROM segments WHERE start_address = ?',
+                ((addr,) for addr in start_addresses))
+
+    def optimize(self):
+        """
+        Finalize the sdb: Merge the segments of the fts tables, collect
+        statistics for the query planner and compact the file.
+        """
+        self.create_indexes()
+        self.flush()
         self._commit_transaction()
 
-        self._conn.execute("""INSERT INTO lines_data_fts(
-            rowid,line_data_hex) SELECT 
-            address, line_data_hex FROM lines""")
+        for fts_table in LINES_FTS_TABLES:
+            self._conn.execute("INSERT INTO {0}({0}) VALUES('optimize')"\
+                    .format(fts_table))
+        self._conn.execute('ANALYZE')
+        self._conn.execute('VACUUM')
 
         self._begin_transaction()
 
-    def close(self):
+    def merge(self,pages=FTS_MERGE_PAGES):
+        """
+        A cheap finalization for an update of an existing sdb: Merge a
+        bounded amount of the segments of the fts tables (About pages pages
+        of every table), and update the statistics of the query planner only
+        where sqlite finds them out of date. The file is not rewritten.
+        """
+        self.create_indexes()
+        self.flush()
+        for fts_table in LINES_FTS_TABLES:
+            # Merge even two segments of the same level:
+            self._conn.execute("INSERT INTO {0}({0}) VALUES('merge={1},2')"\
+                    .format(fts_table,pages))
+        self._conn.execute('PRAGMA optimize')
+
+    def close(self,optimize=True):
         """
         Close connection to database.
+        If optimize is True, the sdb is finalized first (See optimize).
         """
+        if optimize:
+            self.optimize()
+        else:
+            self.create_indexes()
+        self.flush()
         self._commit_transaction()
         self._conn.close()
+        if self._partial_path is not None:
+            os.remove(self._partial_path)
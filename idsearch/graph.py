@@ -0,0 +1,249 @@
+import array
+import collections
+
+# In memory directed graphs of addresses, for fast graph queries over xrefs.
+# Edges are kept in compressed sparse row form: The successors of the node
+# with index i are targets[offsets[i]:offsets[i + 1]].
+# Node indexes are kept in arrays of C longs. Addresses are kept in a list,
+# because C longs are only 32 bits on some platforms.
+
+def build_csr(num_nodes,edges):
+    """
+    Build compressed sparse rows from a list of (src_index,dst_index) edges.
+    Returns (offsets,targets) arrays.
+    """
+    counts = array.array('l',[0]) * (num_nodes + 1)
+    for src,_ in edges:
+        counts[src + 1] += 1
+
+    # Prefix sums of the counts are the offsets:
+    offsets = counts
+    for i in xrange(num_nodes):
+        offsets[i + 1] += offsets[i]
+
+    targets = array.array('l',[0]) * len(edges)
+    fill = array.array('l',offsets[:num_nodes])
+    for src,dst in edges:
+        targets[fill[src]] = dst
+        fill[src] += 1
+
+    return (offsets,targets)
+
+
+class Graph(object):
+    """
+    A directed graph of addresses (Lines or functions).
+    """
+    def __init__(self,edges,nodes=()):
+        """
+        edges is an iterable of (src_address,dst_address) pairs. nodes is an
+        optional iterable of addresses of nodes without edges.
+        """
+        edges = list(edges)
+        addresses = set(nodes)
+        for src,dst in edges:
+            addresses.add(src)
+            addresses.add(dst)
+
+        # Sorted addresses of the nodes, and the index of every address:
+        self._addresses = sorted(addresses)
+        self._index = {address:i for i,address in enumerate(self._addresses)}
+
+        index = self._index
+        index_edges = [(index[src],index[dst]) for src,dst in edges]
+        self._offsets,self._targets = build_csr(len(self._addresses),
+                index_edges)
+        self._rev_offsets,self._rev_targets = build_csr(len(self._addresses),
+                [(dst,src) for src,dst in index_edges])
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def __contains__(self,address):
+        return address in self._index
+
+    def nodes(self):
+        """
+        Get the addresses of all nodes, sorted.
+        """
+        return list(self._addresses)
+
+    def num_edges(self):
+        return len(self._targets)
+
+    def _neighbors(self,i,reverse=False):
+        """
+        Get the indexes of the successors (Or predecessors, if reverse is
+        True) of the node with index i.
+        """
+        if reverse:
+            return self._rev_targets[self._rev_offsets[i]:
+                    self._rev_offsets[i + 1]]
+        return self._targets[self._offsets[i]:self._offsets[i + 1]]
+
+    def successors(self,address):
+        """
+        Get the addresses of the direct successors of a node.
+        """
+        if address not in self._index:
+            return []
+        return [self._addresses[j] for j in self._neighbors(
+            self._index[address])]
+
+    def predecessors(self,address):
+        """
+        Get the addresses of the direct predecessors of a node.
+        """
+        if address not in self._index:
+            return []
+        return [self._addresses[j] for j in self._neighbors(
+            self._index[address],reverse=True)]
+
+    def _bfs(self,sources,max_depth=None,reverse=False):
+        """
+        Breadth first search from the nodes with the given indexes.
+        Returns (order,parents): The indexes of the reached nodes, in the
+        order they were reached, and the parent index of every reached node
+        (-1 for the sources and unreached nodes).
+        """
+        parents = array.array('l',[-1]) * len(self._addresses)
+        visited = bytearray(len(self._addresses))
+        order = []
+        queue = collections.deque()
+        for i in sources:
+            if not visited[i]:
+                visited[i] = 1
+                order.append(i)
+                queue.append((i,0))
+
+        if reverse:
+            offsets,targets = self._rev_offsets,self._rev_targets
+        else:
+            offsets,targets = self._offsets,self._targets
+
+        while len(queue) > 0:
+            i,depth = queue.popleft()
+            if (max_depth is not None) and (depth >= max_depth):
+                continue
+            for j in targets[offsets[i]:offsets[i + 1]]:
+                if visited[j]:
+                    continue
+                visited[j] = 1
+                parents[j] = i
+                order.append(j)
+                queue.append((j,depth + 1))
+
+        return (order,parents)
+
+    def reachable(self,address,max_depth=None,reverse=False):
+        """
+        Get the addresses of all the nodes reachable from a node (Including
+        the node itself), up to max_depth edges away. If reverse is True,
+        edges are followed backwards.
+        """
+        if address not in self._index:
+            return []
+        order,_ = self._bfs([self._index[address]],max_depth,reverse)
+        return [self._addresses[i] for i in order]
+
+    def callees(self,address,depth=1):
+        """
+        Get the addresses of the nodes up to depth edges after a node (Not
+        including the node itself, unless it is on a cycle).
+        """
+        return self._around(address,depth,reverse=False)
+
+    def callers(self,address,depth=1):
+        """
+        Get the addresses of the nodes up to depth edges before a node (Not
+        including the node itself, unless it is on a cycle).
+        """
+        return self._around(address,depth,reverse=True)
+
+    def _around(self,address,depth,reverse):
+        if address not in self._index:
+            return []
+        i = self._index[address]
+        # Start from the neighbors, so that the node itself is only included
+        # if it is reachable from them:
+        order,_ = self._bfs(self._neighbors(i,reverse),depth - 1,reverse)
+        return [self._addresses[j] for j in order]
+
+    def shortest_path(self,src_address,dst_address):
+        """
+        Get the addresses of the nodes on a shortest path from src_address to
+        dst_address (Including both). Returns None if there is no path.
+        """
+        if (src_address not in self._index) or \
+                (dst_address not in self._index):
+            return None
+
+        src = self._index[src_address]
+        dst = self._index[dst_address]
+        order,parents = self._bfs([src])
+        if (dst != src) and (parents[dst] == -1):
+            return None
+
+        path = [dst]
+        while path[-1] != src:
+            path.append(parents[path[-1]])
+        return [self._addresses[i] for i in reversed(path)]
+
+    def strongly_connected_components(self):
+        """
+        Get the strongly connected components of the graph.
+        Returns a list of components. Every component is a sorted list of
+        addresses.
+        """
+        # Iterative Tarjan's algorithm:
+        num_nodes = len(self._addresses)
+        offsets,targets = self._offsets,self._targets
+        indexes = array.array('l',[-1]) * num_nodes
+        lowlinks = array.array('l',[0]) * num_nodes
+        on_stack = bytearray(num_nodes)
+        stack = []
+        components = []
+        next_index = 0
+
+        for root in xrange(num_nodes):
+            if indexes[root] != -1:
+                continue
+
+            # Call stack of (node,position in its successors):
+            call_stack = [(root,offsets[root])]
+            indexes[root] = lowlinks[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack[root] = 1
+
+            while len(call_stack) > 0:
+                i,pos = call_stack[-1]
+                if pos < offsets[i + 1]:
+                    call_stack[-1] = (i,pos + 1)
+                    j = targets[pos]
+                    if indexes[j] == -1:
+                        indexes[j] = lowlinks[j] = next_index
+                        next_index += 1
+                        stack.append(j)
+                        on_stack[j] = 1
+                        call_stack.append((j,offsets[j]))
+                    elif on_stack[j]:
+                        lowlinks[i] = min(lowlinks[i],indexes[j])
+                    continue
+
+                call_stack.pop()
+                if len(call_stack) > 0:
+                    parent = call_stack[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent],lowlinks[i])
+
+                if lowlinks[i] == indexes[i]:
+                    component = []
+                    while True:
+                        j = stack.pop()
+                        on_stack[j] = 0
+                        component.append(self._addresses[j])
+                        if j == i:
+                            break
+                    components.append(sorted(component))
+
+        return components
@@ -1,4 +1,5 @@
 import logging
+import hashlib
 import idc
 import idaapi
 import idautils
@@ -7,19 +8,40 @@ from .types import LineTypes, XrefTypes
 
 logger = logging.getLogger(__name__)
 
+# Largest address that can be stored in the sdb (sqlite integers are signed 64
+# bit):
+MAX_SDB_ADDRESS = 2**63 - 1
+
+# Maximum amount of operands of an instruction (UA_MAXOP):
+MAX_OPERANDS = 6
+
+def iter_segments():
+    """
+    Iterate through all segments in the IDB.
+    Yields (seg_start,seg_end) pairs.
+    """
+    for ea in idautils.Segments():
+        yield (idc.SegStart(ea),idc.SegEnd(ea))
+
+
+def iter_segment_lines(seg_start,seg_end):
+    """
+    Iterate through all line addresses in a segment.
+    """
+    cur_addr = seg_start
+    while (cur_addr < seg_end) and (cur_addr != idaapi.BADADDR):
+        yield cur_addr
+        cur_addr = idc.NextHead(cur_addr)
+
+
 def iter_lines():
     """
     Iterate through all line addresses in the IDB
     Yields addresses of all lines.
     """
-    for ea in idautils.Segments():
-        seg_start = idc.SegStart(ea)
-        seg_end = idc.SegEnd(ea)
-
-        cur_addr = seg_start
-        while (cur_addr < seg_end) and (cur_addr != idaapi.BADADDR):
-            yield cur_addr
-            cur_addr = idc.NextHead(cur_addr)
+    for seg_start,seg_end in iter_segments():
+        for line_addr in iter_segment_lines(seg_start,seg_end):
+            yield line_addr
 
 
 def canonicalize_line_text(line_text):
@@ -35,25 +57,39 @@ def canonicalize_line_text(line_text):
     return unicode(' '.join(res_line_text.split()))
 
 
-def is_func_chunked(func_addr):
+def get_instruction_row(line_addr):
+    """
+    Get the instruction of a code line.
+    Returns an (addr,mnemonic,operands) tuple, where operands is a list of
+    (op_type,text,value) tuples.
+    """
+    operands = []
+    for op_index in xrange(MAX_OPERANDS):
+        op_type = idc.GetOpType(line_addr,op_index)
+        # The operands end with an operand of type o_void (Or an error):
+        if op_type <= idc.o_void:
+            break
+        operands.append((op_type,
+            canonicalize_line_text(idc.GetOpnd(line_addr,op_index)),
+            idc.GetOperandValue(line_addr,op_index)))
+
+    return (line_addr,idc.GetMnem(line_addr),operands)
+
+
+def iter_func_chunks(func_addr):
     """
-    Check if a function is divided into chunks.
+    Iterate through all the chunks of a function.
+    Yields (start_address,end_address) pairs.
     """
-    logger.debug('is_func_chunked {}'.format(func_addr))
     # Idea for this code is from:
     # http://code.google.com/p/idapython/source/browse/trunk/python/idautils.py?r=344
-
-    num_chunks = 0
     func_iter = idaapi.func_tail_iterator_t(idaapi.get_func(func_addr))
     status = func_iter.main()
     while status:
         chunk = func_iter.chunk()
-        num_chunks += 1
-        # yield (chunk.startEA, chunk.endEA)
+        yield (chunk.startEA, chunk.endEA)
         status = func_iter.next()
 
-    return (num_chunks > 1)
-
 def is_line_code(line_address):
     """
     Check if a given line contains code.
@@ -75,17 +111,67 @@ def is_line_exists(line_address):
 
 
 
-def index_idb(sdb_path):
+class LineClassifier(object):
     """
-    Index the current idb.
+    Classify line addresses as code, data or nonexistent.
+    Classifications of xref targets are cached, so that the IDA api is asked
+    about every xref target only once.
     """
-    sdbgen = SDBGen(sdb_path)
+    # Classification of nonexistent lines:
+    NONEXISTENT = None
+
+    def __init__(self):
+        # Cached classifications by line address:
+        self._cache = {}
+
+    def classify(self,line_address):
+        """
+        Get the classification of a line: LineTypes.CODE, LineTypes.DATA or
+        NONEXISTENT.
+        """
+        try:
+            return self._cache[line_address]
+        except KeyError:
+            pass
+
+        # A line that has a mnemonic must exist, so we check existence only
+        # for lines that are not code:
+        if is_line_code(line_address):
+            line_class = LineTypes.CODE
+        elif is_line_exists(line_address):
+            line_class = LineTypes.DATA
+        else:
+            line_class = self.NONEXISTENT
 
-    # Index all lines:
-    for line_addr in iter_lines():
+        self._cache[line_address] = line_class
+        return line_class
+
+    def is_code(self,line_address):
+        """
+        Check if an existing line contains code.
+        The result is not cached: Every line is visited only once, and caching
+        all the lines of a large IDB takes too much memory.
+        """
+        line_class = self._cache.get(line_address,self.NONEXISTENT)
+        if line_class is not self.NONEXISTENT:
+            return line_class == LineTypes.CODE
+        return is_line_code(line_address)
+
+
+def iter_line_infos(line_addrs,classifier=None):
+    """
+    Iterate through the lines at the given addresses, visiting every line once.
+    Yields (line_row,xref_rows) pairs, where line_row is a
+    (addr,line_type,line_text,line_data) tuple and xref_rows is a list of
+    (xref_type,line_from,line_to) tuples.
+    """
+    if classifier is None:
+        classifier = LineClassifier()
+
+    for line_addr in line_addrs:
         # Get line attributes:
         line_type = LineTypes.DATA
-        if is_line_code(line_addr):
+        if classifier.is_code(line_addr):
             line_type = LineTypes.CODE
 
         line_text = canonicalize_line_text(idc.GetDisasm(line_addr))
@@ -94,77 +180,314 @@ def index_idb(sdb_path):
         if line_data is None:
             line_data = ""
 
-        # Index the line:
-        sdbgen.add_line(line_addr,line_type,line_text,line_data)
-
-
-            
-    # Index all xrefs:
-    for line_addr in iter_lines():
-        if is_line_code(line_addr):
-            # Line is code:
-            # Code xrefs:
-            no_flow_crefs = set(idautils.CodeRefsFrom(line_addr,0))
-            all_crefs = set(idautils.CodeRefsFrom(line_addr,1))
-            flow_crefs = no_flow_crefs.difference(all_crefs)
-
-            for nf_cref in no_flow_crefs:
-                if not is_line_exists(nf_cref):
-                    logger.warning('Code line: nf_cref = 0x{:x} is nonexistent. '
-                        'line_addr = 0x{:x}'.format(nf_cref,line_addr))
-                    continue 
-                sdbgen.add_xref(XrefTypes.CODE_JUMP,line_addr,nf_cref)
-
-            for f_cref in flow_crefs:
-                if not is_line_exists(f_cref):
-                    logger.warning('Code line: f_cref = 0x{:x} is nonexistent. '
-                        'line_addr = 0x{:x}'.format(f_cref,line_addr))
-                    continue
-                sdbgen.add_xref(XrefTypes.CODE_FLOW,line_addr,f_cref)
-
-            # Code to Data xrefs:
-            for dref in idautils.DataRefsFrom(line_addr):
-                if not is_line_exists(dref):
-                    logger.warning('Code line: dref = 0x{:x} is nonexistent. '
-                        'line_addr = 0x{:x}'.format(dref,line_addr))
-                    continue
-                sdbgen.add_xref(XrefTypes.CODE_TO_DATA,line_addr,dref)
+        line_row = (line_addr,line_type,line_text,line_data)
 
+        if line_type == LineTypes.CODE:
+            xref_rows = list(iter_code_xref_rows(line_addr,classifier))
         else:
-            # Line is data (Not code):
-            for dref in idautils.DataRefsFrom(line_addr):
-                if not is_line_exists(dref):
-                    logger.warning('Data line: dref = {:x} is nonexistent. '
-                        'line_addr = 0x{:x}'.format(dref,line_addr))
-                    continue
+            xref_rows = list(iter_data_xref_rows(line_addr,classifier))
 
-                if is_line_code(dref):
-                    sdbgen.add_xref(XrefTypes.DATA_TO_CODE,line_addr,dref)
-                else:
-                    sdbgen.add_xref(XrefTypes.DATA_TO_DATA,line_addr,dref)
+        yield (line_row,xref_rows)
 
 
-    # Index all functions:
-    for func_addr in idautils.Functions():
-        # We skip chunked functions:
-        if is_func_chunked(func_addr):
-            logger.warning('Function at 0x{:x} is chunked'.format(func_addr))
+def iter_code_xref_rows(line_addr,classifier):
+    """
+    Iterate through all xrefs from a code line.
+    Yields (xref_type,line_from,line_to) tuples.
+    """
+    # Code xrefs:
+    no_flow_crefs = set(idautils.CodeRefsFrom(line_addr,0))
+    all_crefs = set(idautils.CodeRefsFrom(line_addr,1))
+    flow_crefs = all_crefs.difference(no_flow_crefs)
+
+    for nf_cref in no_flow_crefs:
+        if classifier.classify(nf_cref) is LineClassifier.NONEXISTENT:
+            logger.warning('Code line: nf_cref = 0x{:x} is nonexistent. '
+                'line_addr = 0x{:x}'.format(nf_cref,line_addr))
             continue
+        yield (XrefTypes.CODE_JUMP,line_addr,nf_cref)
 
-        func_end = idc.GetFunctionAttr(func_addr,idc.FUNCATTR_END)
+    for f_cref in flow_crefs:
+        if classifier.classify(f_cref) is LineClassifier.NONEXISTENT:
+            logger.warning('Code line: f_cref = 0x{:x} is nonexistent. '
+                'line_addr = 0x{:x}'.format(f_cref,line_addr))
+            continue
+        yield (XrefTypes.CODE_FLOW,line_addr,f_cref)
 
-        # Make sure that start is before end:
-        if func_end <= func_addr:
-            logger.warning('Function at {:x} has end {:x}'\
-                    .format(func_addr,func_end))
+    # Code to Data xrefs:
+    for dref in idautils.DataRefsFrom(line_addr):
+        if classifier.classify(dref) is LineClassifier.NONEXISTENT:
+            logger.warning('Code line: dref = 0x{:x} is nonexistent. '
+                'line_addr = 0x{:x}'.format(dref,line_addr))
+            continue
+        yield (XrefTypes.CODE_TO_DATA,line_addr,dref)
+
+
+def iter_data_xref_rows(line_addr,classifier):
+    """
+    Iterate through all xrefs from a data line.
+    Yields (xref_type,line_from,line_to) tuples.
+    """
+    for dref in idautils.DataRefsFrom(line_addr):
+        dref_class = classifier.classify(dref)
+        if dref_class is LineClassifier.NONEXISTENT:
+            logger.warning('Data line: dref = {:x} is nonexistent. '
+                'line_addr = 0x{:x}'.format(dref,line_addr))
+            continue
+
+        if dref_class == LineTypes.CODE:
+            yield (XrefTypes.DATA_TO_CODE,line_addr,dref)
+        else:
+            yield (XrefTypes.DATA_TO_DATA,line_addr,dref)
+
+
+def iter_func_rows():
+    """
+    Iterate through all functions in the IDB.
+    Yields (func_addr,func_name,chunks) tuples.
+    """
+    for func_addr in idautils.Functions():
+        chunks = []
+        for chunk_start,chunk_end in iter_func_chunks(func_addr):
+            # Make sure that start is before end:
+            if chunk_end <= chunk_start:
+                logger.warning('Function at 0x{:x} has chunk 0x{:x} with '
+                        'end 0x{:x}'.format(func_addr,chunk_start,chunk_end))
+                continue
+            chunks.append((chunk_start,chunk_end))
+
+        if len(chunks) == 0:
+            logger.warning('Function at 0x{:x} has no valid chunks'\
+                    .format(func_addr))
             continue
 
-        line_addresses = xrange(func_addr,func_end)
         func_name = idc.GetFunctionName(func_addr)
-        sdbgen.add_function(func_addr,func_name,line_addresses)
+        yield (func_addr,func_name,chunks)
+
+
+def update_checksum(checksum,line_row,xref_rows):
+    """
+    Update a segment checksum with a line and its xrefs.
+    """
+    checksum.update(repr(line_row))
+    checksum.update(repr(sorted(xref_rows)))
+
 
+def segment_checksum(seg_start,seg_end,classifier):
+    """
+    Calculate the checksum of the lines and xrefs of a segment.
+    """
+    checksum = hashlib.md5()
+    for line_row,xref_rows in iter_line_infos(
+            iter_segment_lines(seg_start,seg_end),classifier):
+        update_checksum(checksum,line_row,xref_rows)
+    return checksum.hexdigest()
 
 
+def index_idb(sdb_path,image_path=None):
+    """
+    Index the current idb.
+    If image_path is not None, a segment image is also written there (See
+    segment_image).
+    """
+    sdbgen = SDBGen(sdb_path)
+    classifier = LineClassifier()
+
+    # Index all lines and xrefs in one pass over the IDB:
+    for seg_start,seg_end in iter_segments():
+        checksum = hashlib.md5()
+        for line_row,xref_rows in iter_line_infos(
+                iter_segment_lines(seg_start,seg_end),classifier):
+            update_checksum(checksum,line_row,xref_rows)
+            sdbgen.add_lines([line_row])
+            sdbgen.add_xrefs(xref_rows)
+            if line_row[1] == LineTypes.CODE:
+                sdbgen.add_instructions([get_instruction_row(line_row[0])])
+
+        sdbgen.add_segments([(seg_start,seg_end,checksum.hexdigest())])
+
+    # Index all functions:
+    sdbgen.add_functions(iter_func_rows())
+
     sdbgen.fill_lines_fts()
+    sdbgen.fill_blocks()
+    sdbgen.fill_data_pages()
+    if image_path is not None:
+        sdbgen.write_image(image_path)
     sdbgen.close()
 
+
+def iter_merged_infos(old_infos,new_infos):
+    """
+    Merge two iterators of (line_row,xref_rows) pairs, both ordered by
+    address.
+    Yields (old_info,new_info) pairs of the same address. A missing side is
+    None.
+    """
+    old_info = next(old_infos,None)
+    new_info = next(new_infos,None)
+    while (old_info is not None) or (new_info is not None):
+        if (new_info is None) or \
+                ((old_info is not None) and (old_info[0][0] < new_info[0][0])):
+            yield (old_info,None)
+            old_info = next(old_infos,None)
+        elif (old_info is None) or (new_info[0][0] < old_info[0][0]):
+            yield (None,new_info)
+            new_info = next(new_infos,None)
+        else:
+            yield (old_info,new_info)
+            old_info = next(old_infos,None)
+            new_info = next(new_infos,None)
+
+
+def update_segment(sdbgen,seg_start,seg_end,classifier):
+    """
+    Rewrite the lines and xrefs of a segment that differ between the IDB and
+    the sdb.
+    Returns the set of targets of the xrefs that were deleted or added.
+    """
+    # Addresses of lines to delete:
+    deleted_lines = []
+    # Addresses of lines whose xrefs should be deleted:
+    deleted_xrefs = []
+    new_lines = []
+    new_xrefs = []
+    # Targets of deleted xrefs:
+    old_targets = set()
+
+    old_infos = sdbgen.iter_line_infos(seg_start,seg_end)
+    new_infos = iter_line_infos(
+            iter_segment_lines(seg_start,seg_end),classifier)
+
+    for old_info,new_info in iter_merged_infos(old_infos,new_infos):
+        if new_info is None:
+            deleted_lines.append(old_info[0][0])
+            old_targets.update(xref[2] for xref in old_info[1])
+            continue
+
+        new_line_row,new_xref_rows = new_info
+        if old_info is None:
+            new_lines.append(new_line_row)
+            new_xrefs.extend(new_xref_rows)
+            continue
+
+        old_line_row,old_xref_rows = old_info
+        if old_line_row != new_line_row:
+            # Deleting a line also deletes its xrefs:
+            deleted_lines.append(old_line_row[0])
+            old_targets.update(xref[2] for xref in old_xref_rows)
+            new_lines.append(new_line_row)
+            new_xrefs.extend(new_xref_rows)
+        elif set(old_xref_rows) != set(new_xref_rows):
+            deleted_xrefs.append(old_line_row[0])
+            old_targets.update(xref[2] for xref in old_xref_rows)
+            new_xrefs.extend(new_xref_rows)
+
+    logger.info('Segment 0x{:x}: {} lines deleted, {} lines added'.format(
+        seg_start,len(deleted_lines),len(new_lines)))
+
+    sdbgen.delete_lines(deleted_lines)
+    sdbgen.delete_xrefs_from(deleted_xrefs)
+    sdbgen.add_lines(new_lines)
+    sdbgen.add_xrefs(new_xrefs)
+    sdbgen.add_instructions(get_instruction_row(line_row[0])
+            for line_row in new_lines if line_row[1] == LineTypes.CODE)
+    sdbgen.fill_lines_fts([line_row[0] for line_row in new_lines])
+    return old_targets | set(xref[2] for xref in new_xrefs)
+
+
+def update_functions(sdbgen):
+    """
+    Rewrite the functions that differ between the IDB and the sdb.
+    Returns the addresses of the functions that were deleted or added.
+    """
+    old_functions = sdbgen.get_functions()
+    deleted_functions = []
+    new_functions = []
+
+    for func_addr,func_name,chunks in iter_func_rows():
+        old_function = old_functions.pop(func_addr,None)
+        if old_function == (func_name,sorted(chunks)):
+            continue
+        if old_function is not None:
+            deleted_functions.append(func_addr)
+        new_functions.append((func_addr,func_name,chunks))
+
+    # Functions that do not exist anymore:
+    deleted_functions.extend(old_functions.keys())
+
+    logger.info('{} functions deleted, {} functions added'.format(
+        len(deleted_functions),len(new_functions)))
+
+    sdbgen.delete_functions(deleted_functions)
+    sdbgen.add_functions(new_functions)
+    return set(deleted_functions) | \
+            set(func_addr for func_addr,_,_ in new_functions)
+
+
+def iter_gaps(segments):
+    """
+    Iterate through the ranges of addresses that are outside of all the
+    given (start_address,end_address) segments. Yields (start_address,
+    end_address) pairs, end_address exclusive.
+    """
+    gap_start = 0
+    for seg_start,seg_end in sorted(segments):
+        if gap_start < seg_start:
+            yield (gap_start,seg_start)
+        gap_start = max(gap_start,seg_end)
+    yield (gap_start,MAX_SDB_ADDRESS)
+
+
+def update_index_idb(sdb_path,image_path=None):
+    """
+    Update an existing index of the current idb. Only segments with a changed
+    checksum are rewritten.
+    If image_path is not None, the segment image is written again there.
+    """
+    sdbgen = SDBGen(sdb_path,update=True)
+    classifier = LineClassifier()
+
+    old_segments = sdbgen.get_segments()
+    new_segments = []
+    unchanged_segments = []
+    # Lines whose block could change, outside of the changed segments:
+    xref_targets = set()
+
+    for seg_start,seg_end in iter_segments():
+        new_segments.append((seg_start,seg_end))
+        checksum = segment_checksum(seg_start,seg_end,classifier)
+        if old_segments.get(seg_start) == (seg_end,checksum):
+            unchanged_segments.append((seg_start,seg_end))
+            continue
+
+        xref_targets.update(
+                update_segment(sdbgen,seg_start,seg_end,classifier))
+        sdbgen.add_segments([(seg_start,seg_end,checksum)])
+
+    # Delete segments that do not exist anymore:
+    new_seg_starts = set(seg_start for seg_start,seg_end in new_segments)
+    sdbgen.delete_segments(seg_start for seg_start in old_segments
+            if seg_start not in new_seg_starts)
+
+    # Delete lines outside of all the current segments:
+    for gap_start,gap_end in iter_gaps(new_segments):
+        sdbgen.delete_lines_in_range(gap_start,gap_end)
+
+    changed_functions = update_functions(sdbgen)
+    # Blocks are derived again only around the lines that changed: Lines
+    # outside of the unchanged segments, targets of changed xrefs, and
+    # changed function starts together with the lines that jump to them (A
+    # jump to a function start is a call, which does not end a block):
+    changed_lines = xref_targets | changed_functions | \
+            sdbgen.get_jump_sources(changed_functions)
+    sdbgen.fill_blocks(list(iter_gaps(unchanged_segments)) +
+            [(address,address + 1) for address in changed_lines])
+    # Data pages are cut at the segments. Only the pages outside of the
+    # unchanged segments are replaced:
+    sdbgen.fill_data_pages(list(iter_gaps(unchanged_segments)))
+    if image_path is not None:
+        sdbgen.write_image(image_path)
+    # A full optimize would rewrite the whole file:
+    sdbgen.merge()
+    sdbgen.close(optimize=False)
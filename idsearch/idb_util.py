@@ -1,10 +1,17 @@
 import os
+import logging
 
 from .exceptions import IDBUtilError
-from .idb_indexer import index_idb
+from .idb_indexer import index_idb, update_index_idb
+from .gen_db import get_sdb_version
+from .partial_sdb import is_sdb_partial
+from .types import SDBVersions
+from .segment_image import gen_image_path
 
 import idaapi
 
+logger = logging.getLogger(__name__)
+
 
 def gen_sdb_path(idb_path):
     """
@@ -14,21 +21,49 @@ def gen_sdb_path(idb_path):
     return '.'.join(idb_path.split('.')[:-1] + ['sdb'])
 
 
-def gen_sdb(sdb_path=None,overwrite=False):
+def _remove_old_image(sdb_path):
+    """
+    Remove the segment image of an sdb that is about to change. An old image
+    would not match the new sdb.
+    """
+    image_path = gen_image_path(sdb_path)
+    if os.path.isfile(image_path):
+        os.remove(image_path)
+
+
+def gen_sdb(sdb_path=None,overwrite=False,incremental=False,image=False):
     """
     Generate SearchDB for the current database (Slow!)
+    If incremental is True and the sdb already exists, only the parts of the
+    sdb that changed are updated.
+    If image is True, a segment image is also written next to the sdb.
     """
     if sdb_path is None:
         # Get the path of the idb:
         idb_path = idaapi.cvar.database_idb
         sdb_path = gen_sdb_path(idb_path)
 
+    image_path = None
+    if image:
+        image_path = gen_image_path(sdb_path)
+
     if os.path.isfile(sdb_path):
-        if not overwrite:
+        if incremental:
+            # An interrupted generation or update leaves a partial sdb:
+            if (not is_sdb_partial(sdb_path)) and \
+                    (get_sdb_version(sdb_path) == SDBVersions.CURRENT):
+                if not image:
+                    _remove_old_image(sdb_path)
+                update_index_idb(sdb_path,image_path)
+                return
+            logger.info('sdb {} can not be updated. Rebuilding.'\
+                    .format(sdb_path))
+        elif not overwrite:
             raise IDBUtilError('sdb {} already exists. Use overwrite=True if '
                     'you want to overwrite.'.format(sdb_path))
         os.remove(sdb_path)
 
+    if not image:
+        _remove_old_image(sdb_path)
     # Index current IDB:
-    index_idb(sdb_path)
-
+    index_idb(sdb_path,image_path)
@@ -0,0 +1,599 @@
+import re
+import operator
+from .func_iter import FuncIter
+from .exceptions import SearchDBError
+from .types import SDBVersions, XrefTypes, OperandTypes, data_to_hex, \
+        int_to_sdb
+from . import regex_text
+
+# Lazy queries over the lines table. Conditions on lines are compiled into one
+# sql statement, that is executed only when the iteration starts.
+
+class Cond(object):
+    """
+    A condition on lines: An sql expression over the columns of the lines
+    table, with its parameters. Conditions can be combined using &, | and ~.
+    """
+    def __init__(self,sql,params=()):
+        self._sql = sql
+        self._params = tuple(params)
+
+    def compile(self,sdb):
+        """
+        Get (sql,params) of the condition, for a given SearchDB.
+        """
+        return (self._sql,self._params)
+
+    def __and__(self,other):
+        return BoolCond('AND',[self,other])
+
+    def __or__(self,other):
+        return BoolCond('OR',[self,other])
+
+    def __invert__(self):
+        return NotCond(self)
+
+class BoolCond(Cond):
+    """
+    Conditions joined by an sql boolean operator (AND, OR).
+    """
+    def __init__(self,op,conds):
+        self._op = op
+        self._conds = conds
+
+    def compile(self,sdb):
+        sqls = []
+        params = ()
+        for cond in self._conds:
+            cond_sql,cond_params = cond.compile(sdb)
+            sqls.append('({})'.format(cond_sql))
+            params += cond_params
+        return (' {} '.format(self._op).join(sqls),params)
+
+class NotCond(Cond):
+    """
+    Negation of a condition.
+    """
+    def __init__(self,cond):
+        self._cond = cond
+
+    def compile(self,sdb):
+        cond_sql,cond_params = self._cond.compile(sdb)
+        return ('NOT ({})'.format(cond_sql),cond_params)
+
+class VersionCond(Cond):
+    """
+    A condition with a different sql expression for some sdb versions.
+    sql_by_version is a dictionary: version -> sql. Other versions use sql.
+    """
+    def __init__(self,sql,sql_by_version,params=()):
+        super(VersionCond,self).__init__(sql,params)
+        self._sql_by_version = sql_by_version
+
+    def compile(self,sdb):
+        return (self._sql_by_version.get(sdb._version,self._sql),self._params)
+
+class UnionCond(Cond):
+    """
+    Lines that are in the results of any of two queries (LineQuery).
+    """
+    def __init__(self,left,right):
+        self._left = left
+        self._right = right
+
+    def compile(self,sdb):
+        left_sql,left_params = self._left.get_sql()
+        right_sql,right_params = self._right.get_sql()
+        return ('''address IN (SELECT address FROM lines WHERE {}
+            UNION SELECT address FROM lines WHERE {})'''.format(
+                left_sql,right_sql),left_params + right_params)
+
+class WithinFunctionCond(Cond):
+    """
+    Lines that are inside a function that contains a line from the results
+    of a query (LineQuery).
+    """
+    def __init__(self,query):
+        self._query = query
+
+    def compile(self,sdb):
+        query_sql,query_params = self._query.get_sql()
+        if sdb._version == SDBVersions.HEX:
+            return ('''address IN (SELECT line FROM funcs_lines
+                WHERE func IN (SELECT func FROM funcs_lines
+                WHERE line IN (SELECT address FROM lines WHERE {})))'''\
+                        .format(query_sql),query_params)
+
+        # Only chunks that start at most max_chunk_size before a line could
+        # contain it (See SearchDB.funcs_by_line):
+        return ('''address IN (SELECT lines.address
+            FROM funcs_chunks INNER JOIN lines ON
+            lines.address >= funcs_chunks.start_address AND
+            lines.address < funcs_chunks.end_address
+            WHERE funcs_chunks.func IN (SELECT funcs_chunks.func
+            FROM lines INNER JOIN funcs_chunks ON
+            funcs_chunks.start_address <= lines.address AND
+            funcs_chunks.start_address >= lines.address - ? AND
+            funcs_chunks.end_address > lines.address
+            WHERE lines.address IN
+            (SELECT address FROM lines WHERE {})))'''.format(query_sql),
+            (sdb._get_max_chunk_size(),) + query_params)
+
+###########################################################################
+# Conditions:
+
+def line_type_is(line_type):
+    """
+    Lines of a given type (LineTypes).
+    """
+    return Cond('type = ?',(line_type,))
+
+def address_in_range(start_address,end_address):
+    """
+    Lines in a range of addresses, inclusive.
+    """
+    return Cond('address >= ? AND address <= ?',(start_address,end_address))
+
+def context_bound_sql(address_sql,address_params,count,before):
+    """
+    Get (sql,params) of the address of the count-th line before (Or after,
+    if before is False) an address. If there are less lines, it is the
+    address of the first (Or last) line. address_sql is an sql expression of
+    the address, with address_params.
+    """
+    if count <= 0:
+        return (address_sql,address_params)
+    op,order,bound = ('<','DESC','MIN') if before else ('>','ASC','MAX')
+    # Walks the primary key from the address, at most count rows:
+    return ("""IFNULL((SELECT address FROM lines WHERE address {} {}
+        ORDER BY address {} LIMIT 1 OFFSET ?),
+        (SELECT {}(address) FROM lines))""".format(op,address_sql,order,bound),
+        tuple(address_params) + (count - 1,))
+
+def line_context(line_address,before,after):
+    """
+    Lines around a line: before lines before it, the line itself and after
+    lines after it. Counts are of lines, not of addresses.
+    """
+    lower_sql,lower_params = context_bound_sql('?',(line_address,),
+            before,True)
+    upper_sql,upper_params = context_bound_sql('?',(line_address,),
+            after,False)
+    return Cond('address >= {} AND address <= {}'.format(lower_sql,upper_sql),
+            lower_params + upper_params)
+
+def in_function(func_addr):
+    """
+    Lines that belong to the function at func_addr.
+    """
+    return VersionCond("""address IN (SELECT lines.address
+        FROM funcs_chunks INNER JOIN lines ON
+        lines.address >= funcs_chunks.start_address AND
+        lines.address < funcs_chunks.end_address
+        WHERE funcs_chunks.func = ?)""",
+        {SDBVersions.HEX:"""address IN (SELECT line FROM funcs_lines
+        WHERE func = ?)"""},(func_addr,))
+
+def in_block(block_address):
+    """
+    Lines of the basic block that starts at block_address.
+    """
+    return Cond("""address >= ? AND
+        address < (SELECT end_address FROM blocks WHERE start_address = ?)""",
+        (block_address,block_address))
+
+def _xref_types_cond(xref_types,by_line_to=False):
+    """
+    Get (sql,params) that restricts xrefs to some xref types.
+    by_line_to should be True if the xrefs are searched by line_to.
+    """
+    if xref_types is None:
+        return ('',())
+    xref_types = tuple(xref_types)
+    # The unique index of xrefs starts with xref_type. The unary + keeps
+    # sqlite from choosing it over the index of line_to:
+    column = '+xref_type' if by_line_to else 'xref_type'
+    return (' AND {} IN ({})'.format(column,','.join('?' * len(xref_types))),
+            xref_types)
+
+# The line columns of xrefs have no type affinity, while lines.address is an
+# INTEGER. The unary + removes the affinity of lines.address in the
+# comparison, which allows searching the indexes of xrefs instead of scanning
+# them.
+
+def has_xrefs_from(xref_types=None):
+    """
+    Lines that have xrefs from them. If xref_types is given, only xrefs of
+    those types (XrefTypes) are considered.
+    """
+    types_sql,types_params = _xref_types_cond(xref_types)
+    return Cond("""EXISTS (SELECT 1 FROM xrefs
+        WHERE line_from = +lines.address{})""".format(types_sql),types_params)
+
+def has_xrefs_to(xref_types=None):
+    """
+    Lines that have xrefs to them. If xref_types is given, only xrefs of
+    those types (XrefTypes) are considered.
+    """
+    types_sql,types_params = _xref_types_cond(xref_types,by_line_to=True)
+    return Cond("""EXISTS (SELECT 1 FROM xrefs
+        WHERE line_to = +lines.address{})""".format(types_sql),types_params)
+
+# Basic block boundaries, in terms of the stored xrefs. Calls and jumps are
+# both stored as CODE_JUMP xrefs. A CODE_JUMP to the start of a function is
+# considered a call, which does not end a block.
+# Xrefs searched by line_to use +xref_type (See _xref_types_cond).
+
+STARTS_BLOCK_SQL = """(EXISTS (SELECT 1 FROM xrefs
+    WHERE line_to = {addr} AND +xref_type = {jump}) OR
+    (SELECT COUNT(*) FROM xrefs
+    WHERE line_to = {addr} AND +xref_type = {flow}) != 1)"""
+
+ENDS_BLOCK_SQL = """(EXISTS (SELECT 1 FROM xrefs
+    WHERE line_from = {addr} AND xref_type = {jump} AND
+    line_to NOT IN (SELECT address FROM funcs)) OR
+    (SELECT COUNT(*) FROM xrefs
+    WHERE line_from = {addr} AND xref_type = {flow}) != 1)"""
+
+def block_sql(template,addr):
+    """
+    Fill a block boundary template (STARTS_BLOCK_SQL, ENDS_BLOCK_SQL) for an
+    sql expression of a line address.
+    """
+    return template.format(addr=addr,jump=XrefTypes.CODE_JUMP,
+            flow=XrefTypes.CODE_FLOW)
+
+def in_code_flow_block(line_address):
+    """
+    Lines in the basic block of a line: The chain of CODE_FLOW xrefs around
+    the line, up to jump targets and branches.
+    """
+    # Follow the flow forward and backward, until the block boundaries.
+    # Inside a block every line has a single flow xref to the next line, so
+    # the next and previous lines are scalar subqueries. Joining the xrefs
+    # table instead makes sqlite build a bloom filter over all of it on every
+    # recursion step:
+    next_sql = """(SELECT line_to FROM xrefs WHERE line_from = fwd.address
+        AND xref_type = {})""".format(XrefTypes.CODE_FLOW)
+    prev_sql = """(SELECT line_from FROM xrefs WHERE line_to = bwd.address
+        AND +xref_type = {})""".format(XrefTypes.CODE_FLOW)
+    return Cond("""address IN (WITH RECURSIVE
+        fwd(address) AS (SELECT ? UNION
+            SELECT {next} FROM fwd WHERE NOT {fwd_ends} AND NOT {next_starts}),
+        bwd(address) AS (SELECT ? UNION
+            SELECT {prev} FROM bwd WHERE NOT {bwd_starts} AND NOT {prev_ends})
+        SELECT address FROM fwd UNION SELECT address FROM bwd)""".format(
+            next=next_sql,prev=prev_sql,
+            fwd_ends=block_sql(ENDS_BLOCK_SQL,'fwd.address'),
+            next_starts=block_sql(STARTS_BLOCK_SQL,next_sql),
+            bwd_starts=block_sql(STARTS_BLOCK_SQL,'bwd.address'),
+            prev_ends=block_sql(ENDS_BLOCK_SQL,prev_sql)),
+        (line_address,line_address))
+
+def match_text_fts(match_query):
+    """
+    Lines whose hex text matches an fts4 query.
+    """
+    return Cond("""address IN (SELECT rowid FROM lines_text_fts
+        WHERE lines_text_fts MATCH ?)""",(match_query,))
+
+def match_text_tokens_fts(match_query):
+    """
+    Lines whose text tokens match an fts4 query.
+    """
+    return Cond("""address IN (SELECT rowid FROM lines_text_tokens_fts
+        WHERE lines_text_tokens_fts MATCH ?)""",(match_query,))
+
+def match_data_fts(match_query):
+    """
+    Lines whose hex data matches an fts4 query.
+    """
+    return Cond("""address IN (SELECT rowid FROM lines_data_fts
+        WHERE lines_data_fts MATCH ?)""",(match_query,))
+
+def text_contains(text):
+    """
+    Lines that contain some exact text.
+    """
+    return match_text_fts('"{}"'.format(data_to_hex(text)))
+
+def text_tokens(tokens):
+    """
+    Lines that contain some text tokens.
+    """
+    return match_text_tokens_fts('"{}"'.format(tokens))
+
+def data_contains(data):
+    """
+    Lines that contain some exact data.
+    """
+    return match_data_fts('"{}"'.format(data_to_hex(data)))
+
+class InstructionCond(Cond):
+    """
+    A condition on the instructions of code lines, which are stored since
+    sdb version INSTRUCTIONS.
+    """
+    def compile(self,sdb):
+        sdb._check_instructions()
+        return super(InstructionCond,self).compile(sdb)
+
+def mnemonic_is(mnemonic):
+    """
+    Code lines with some mnemonic.
+    """
+    return InstructionCond("""address IN (SELECT address FROM instructions
+        WHERE mnemonic = ?)""",(mnemonic.lower(),))
+
+def has_operand(op_index=None,op_type=None,text=None,value=None):
+    """
+    Code lines with an operand that has all the given properties: Its index
+    in the instruction, type (One of OperandTypes), text and value.
+    """
+    conds = []
+    params = []
+    for column,param in [('op_index',op_index),('type',op_type),
+            ('text',text),('value',value)]:
+        if param is None:
+            continue
+        if column == 'value':
+            param = int_to_sdb(param)
+        conds.append('{} = ?'.format(column))
+        params.append(param)
+    if value is not None:
+        # Searched by the index of values:
+        return InstructionCond("""address IN (SELECT line FROM operands
+            WHERE {})""".format(' AND '.join(conds)),params)
+
+    # Checked for every line, by the index of lines. This is fast when
+    # combined with other conditions:
+    conds.insert(0,'line = lines.address')
+    return InstructionCond("""EXISTS (SELECT 1 FROM operands
+        WHERE {})""".format(' AND '.join(conds)),params)
+
+def has_immediate(value):
+    """
+    Code lines with an immediate operand of some value.
+    """
+    return has_operand(op_type=OperandTypes.IMM,value=value)
+
+# Shortest part of a token that is searched in the fts index of the hex text.
+# Shorter parts are contained in too many lines:
+MIN_PREFILTER_WORD = 3
+# Largest fraction of the lines that a prefilter may match. Reading the fts
+# index for more lines is slower than running the regular expression on all
+# the lines:
+MAX_PREFILTER_FRACTION = 0.25
+
+def _literal_prefilter(literal,ignore_case,sdb):
+    """
+    Get an (estimated_lines,cond) pair of the best condition on lines that
+    contain a literal string, or None. The condition searches the rarest
+    token of the literal (Using the statistics of the sdb).
+    """
+    bounded = set(regex_text.literal_tokens(literal))
+    best = None
+    for word in regex_text.TOKEN_REGEX.findall(literal):
+        if word in bounded:
+            cond = match_text_tokens_fts('"{}"'.format(word))
+        # Parts of tokens are searched in the hex text, which is case
+        # sensitive:
+        elif (not ignore_case) and (len(word) >= MIN_PREFILTER_WORD):
+            cond = text_contains(word)
+        else:
+            continue
+        # The amount of lines with the whole token estimates the amount of
+        # lines with a part of it:
+        estimate = sdb._token_documents(word.lower())
+        if (best is None) or (estimate < best[0]):
+            best = (estimate,cond)
+    return best
+
+def _required_text_prefilter(reqs,ignore_case,sdb):
+    """
+    Get an (estimated_lines,cond) pair of the best condition on lines that
+    contain some required text (See regex_text.required_text), or None.
+    """
+    best = None
+    for req in reqs:
+        if isinstance(req,list):
+            # All the alternatives need a condition:
+            alts = [_required_text_prefilter(alt,ignore_case,sdb)
+                    for alt in req]
+            if None in alts:
+                continue
+            candidate = (sum(alt[0] for alt in alts),
+                    reduce(operator.or_,[alt[1] for alt in alts]))
+        else:
+            candidate = _literal_prefilter(req,ignore_case,sdb)
+            if candidate is None:
+                continue
+        if (best is None) or (candidate[0] < best[0]):
+            best = candidate
+    return best
+
+def text_regex_prefilter(regex,sdb):
+    """
+    A condition that is satisfied by all the lines whose text matches a
+    regular expression, using only the fts tables. The rarest token in the
+    literal text of the regular expression is searched.
+    Returns None if there is no condition that is selective enough in sdb.
+    """
+    regex = regex_text.compile_regex(regex)
+    best = _required_text_prefilter(regex_text.required_text(regex),
+            bool(regex.flags & re.IGNORECASE),sdb)
+    if (best is None) or \
+            (best[0] > sdb._get_num_lines() * MAX_PREFILTER_FRACTION):
+        return None
+    return best[1]
+
+class TextRegexCond(Cond):
+    """
+    Lines whose text matches a regular expression (See text_regex).
+    """
+    def __init__(self,regex,prefilter):
+        self._regex = regex_text.compile_regex(regex)
+        self._prefilter = prefilter
+
+    def compile(self,sdb):
+        cond = VersionCond('line_text REGEXP ?',
+                {SDBVersions.HEX:'hex_to_data(line_text_hex) REGEXP ?'},
+                (regex_text.regex_pattern(self._regex),))
+        if self._prefilter:
+            # The prefilter depends on the statistics of the sdb:
+            prefilter_cond = text_regex_prefilter(self._regex,sdb)
+            if prefilter_cond is not None:
+                cond = prefilter_cond & cond
+        return cond.compile(sdb)
+
+def text_regex(regex,prefilter=True):
+    """
+    Lines whose text matches a regular expression (A pattern string or a
+    compiled pattern), using re.search.
+    If prefilter is True, the regular expression only runs on the lines that
+    satisfy text_regex_prefilter. Otherwise it runs on all the lines.
+    """
+    return TextRegexCond(regex,prefilter)
+
+###########################################################################
+
+class LineQuery(FuncIter):
+    """
+    A lazy query of lines. Behaves like a FuncIter of lines.
+    Conditions (Cond) given to filter, any and all are added to the sql
+    query. Any other function is run in python over the results of the
+    sql query.
+    Queries of the same sdb can be combined using & (Intersection),
+    | (Union), - (Difference) and within_function_of. The combination is
+    one sql query.
+    """
+    def __init__(self,sdb,conds=(),fields=None,py_filters=()):
+        super(LineQuery,self).__init__(None)
+        self._sdb = sdb
+        self._conds = list(conds)
+        self._fields = fields
+        # Filters that could not be compiled to sql:
+        self._py_filters = list(py_filters)
+
+    def get_sql(self):
+        """
+        Get (where_sql,params) of the sql conditions of the query, over the
+        lines table.
+        """
+        if len(self._conds) == 0:
+            return ('1',())
+        return BoolCond('AND',self._conds).compile(self._sdb)
+
+    def _execute(self):
+        """
+        Run the query. Returns an iterator of lines.
+        """
+        where_sql,params = self.get_sql()
+        lines = self._sdb._query_lines(where_sql,params,self._fields)
+        for func in self._py_filters:
+            lines = FuncIter(lines).filter(func)
+        return lines
+
+    def next(self):
+        if self._input_iter is None:
+            self._input_iter = self._execute()
+        return next(self._input_iter)
+
+    def filter(self,func):
+        """
+        Filter. func is a Cond or a function.
+        """
+        if isinstance(func,Cond):
+            return LineQuery(self._sdb,self._conds + [func],self._fields,
+                    self._py_filters)
+        return LineQuery(self._sdb,self._conds,self._fields,
+                self._py_filters + [func])
+
+    def any(self,func):
+        """
+        Check if any of the lines satisfy some condition.
+        """
+        if not isinstance(func,Cond):
+            return FuncIter(self).any(func)
+
+        query = self.filter(func)
+        if len(self._py_filters) == 0:
+            where_sql,params = query.get_sql()
+            return self._sdb._exists_line(where_sql,params)
+        return next(query,None) is not None
+
+    def all(self,func):
+        """
+        Check if all the lines satisfy some condition.
+        """
+        if not isinstance(func,Cond):
+            return FuncIter(self).all(func)
+        return not self.any(~func)
+
+    def map(self,func):
+        return FuncIter(self).map(func)
+
+    def unique(self,key):
+        return FuncIter(self).unique(key)
+
+    def _get_other_cond(self,other,op_name):
+        """
+        Get a condition that is satisfied by the lines of another query.
+        other is a LineQuery of the same sdb, or a Cond.
+        """
+        if isinstance(other,Cond):
+            return other
+
+        if not isinstance(other,LineQuery):
+            raise SearchDBError('Can not {} a LineQuery with {}'.format(
+                op_name,type(other).__name__))
+        if other._sdb is not self._sdb:
+            raise SearchDBError('Can not {} queries of different sdbs'\
+                    .format(op_name))
+        if len(other._py_filters) > 0:
+            raise SearchDBError('Can not {} with a query that has python '
+                    'filters'.format(op_name))
+
+        if len(other._conds) == 0:
+            return Cond('1')
+        return BoolCond('AND',other._conds)
+
+    def __and__(self,other):
+        """
+        Lines in the results of both queries.
+        """
+        # The python filters of both queries can apply to the intersection:
+        if isinstance(other,LineQuery) and len(other._py_filters) > 0:
+            return LineQuery(self._sdb,self._conds,self._fields,
+                    self._py_filters + other._py_filters)\
+                            & LineQuery(other._sdb,other._conds)
+
+        return self.filter(self._get_other_cond(other,'intersect'))
+
+    def __sub__(self,other):
+        """
+        Lines in the results of this query, but not of the other query.
+        """
+        return self.filter(~self._get_other_cond(other,'subtract'))
+
+    def __or__(self,other):
+        """
+        Lines in the results of any of the queries.
+        """
+        other_cond = self._get_other_cond(other,'unite')
+        # Python filters would apply to the results of the other query too:
+        if len(self._py_filters) > 0:
+            raise SearchDBError('Can not unite a query that has python '
+                    'filters')
+
+        return LineQuery(self._sdb,[UnionCond(LineQuery(self._sdb,self._conds),
+            LineQuery(self._sdb,[other_cond]))],self._fields)
+
+    def within_function_of(self,other):
+        """
+        Lines that are inside a function that contains a line from the
+        results of another query.
+        """
+        other_cond = self._get_other_cond(other,'combine')
+        return self.filter(WithinFunctionCond(
+            LineQuery(self._sdb,[other_cond])))
@@ -0,0 +1,20 @@
+import os
+
+# An sdb is marked as partial while it is being generated or updated: A marker
+# file is created next to it, and removed when the sdb is complete. An sdb
+# whose marker is left behind was interrupted, and is generated again from
+# scratch. This module has no dependencies, so that it can be used from
+# outside IDA (See batch_index).
+
+def gen_partial_path(sdb_path):
+    """
+    If sdb is c:\\temp\\my_proj.sdb, its partial marker will be
+    c:\\temp\\my_proj.sdb-partial.
+    """
+    return sdb_path + '-partial'
+
+def is_sdb_partial(sdb_path):
+    """
+    Check if the generation or the update of an sdb was interrupted.
+    """
+    return os.path.isfile(gen_partial_path(sdb_path))
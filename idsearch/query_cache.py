@@ -0,0 +1,190 @@
+import os
+import struct
+import hashlib
+
+from .usqlite3 import sqlite3
+from .exceptions import SearchDBError
+
+# A persistent cache of query results. The addresses of the results of every
+# query are kept in a sidecar sqlite file, keyed by a hash of the normalized
+# query. The cache belongs to one state of the sdb (See get_sdb_stamp): When
+# the sdb changes, all the results are dropped. Results that were not used
+# recently are evicted when the total size of the results grows beyond the
+# maximum size of the cache.
+
+# Default maximum total size of the cached results, in bytes:
+DEFAULT_MAX_SIZE = 0x4000000
+
+# Position of the file change counter in the header of an sqlite file. It is
+# incremented by every transaction that modifies the file:
+SQLITE_COUNTER_OFFSET = 24
+SQLITE_COUNTER_STRUCT = struct.Struct('>I')
+
+def gen_cache_path(sdb_path):
+    """
+    If sdb is c:\\temp\\my_proj.sdb, the cache will be c:\\temp\\my_proj.scache
+    """
+    return os.path.splitext(sdb_path)[0] + '.scache'
+
+def get_sdb_stamp(sdb_path):
+    """
+    Get a string that changes whenever the sdb is modified or generated
+    again: The file change counter of the sdb, its size and its modification
+    time.
+    """
+    with open(sdb_path,'rb') as f:
+        f.seek(SQLITE_COUNTER_OFFSET)
+        header = f.read(SQLITE_COUNTER_STRUCT.size)
+    counter = 0
+    if len(header) == SQLITE_COUNTER_STRUCT.size:
+        counter = SQLITE_COUNTER_STRUCT.unpack(header)[0]
+    stat = os.stat(sdb_path)
+    return '{}:{}:{!r}'.format(counter,stat.st_size,stat.st_mtime)
+
+def query_key(sql,params=()):
+    """
+    Get the cache key of a query: A hash of its sql, with whitespace
+    normalized, and its parameters.
+    """
+    normalized = ' '.join(sql.split())
+    return hashlib.sha1('{}\n{!r}'.format(normalized,tuple(params)))\
+            .hexdigest()
+
+def pack_addresses(addresses):
+    """
+    Pack a list of addresses into a string.
+    """
+    return struct.pack('<{}Q'.format(len(addresses)),*addresses)
+
+def unpack_addresses(addresses_str):
+    """
+    Unpack a list of addresses.
+    """
+    addresses_str = str(addresses_str)
+    return list(struct.unpack('<{}Q'.format(len(addresses_str) // 8),
+        addresses_str))
+
+
+class QueryCache(object):
+    """
+    Addresses of query results, by query key, for one state of an sdb.
+    """
+    def __init__(self,cache_path,stamp,max_size=DEFAULT_MAX_SIZE):
+        """
+        Open the cache at cache_path, creating it if it does not exist.
+        stamp identifies the state of the sdb (See get_sdb_stamp). Results
+        of any other stamp are dropped.
+        """
+        self._max_size = max_size
+        try:
+            self._conn = sqlite3.connect(cache_path)
+            self._conn.text_factory = str
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS cache_info (
+                stamp TEXT)""")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                addresses BLOB,
+                size INTEGER,
+                last_used INTEGER)""")
+            self._conn.execute("""CREATE INDEX IF NOT EXISTS
+                index_results_last_used ON results(last_used)""")
+
+            self._stamp = None
+            self.set_stamp(stamp)
+            # Use counter of the most recently used result:
+            self._clock = self._conn.execute(
+                    'SELECT MAX(last_used) FROM results').fetchone()[0] or 0
+        except sqlite3.DatabaseError:
+            raise SearchDBError('Query cache {} is invalid'.format(
+                cache_path))
+
+    def close(self):
+        """
+        Close the cache.
+        """
+        self._conn.close()
+
+    def set_stamp(self,stamp):
+        """
+        Set the state of the sdb. If it changed, all the results are
+        dropped.
+        """
+        if stamp == self._stamp:
+            return
+        row = self._conn.execute('SELECT stamp FROM cache_info').fetchone()
+        if (row is None) or (row[0] != stamp):
+            self._conn.execute('DELETE FROM cache_info')
+            self._conn.execute('DELETE FROM results')
+            self._conn.execute('INSERT INTO cache_info VALUES(?)',(stamp,))
+            self._conn.commit()
+        self._stamp = stamp
+
+    def _tick(self):
+        """
+        Advance the use counter.
+        """
+        self._clock += 1
+        return self._clock
+
+    def get(self,key):
+        """
+        Get the cached addresses of a query, or None if the query is not
+        cached.
+        """
+        row = self._conn.execute('SELECT addresses FROM results WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        self._conn.execute('UPDATE results SET last_used = ? WHERE key = ?',
+                (self._tick(),key))
+        self._conn.commit()
+        return unpack_addresses(row[0])
+
+    def put(self,key,addresses):
+        """
+        Cache the addresses of the results of a query. The least recently
+        used results are evicted to keep the cache within its maximum size.
+        Results that are larger than the whole cache are not cached.
+        """
+        addresses_str = pack_addresses(addresses)
+        if len(addresses_str) > self._max_size:
+            return
+        self._conn.execute("""INSERT OR REPLACE INTO results
+            (key,addresses,size,last_used) VALUES(?,?,?,?)""",
+            (key,buffer(addresses_str),len(addresses_str),self._tick()))
+        self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        """
+        Evict the least recently used results, until the total size of the
+        results is at most the maximum size.
+        """
+        total_size = self._conn.execute(
+                'SELECT TOTAL(size) FROM results').fetchone()[0]
+        if total_size <= self._max_size:
+            return
+
+        evicted = []
+        rows = self._conn.execute(
+                'SELECT key,size FROM results ORDER BY last_used').fetchall()
+        for key,size in rows:
+            if total_size <= self._max_size:
+                break
+            evicted.append((key,))
+            total_size -= size
+        self._conn.executemany('DELETE FROM results WHERE key = ?',evicted)
+
+    def get_size(self):
+        """
+        Get the total size of the cached results, in bytes.
+        """
+        return int(self._conn.execute(
+            'SELECT TOTAL(size) FROM results').fetchone()[0])
+
+    def clear(self):
+        """
+        Drop all the cached results.
+        """
+        self._conn.execute('DELETE FROM results')
+        self._conn.commit()
@@ -0,0 +1,113 @@
+import re
+import sre_parse
+import sre_constants
+
+# Regular expressions over the text of lines.
+# The text that every match of a regular expression must contain is extracted
+# from the parsed regular expression. It is used to find candidate lines with
+# the fts tables, and the regular expression is only run on the candidates.
+
+# Characters of the tokens of the fts simple tokenizer:
+TOKEN_REGEX = re.compile('[a-zA-Z0-9]+')
+
+# Flags of regular expressions, as inline flags:
+INLINE_FLAGS = [(re.IGNORECASE,'i'),(re.LOCALE,'L'),(re.MULTILINE,'m'),
+        (re.DOTALL,'s'),(re.UNICODE,'u'),(re.VERBOSE,'x')]
+
+def compile_regex(regex):
+    """
+    Get a compiled regular expression, from a pattern string or a compiled
+    pattern.
+    """
+    if isinstance(regex,basestring):
+        return re.compile(regex)
+    return regex
+
+def regex_pattern(regex):
+    """
+    Get a pattern string with the flags of a regular expression (A pattern
+    string or a compiled pattern) as inline flags.
+    """
+    regex = compile_regex(regex)
+    flags = ''.join(letter for flag,letter in INLINE_FLAGS
+            if regex.flags & flag)
+    if len(flags) == 0:
+        return regex.pattern
+    return '(?{}){}'.format(flags,regex.pattern)
+
+def sql_regexp(pattern,text):
+    """
+    The REGEXP function of sqlite: Check if a pattern matches some text
+    (Using re.search). Compiled patterns are cached by the re module.
+    """
+    if text is None:
+        return 0
+    if isinstance(text,buffer):
+        text = str(text)
+    return int(re.search(pattern,text) is not None)
+
+###########################################################################
+
+def _required_text(subpattern):
+    """
+    Get the text that every match of a parsed regular expression contains.
+    Returns a list of requirements. Every requirement is a literal string, or
+    a list of alternatives, each a list of requirements.
+    """
+    reqs = []
+    literal = []
+    for op,av in subpattern:
+        if (op == sre_constants.LITERAL) and (av < 0x80):
+            literal.append(chr(av))
+            continue
+        # Anchors match no characters:
+        if op == sre_constants.AT:
+            continue
+
+        if op == sre_constants.BRANCH:
+            alts = [_required_text(branch) for branch in av[1]]
+            # The parser moves a common prefix of the alternatives before
+            # them. It is joined back to every alternative:
+            if len(literal) > 0:
+                prefix = ''.join(literal)
+                literal = []
+                for branch,alt in zip(av[1],alts):
+                    if (len(branch) > 0) and \
+                            (branch[0][0] == sre_constants.LITERAL) and \
+                            (branch[0][1] < 0x80):
+                        alt[0] = prefix + alt[0]
+                    else:
+                        alt.insert(0,prefix)
+            reqs.append(alts)
+            continue
+
+        if len(literal) > 0:
+            reqs.append(''.join(literal))
+            literal = []
+        if op == sre_constants.SUBPATTERN:
+            reqs.extend(_required_text(av[1]))
+        elif op in (sre_constants.MAX_REPEAT,sre_constants.MIN_REPEAT):
+            # Only repeats of at least once are required:
+            if av[0] >= 1:
+                reqs.extend(_required_text(av[2]))
+
+    if len(literal) > 0:
+        reqs.append(''.join(literal))
+    return reqs
+
+def required_text(regex):
+    """
+    Get the text that every match of a regular expression (A pattern string
+    or a compiled pattern) contains (See _required_text).
+    """
+    regex = compile_regex(regex)
+    return _required_text(sre_parse.parse(regex.pattern,regex.flags))
+
+def literal_tokens(literal):
+    """
+    Get the fts tokens that are completely inside a literal string: Tokens
+    that have a separator on both of their sides. The tokens are consecutive
+    in the text of a line that contains the literal.
+    """
+    return [match.group() for match in TOKEN_REGEX.finditer(literal)
+            if (match.start() > 0) and (match.end() < len(literal))]
@@ -2,8 +2,114 @@ import os
 from .usqlite3 import sqlite3
 from .exceptions import SearchDBError
 from .types import hex_to_data, data_to_hex,\
-    Xref, Line, Function
+    Xref, Line, LazyLine, Function, Block, Operand, SDBVersions, XrefTypes
+from . import line_query
+from .line_query import LineQuery
+from .graph import Graph
+from . import byte_search
+from .byte_search import BytePattern
+from .segment_image import SegmentImage, gen_image_path
+from .regex_text import sql_regexp
+from . import query_cache
+from .query_cache import QueryCache, gen_cache_path, get_sdb_stamp, query_key
 
+# Columns of the lines table, by the storage of lines (See
+# get_lines_version):
+LINE_COLUMNS = {
+    SDBVersions.HEX: 'address,type,line_text_hex,line_data_hex',
+    SDBVersions.RAW: 'address,type,line_text,line_data',
+}
+
+
+def get_lines_version(version):
+    """
+    Get the storage of lines of an sdb version: HEX, or RAW for all the
+    later versions.
+    """
+    if version == SDBVersions.HEX:
+        return SDBVersions.HEX
+    return SDBVersions.RAW
+
+
+def hex_row_to_line(row):
+    """
+    Convert a row of a HEX version sdb to a Line.
+    """
+    return Line(row[0],row[1],hex_to_data(row[2]),hex_to_data(row[3]))
+
+def raw_row_to_line(row):
+    """
+    Convert a row of a RAW version sdb to a Line.
+    """
+    return Line(row[0],row[1],row[2],str(row[3]))
+
+# Row to Line conversion functions, by the storage of lines:
+ROW_TO_LINE = {
+    SDBVersions.HEX: hex_row_to_line,
+    SDBVersions.RAW: raw_row_to_line,
+}
+
+
+def hex_row_to_lazy_line(row):
+    """
+    Convert a row of a HEX version sdb to a LazyLine.
+    """
+    return LazyLine(row[0],row[1],row[2],row[3],hex_to_data,hex_to_data)
+
+def raw_row_to_lazy_line(row):
+    """
+    Convert a row of a RAW version sdb to a LazyLine. The text is already
+    decoded, and data is a buffer.
+    """
+    return LazyLine(row[0],row[1],row[2],row[3],None,str)
+
+# Row to LazyLine conversion functions, by the storage of lines:
+ROW_TO_LAZY_LINE = {
+    SDBVersions.HEX: hex_row_to_lazy_line,
+    SDBVersions.RAW: raw_row_to_lazy_line,
+}
+
+# Fields of a Line, in the order of the columns in LINE_COLUMNS:
+LINE_FIELDS = ['address','line_type','text','data']
+
+# Functions that decode the (text,data) columns, by the storage of lines.
+# None means that the column needs no decoding:
+LINE_DECODERS = {
+    SDBVersions.HEX: (hex_to_data,hex_to_data),
+    SDBVersions.RAW: (None,str),
+}
+
+
+# Maximum amount of addresses in one batch query. Old sqlite versions allow
+# at most 999 parameters in a query:
+MAX_BATCH_ADDRESSES = 0x200
+
+def iter_batches(addresses,batch_size=MAX_BATCH_ADDRESSES):
+    """
+    Split an iterable of addresses to lists of at most batch_size unique
+    addresses.
+    """
+    batch = []
+    for address in sorted(set(addresses)):
+        batch.append(address)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def sql_params_list(amount):
+    """
+    Get a list of amount sql parameters: ?,?,...
+    """
+    return ','.join('?' * amount)
+
+
+def sql_hex_to_data(data_hex):
+    """
+    hex_to_data for use inside sql queries.
+    """
+    return hex_to_data(data_hex)
 
 def ident_iter_proxy(input_iter):
     """
@@ -14,25 +120,199 @@ def ident_iter_proxy(input_iter):
         yield elem
 
 class SearchDB(object):
-    def __init__(self,sdb_path,iter_proxy=ident_iter_proxy):
+    def __init__(self,sdb_path,iter_proxy=ident_iter_proxy,lazy_lines=False,
+            query_builder=False):
+        """
+        Open the sdb at sdb_path. Results are wrapped with iter_proxy.
+        If lazy_lines is True, lines are returned as LazyLine objects, that
+        decode their text and data only when accessed.
+        If query_builder is True, the methods that return lines return lazy
+        LineQuery objects instead, that can be filtered further in sql.
+        """
         self._sdb_path = sdb_path
+        self._query_builder = query_builder
         self._iter_proxy = iter_proxy
         if not os.path.isfile(sdb_path):
             raise SearchDBError('SearchDB {} Does not exist'\
                     .format(sdb_path))
 
         self._conn = sqlite3.connect(self._sdb_path)
+        # Line text is plain ascii, we don't want to decode it to unicode:
+        self._conn.text_factory = str
+        # Regular expressions over the text of lines (See
+        # line_query.text_regex):
+        self._conn.create_function('regexp',2,sql_regexp)
+        self._conn.create_function('hex_to_data',1,sql_hex_to_data)
+
+        self._version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if not (SDBVersions.HEX <= self._version <= SDBVersions.CURRENT):
+            self._conn.close()
+            raise SearchDBError('SearchDB {} has unsupported version {}'\
+                    .format(sdb_path,self._version))
+
+        self._lines_version = get_lines_version(self._version)
+        self._line_columns = LINE_COLUMNS[self._lines_version]
+        self._lazy_lines = lazy_lines
+        if lazy_lines:
+            self._row_to_line = ROW_TO_LAZY_LINE[self._lines_version]
+        else:
+            self._row_to_line = ROW_TO_LINE[self._lines_version]
+
+        # Size of the largest function chunk (Calculated on first use):
+        self._max_chunk_size = None
+        # Size of the largest block (Calculated on first use):
+        self._max_block_size = None
+        # The segment image (Opened on first use):
+        self._image = None
+        # Amount of lines (Calculated on first use):
+        self._num_lines = None
+        # Amounts of lines that contain text tokens, by token:
+        self._token_documents_cache = {}
+        # The query result cache (See open_cache):
+        self._cache = None
+
+    def _check_fields(self,fields):
+        """
+        Make sure that all the requested fields of lines exist.
+        """
+        if fields is None:
+            return
+
+        for field in fields:
+            if field not in LINE_FIELDS:
+                raise SearchDBError('Unknown line field {}'.format(field))
 
-    def all_lines(self):
+    def _get_line_columns(self,fields=None):
         """
-        Return all lines
+        Get the columns to select from the lines table, for the requested
+        fields of lines. Columns of fields that were not requested are
+        replaced by NULL, so that they are never read.
         """
-        rows = self._conn.execute("""SELECT address,type,line_text_hex,
-            line_data_hex FROM lines""")
+        if fields is None:
+            return self._line_columns
 
-        return self._iter_proxy(
-                (Line(row[0],row[1],hex_to_data(row[2]),hex_to_data(row[3])) 
-                    for row in rows))
+        return ','.join(column if field in fields else 'NULL'
+            for field,column in zip(LINE_FIELDS,self._line_columns.split(',')))
+
+    def _get_row_to_line(self,fields=None):
+        """
+        Get a function that converts a row of the lines table to a line,
+        decoding only the requested fields. Fields that were not requested
+        are None.
+        """
+        if fields is None:
+            return self._row_to_line
+
+        decode_text,decode_data = LINE_DECODERS[self._lines_version]
+        if 'text' not in fields:
+            decode_text = None
+        if 'data' not in fields:
+            decode_data = None
+
+        if self._lazy_lines:
+            return lambda row:LazyLine(row[0],row[1],row[2],row[3],
+                    decode_text,decode_data)
+
+        def row_to_line(row):
+            text = row[2] if decode_text is None else decode_text(row[2])
+            data = row[3] if decode_data is None else decode_data(row[3])
+            return Line(row[0],row[1],text,data)
+
+        return row_to_line
+
+    def _query_lines(self,where_sql,params,fields=None):
+        """
+        Get an iterator of the lines that satisfy an sql condition.
+        If the query result cache is open, the addresses of the lines are
+        taken from the cache, or cached once the iteration is done. Queries
+        of all the lines are not cached.
+        """
+        cache = self._get_cache()
+        if (cache is not None) and (where_sql != '1'):
+            key = query_key('SELECT address FROM lines WHERE ' + where_sql,
+                    params)
+            addresses = cache.get(key)
+            if addresses is not None:
+                return self._lines_by_addresses(addresses,fields)
+
+            # The address is selected separately, in case it is not one of
+            # the requested fields:
+            rows = self._conn.execute('SELECT address,{} FROM lines WHERE {}'\
+                    .format(self._get_line_columns(fields),where_sql),params)
+            row_to_line = self._get_row_to_line(fields)
+            return self._iter_caching(cache,key,
+                    ((row[0],row_to_line(row[1:])) for row in rows))
+
+        rows = self._conn.execute('SELECT {} FROM lines WHERE {}'.format(
+            self._get_line_columns(fields),where_sql),params)
+        row_to_line = self._get_row_to_line(fields)
+        return (row_to_line(row) for row in rows)
+
+    def _lines_by_addresses(self,addresses,fields=None):
+        """
+        Get an iterator of the lines at a list of addresses, in the order of
+        the list.
+        """
+        if fields == ['address']:
+            # Nothing to read from the lines table:
+            row_to_line = self._get_row_to_line(fields)
+            for address in addresses:
+                yield row_to_line((address,None,None,None))
+            return
+
+        for i in xrange(0,len(addresses),MAX_BATCH_ADDRESSES):
+            batch = addresses[i:i + MAX_BATCH_ADDRESSES]
+            lines = self.get_lines(batch,fields)
+            for address in batch:
+                if address in lines:
+                    yield lines[address]
+
+    def _iter_caching(self,cache,key,address_lines):
+        """
+        Yield the lines of an iterable of (address,line) pairs. Once all the
+        lines were yielded, their addresses are cached under key.
+        """
+        addresses = []
+        for address,line in address_lines:
+            addresses.append(address)
+            yield line
+        cache.put(key,addresses)
+
+    def _exists_line(self,where_sql,params):
+        """
+        Check if any line satisfies an sql condition.
+        """
+        return self._conn.execute(
+                'SELECT EXISTS (SELECT 1 FROM lines WHERE {})'.format(
+                    where_sql),params).fetchone()[0] == 1
+
+    def _lines_where(self,cond,fields=None):
+        """
+        Get the lines that satisfy a condition (line_query.Cond). In query
+        builder mode, a LineQuery is returned without running it.
+        """
+        self._check_fields(fields)
+        query = LineQuery(self,[] if cond is None else [cond],fields)
+        if self._query_builder:
+            return query
+        return self._iter_proxy(query._execute())
+
+    def query(self,fields=None):
+        """
+        Get a LineQuery of all lines. Filter it with the conditions of
+        line_query, which are compiled to one sql query.
+        """
+        self._check_fields(fields)
+        return LineQuery(self,[],fields)
+
+    def all_lines(self,fields=None):
+        """
+        Return all lines.
+        fields is an optional list of the Line fields to fetch (See
+        LINE_FIELDS). This applies to all the methods that return lines.
+        Fields that are not fetched are None.
+        """
+        return self._lines_where(None,fields)
 
     def all_functions(self):
         """
@@ -71,153 +351,766 @@ class SearchDB(object):
 
         return self._iter_proxy((Xref(row[0],row[1],row[2]) for row in rows))
 
+    def _xrefs_many(self,column,addresses):
+        """
+        Get the xrefs of many addresses, grouped by the value of a column
+        (line_from or line_to).
+        """
+        res = {}
+        for batch in iter_batches(addresses):
+            for address in batch:
+                res[address] = []
+            rows = self._conn.execute(
+                    'SELECT xref_type, line_from, line_to FROM xrefs '
+                    'WHERE {} IN ({})'.format(column,
+                        sql_params_list(len(batch))),batch)
+            key_index = 1 if column == 'line_from' else 2
+            for row in rows:
+                res[row[key_index]].append(Xref(row[0],row[1],row[2]))
+
+        return res
+
+    def xrefs_to_many(self,lines_to):
+        """
+        Get all the xrefs to many lines.
+        Returns a dictionary: line_to -> list of xrefs to the line.
+        """
+        return self._xrefs_many('line_to',lines_to)
+
+    def xrefs_from_many(self,lines_from):
+        """
+        Get all the xrefs from many lines.
+        Returns a dictionary: line_from -> list of xrefs from the line.
+        """
+        return self._xrefs_many('line_from',lines_from)
+
+    def _xrefs_transitive(self,column,address,max_depth,xref_types):
+        """
+        Get the xrefs on all the chains of xrefs that end (column = line_to)
+        or start (column = line_from) at an address, up to max_depth xrefs
+        long. The chains are followed in one recursive sql query.
+        """
+        other_column = 'line_from' if column == 'line_to' else 'line_to'
+        types_sql,types_params = line_query._xref_types_cond(xref_types,
+                by_line_to=(column == 'line_to'))
+        if max_depth is None:
+            # A constant depth lets UNION remove addresses that were already
+            # reached, which ends the recursion on cycles:
+            depth_sql,max_depth = '0',1
+        else:
+            depth_sql = 'reach.depth + 1'
+
+        rows = self._conn.execute("""WITH RECURSIVE
+            reach(address,depth) AS (SELECT ?,0 UNION
+                SELECT xrefs.{other}, {depth} FROM reach INNER JOIN xrefs ON
+                xrefs.{column} = reach.address
+                WHERE reach.depth < ?{types})
+            SELECT xref_type, line_from, line_to FROM xrefs
+            WHERE {column} IN (SELECT address FROM reach WHERE depth < ?)
+            {types}""".format(column=column,other=other_column,
+                depth=depth_sql,types=types_sql),
+            (address,max_depth) + types_params + (max_depth,) + types_params)
+
+        return self._iter_proxy((Xref(row[0],row[1],row[2]) for row in rows))
+
+    def xrefs_to_transitive(self,line_to,max_depth=None,xref_types=None):
+        """
+        Get the xrefs of all the chains of xrefs that lead to <line_to>, up
+        to max_depth xrefs long. If xref_types is given, only xrefs of those
+        types (XrefTypes) are followed.
+        """
+        return self._xrefs_transitive('line_to',line_to,max_depth,xref_types)
+
+    def xrefs_from_transitive(self,line_from,max_depth=None,xref_types=None):
+        """
+        Get the xrefs of all the chains of xrefs that start at <line_from>,
+        up to max_depth xrefs long. If xref_types is given, only xrefs of
+        those types (XrefTypes) are followed.
+        """
+        return self._xrefs_transitive('line_from',line_from,max_depth,
+                xref_types)
+
+    def code_flow_block(self,line_address,fields=None):
+        """
+        Get the lines of the basic block that contains a line, by following
+        CODE_FLOW xrefs. A block ends at a line that branches, and starts at
+        a jump target.
+        """
+        return self._lines_where(line_query.in_code_flow_block(line_address),
+                fields)
+
+    def xref_graph(self,xref_types=None):
+        """
+        Load the xrefs into an in memory graph of lines (Graph).
+        If xref_types is given, only xrefs of those types (XrefTypes) are
+        loaded.
+        """
+        types_sql,types_params = line_query._xref_types_cond(xref_types)
+        rows = self._conn.execute(
+                'SELECT line_from, line_to FROM xrefs WHERE 1' + types_sql,
+                types_params)
+        return Graph(rows)
+
+    def call_graph(self):
+        """
+        Load the calls between functions into an in memory graph of
+        functions (Graph). There is an edge from a function to another
+        function if a line of the first function has a jump xref to the
+        address of the second function.
+        """
+        if self._version == SDBVersions.HEX:
+            rows = self._conn.execute("""SELECT DISTINCT funcs_lines.func,
+                xrefs.line_to FROM xrefs INNER JOIN funcs_lines ON
+                funcs_lines.line = xrefs.line_from
+                WHERE xrefs.xref_type = ? AND
+                xrefs.line_to IN (SELECT address FROM funcs)""",
+                (XrefTypes.CODE_JUMP,))
+        else:
+            # Like funcs_by_line, for the line_from of every xref:
+            rows = self._conn.execute("""SELECT DISTINCT funcs_chunks.func,
+                xrefs.line_to FROM xrefs INNER JOIN funcs_chunks ON
+                funcs_chunks.start_address <= xrefs.line_from AND
+                funcs_chunks.start_address >= xrefs.line_from - ? AND
+                funcs_chunks.end_address > xrefs.line_from
+                WHERE xrefs.xref_type = ? AND
+                xrefs.line_to IN (SELECT address FROM funcs)""",
+                (self._get_max_chunk_size(),XrefTypes.CODE_JUMP))
+
+        edges = list(rows)
+        funcs = [row[0] for row in
+                self._conn.execute('SELECT address FROM funcs')]
+        return Graph(edges,funcs)
 
-    def get_line(self,line_address):
+
+    def get_line(self,line_address,fields=None):
         """
         Get line by line address
         """
+        self._check_fields(fields)
         row = self._conn.execute(
-                'SELECT address, type,line_text_hex,line_data_hex FROM lines '
-                'WHERE address = ?', (line_address,)).fetchone()
+                'SELECT {} FROM lines WHERE address = ?'\
+                        .format(self._get_line_columns(fields)),
+                        (line_address,)).fetchone()
 
         if row is None:
             raise SearchDBError('Line of address {} is not in sdb'\
-                    .format(address))
+                    .format(line_address))
+
+        return self._get_row_to_line(fields)(row)
 
-        return Line(row[0],row[1],hex_to_data(row[2]),hex_to_data(row[3]))
+    def get_lines(self,line_addresses,fields=None):
+        """
+        Get many lines by their addresses.
+        Returns a dictionary: address -> line. Addresses that are not in the
+        sdb are left out.
+        """
+        self._check_fields(fields)
+        columns = self._get_line_columns(fields)
+        row_to_line = self._get_row_to_line(fields)
+        res = {}
+        for batch in iter_batches(line_addresses):
+            # The address is selected separately, in case it is not one of
+            # the requested fields:
+            rows = self._conn.execute(
+                    'SELECT address,{} FROM lines WHERE address IN ({})'\
+                            .format(columns,sql_params_list(len(batch))),batch)
+            for row in rows:
+                res[row[0]] = row_to_line(row[1:])
 
+        return res
 
-    def lines_in_func(self,func_addr):
+
+    def _get_max_chunk_size(self):
         """
-        Return the addresses of all lines 
+        Get the size of the largest function chunk. Used to bound the range
+        of chunks that could contain a given line.
         """
-        rows = self._conn.execute("""SELECT address,type,line_text_hex,line_data_hex 
-            FROM lines INNER JOIN  funcs_lines ON 
-            lines.address = funcs_lines.line WHERE funcs_lines.func = ?""",
-            (func_addr,))
+        if self._max_chunk_size is None:
+            row = self._conn.execute("""SELECT
+                MAX(end_address - start_address) FROM funcs_chunks""")\
+                    .fetchone()
+            self._max_chunk_size = row[0] or 0
+
+        return self._max_chunk_size
 
-        return self._iter_proxy(
-                (Line(row[0],row[1],hex_to_data(row[2]),hex_to_data(row[3]))
-                    for row in rows))
+    def lines_in_func(self,func_addr,fields=None):
+        """
+        Return all the lines of a function.
+        """
+        return self._lines_where(line_query.in_function(func_addr),fields)
 
 
     def funcs_by_line(self,line_address):
         """
         Return all functions that contain a line.
         """
-        rows = self._conn.execute("""SELECT address,name 
-            FROM funcs INNER JOIN  funcs_lines ON 
-            funcs.address = funcs_lines.func 
-            WHERE funcs_lines.line = ?""",
-            (line_address,))
+        if self._version == SDBVersions.HEX:
+            rows = self._conn.execute("""SELECT address,name 
+                FROM funcs INNER JOIN  funcs_lines ON 
+                funcs.address = funcs_lines.func 
+                WHERE funcs_lines.line = ?""",
+                (line_address,))
+            return self._iter_proxy((Function(row[0],row[1]) for row in rows))
+
+        # Only chunks that start at most max_chunk_size before the line could
+        # contain it. This allows a bounded range scan over the chunks index:
+        rows = self._conn.execute("""SELECT DISTINCT address,name 
+            FROM funcs_chunks INNER JOIN funcs ON 
+            funcs.address = funcs_chunks.func 
+            WHERE funcs_chunks.start_address <= ? AND
+            funcs_chunks.start_address >= ? AND
+            funcs_chunks.end_address > ?""",
+            (line_address,line_address - self._get_max_chunk_size(),
+                line_address,))
 
         return self._iter_proxy((Function(row[0],row[1]) for row in rows))
 
-    def match_text_fts(self,match_query):
+    def funcs_by_lines(self,line_addresses):
         """
-        Return all lines that match a certain match_query
-        Supports fts4 query syntax.
+        Get the functions that contain many lines.
+        Returns a dictionary: line address -> list of functions that contain
+        the line.
         """
-        rows = self._conn.execute("""SELECT address,type,line_text_hex,
-            line_data_hex FROM lines WHERE address IN 
-            (SELECT rowid from lines_text_fts WHERE lines_text_fts MATCH ?)""",
-            (match_query,))
+        res = {}
+        for batch in iter_batches(line_addresses):
+            for address in batch:
+                res[address] = []
 
-        return self._iter_proxy(
-                (Line(row[0],row[1],hex_to_data(row[2]),hex_to_data(row[3])) 
-                    for row in rows))
+            if self._version == SDBVersions.HEX:
+                rows = self._conn.execute("""SELECT line,address,name
+                    FROM funcs INNER JOIN funcs_lines ON
+                    funcs.address = funcs_lines.func
+                    WHERE funcs_lines.line IN ({})""".format(
+                        sql_params_list(len(batch))),batch)
+            else:
+                # Like funcs_by_line, for a table of the batch addresses:
+                rows = self._conn.execute("""WITH batch(line) AS
+                    (VALUES {})
+                    SELECT DISTINCT line,address,name
+                    FROM batch INNER JOIN funcs_chunks ON
+                    funcs_chunks.start_address <= batch.line AND
+                    funcs_chunks.start_address >= batch.line - ? AND
+                    funcs_chunks.end_address > batch.line
+                    INNER JOIN funcs ON funcs.address = funcs_chunks.func"""\
+                    .format(','.join(['(?)'] * len(batch))),
+                    batch + [self._get_max_chunk_size()])
 
-    def match_text_tokens_fts(self,match_query):
+            for row in rows:
+                res[row[0]].append(Function(row[1],row[2]))
+
+        return res
+
+    def _check_blocks(self):
+        """
+        Make sure that the sdb stores basic blocks.
+        """
+        if self._version < SDBVersions.BLOCKS:
+            raise SearchDBError('SearchDB of version {} has no blocks'\
+                    .format(self._version))
+
+    def _get_max_block_size(self):
+        """
+        Get the size of the largest block. Used to bound the range of blocks
+        that could contain a given line (Like _get_max_chunk_size).
+        """
+        if self._max_block_size is None:
+            row = self._conn.execute("""SELECT
+                MAX(end_address - start_address) FROM blocks""").fetchone()
+            self._max_block_size = row[0] or 0
+
+        return self._max_block_size
+
+    def all_blocks(self):
+        """
+        Return all basic blocks.
+        """
+        self._check_blocks()
+        rows = self._conn.execute(
+                'SELECT start_address,end_address FROM blocks')
+        return self._iter_proxy((Block(row[0],row[1]) for row in rows))
+
+    def block_by_line(self,line_address):
+        """
+        Get the basic block that contains a line, or None if the line is not
+        inside a block.
+        """
+        self._check_blocks()
+        # Blocks do not overlap. Only the last block that starts before the
+        # line could contain it:
+        row = self._conn.execute("""SELECT start_address,end_address
+            FROM blocks WHERE start_address =
+            (SELECT MAX(start_address) FROM blocks WHERE start_address <= ?)
+            AND end_address > ?""",
+            (line_address,line_address)).fetchone()
+        if row is None:
+            return None
+        return Block(row[0],row[1])
+
+    def lines_in_block(self,block_address,fields=None):
+        """
+        Return all the lines of the basic block that starts at block_address.
+        """
+        self._check_blocks()
+        return self._lines_where(line_query.in_block(block_address),fields)
+
+    def blocks_with_all(self,conds):
+        """
+        Get the basic blocks that contain, for every condition
+        (line_query.Cond), a line that satisfies it. The search is one sql
+        query.
+        """
+        self._check_blocks()
+        sqls = []
+        params = ()
+        for cond in conds:
+            cond_sql,cond_params = cond.compile(self)
+            # Only blocks that start at most max_block_size before a line
+            # could contain it (See funcs_by_line):
+            sqls.append("""start_address IN (SELECT blocks.start_address
+                FROM lines INNER JOIN blocks ON
+                blocks.start_address <= lines.address AND
+                blocks.start_address >= lines.address - ? AND
+                blocks.end_address > lines.address
+                WHERE {})""".format(cond_sql))
+            params += (self._get_max_block_size(),) + cond_params
+
+        rows = self._conn.execute("""SELECT start_address,end_address
+            FROM blocks WHERE {}""".format(' AND '.join(sqls) or '1'),params)
+        return self._iter_proxy((Block(row[0],row[1]) for row in rows))
+
+    def blocks_text(self,texts):
+        """
+        Get the basic blocks that contain lines with all the given texts.
+        """
+        return self.blocks_with_all([line_query.text_contains(text)
+            for text in texts])
+
+    def blocks_text_tokens(self,token_queries):
+        """
+        Get the basic blocks that contain lines with all the given text
+        tokens.
+        """
+        return self.blocks_with_all([line_query.text_tokens(tokens)
+            for tokens in token_queries])
+
+    def _check_data_pages(self):
+        """
+        Make sure that the sdb stores data pages.
+        """
+        if self._version < SDBVersions.DATA_PAGES:
+            raise SearchDBError('SearchDB of version {} has no data pages'\
+                    .format(self._version))
+
+    def _candidate_pages(self,pattern):
+        """
+        Get the sorted ids of the data pages where a match of a pattern
+        (BytePattern) could start, using the ngram index.
+        """
+        keys = list(set(key for _,key in pattern.ngrams))
+        # A posting list may be split between a few chunks of pages:
+        sizes = {}
+        for batch in iter_batches(keys):
+            sizes.update(self._conn.execute("""SELECT ngram,
+                SUM(length(pages)) FROM data_ngrams WHERE ngram IN ({})
+                GROUP BY ngram""".format(sql_params_list(len(batch))),batch))
+        # An ngram that is nowhere in the data:
+        if len(sizes) < len(keys):
+            return []
+
+        # Intersect the posting lists of the rarest ngrams:
+        ngrams = sorted(pattern.ngrams,key=lambda ngram:sizes[ngram[1]])
+        candidates = None
+        for offset,key in ngrams[:byte_search.MAX_PATTERN_NGRAMS]:
+            page_ids = []
+            for row in self._conn.execute(
+                    'SELECT pages FROM data_ngrams WHERE ngram = ?',(key,)):
+                page_ids.extend(byte_search.unpack_pages(row[0]))
+            starts = pattern.start_pages(offset,page_ids)
+            if candidates is None:
+                candidates = starts
+            else:
+                candidates &= starts
+        return sorted(candidates)
+
+    def _find_in_pages(self,pattern,page_ids):
+        """
+        Verify the matches of a pattern (BytePattern) that start inside some
+        data pages. Yields the addresses of the matches.
+        """
+        # Pages after every page, that could contain the end of a match:
+        num_next = (pattern.size - 1 + byte_search.DATA_PAGE_SIZE - 1) // \
+                byte_search.DATA_PAGE_SIZE
+        for batch in iter_batches(page_ids):
+            needed = set(page_id + i for page_id in batch
+                    for i in xrange(num_next + 1))
+            pages = {}
+            for needed_batch in iter_batches(needed):
+                for page_id,address,data in self._conn.execute(
+                        """SELECT id,address,data FROM data_pages
+                        WHERE id IN ({})""".format(
+                            sql_params_list(len(needed_batch))),needed_batch):
+                    pages[page_id] = (address,str(data))
+
+            for page_id in batch:
+                if page_id not in pages:
+                    continue
+                address,data = pages[page_id]
+                # Data of the following pages of the same run:
+                next_parts = []
+                end = address + len(data)
+                for next_id in xrange(page_id + 1,page_id + num_next + 1):
+                    if (next_id not in pages) or (pages[next_id][0] != end):
+                        break
+                    next_parts.append(pages[next_id][1])
+                    end += len(pages[next_id][1])
+
+                for match_address in pattern.find(address,data,
+                        ''.join(next_parts)):
+                    yield match_address
+
+    def data_pattern_addresses(self,pattern,use_index=True):
+        """
+        Get the sorted addresses of all the matches of a byte pattern, like
+        'E8 ?? ?? ?? ?? 85 C0', in the data of all the lines. A match can
+        span many lines. '?' is a wildcard of one hex digit.
+        If use_index is False, all the data is scanned.
+        """
+        self._check_data_pages()
+        pattern = BytePattern(pattern)
+        cache = self._get_cache()
+        if cache is not None:
+            key = query_key('data_pattern_addresses',(pattern.regex.pattern,))
+            addresses = cache.get(key)
+            if addresses is not None:
+                return addresses
+
+        if use_index and (len(pattern.ngrams) > 0):
+            page_ids = self._candidate_pages(pattern)
+        else:
+            page_ids = [row[0] for row in
+                    self._conn.execute('SELECT id FROM data_pages')]
+
+        addresses = sorted(self._find_in_pages(pattern,page_ids))
+        if cache is not None:
+            cache.put(key,addresses)
+        return addresses
+
+    def lines_data_pattern(self,pattern,fields=None):
+        """
+        Get the lines where matches of a byte pattern start (See
+        data_pattern_addresses).
+        """
+        match_addresses = self.data_pattern_addresses(pattern)
+        line_addresses = set()
+        for batch in iter_batches(match_addresses):
+            # The line of a match is the last line that starts before it:
+            rows = self._conn.execute("""WITH batch(address) AS (VALUES {})
+                SELECT (SELECT MAX(address) FROM lines
+                WHERE address <= batch.address) FROM batch""".format(
+                    ','.join(['(?)'] * len(batch))),batch)
+            line_addresses.update(row[0] for row in rows)
+
+        lines = self.get_lines(line_addresses,fields)
+        return self._iter_proxy((lines[address]
+            for address in sorted(lines.keys())))
+
+    def open_image(self,image_path=None):
+        """
+        Map the segment image of the sdb into memory (See segment_image). By
+        default, the image is next to the sdb (See gen_sdb).
+        Returns the SegmentImage object. It is closed with the sdb.
+        """
+        if image_path is None:
+            image_path = gen_image_path(self._sdb_path)
+        image = SegmentImage(image_path)
+        if self._image is not None:
+            self._image.close()
+        self._image = image
+        return image
+
+    def _get_image(self):
+        """
+        Get the segment image, opening it on first use.
+        """
+        if self._image is None:
+            self.open_image()
+        return self._image
+
+    def image_find_data(self,data):
+        """
+        Get the addresses of all the occurrences of some data in the segment
+        image. Occurrences can span many lines.
+        """
+        return self._iter_proxy(self._get_image().find_data(data))
+
+    def image_find_regex(self,regex):
+        """
+        Get the addresses of all the matches of a regular expression over
+        bytes (A pattern string or a compiled pattern) in the segment image.
+        """
+        return self._iter_proxy(self._get_image().find_regex(regex))
+
+    def open_cache(self,cache_path=None,max_size=query_cache.DEFAULT_MAX_SIZE):
+        """
+        Open a persistent cache of query results (See query_cache), creating
+        it if it does not exist. By default, the cache is next to the sdb.
+        While the cache is open, the addresses of the results of searches
+        are cached, and repeated searches only fetch the lines at the cached
+        addresses. max_size is the maximum total size of the cached results
+        in bytes.
+        Returns the QueryCache object. It is closed with the sdb.
+        """
+        if cache_path is None:
+            cache_path = gen_cache_path(self._sdb_path)
+        cache = QueryCache(cache_path,get_sdb_stamp(self._sdb_path),max_size)
+        if self._cache is not None:
+            self._cache.close()
+        self._cache = cache
+        return cache
+
+    def _get_cache(self):
+        """
+        Get the query result cache, or None if it is not open. Results are
+        dropped if the sdb was modified since they were cached.
+        """
+        if self._cache is not None:
+            self._cache.set_stamp(get_sdb_stamp(self._sdb_path))
+        return self._cache
+
+    def cached_lines(self,name,lines,fields=None):
+        """
+        Cache the results of any iterable of lines under a name. This is
+        meant for pipelines with python filters, that can not be keyed by
+        their sql. lines must have their addresses. lines is only iterated
+        if the name is not cached, and the lines at the cached addresses are
+        fetched with the given fields.
+        Without an open cache, lines are returned as is.
+        """
+        cache = self._get_cache()
+        if cache is None:
+            return self._iter_proxy(lines)
+
+        self._check_fields(fields)
+        key = query_key('cached_lines',(name,))
+        addresses = cache.get(key)
+        if addresses is not None:
+            return self._iter_proxy(self._lines_by_addresses(addresses,fields))
+        return self._iter_proxy(self._iter_caching(cache,key,
+            ((line.address,line) for line in lines)))
+
+    def _check_instructions(self):
+        """
+        Make sure that the sdb stores the instructions of the code lines.
+        """
+        if self._version < SDBVersions.INSTRUCTIONS:
+            raise SearchDBError('SearchDB of version {} has no instructions'\
+                    .format(self._version))
+
+    def lines_by_mnemonic(self,mnemonic,fields=None):
+        """
+        Get all the code lines with some mnemonic.
+        """
+        return self._lines_where(line_query.mnemonic_is(mnemonic),fields)
+
+    def lines_with_immediate(self,value,fields=None):
+        """
+        Get all the code lines with an immediate operand of some value (Like
+        a crypto constant). Negative values are stored the way IDA gives them,
+        usually as unsigned values of the address size.
+        """
+        return self._lines_where(line_query.has_immediate(value),fields)
+
+    def lines_with_operand(self,op_index=None,op_type=None,text=None,
+            value=None,fields=None):
+        """
+        Get all the code lines with an operand that has all the given
+        properties (See line_query.has_operand).
+        """
+        return self._lines_where(line_query.has_operand(op_index,op_type,
+            text,value),fields)
+
+    def get_operands(self,line_address):
+        """
+        Get the operands of the instruction of a code line, ordered by their
+        index.
+        """
+        self._check_instructions()
+        rows = self._conn.execute("""SELECT line,op_index,type,text,value
+            FROM operands WHERE line = ? ORDER BY op_index""",(line_address,))
+        return [Operand(*row) for row in rows]
+
+    def match_text_fts(self,match_query,fields=None):
         """
         Return all lines that match a certain match_query
         Supports fts4 query syntax.
         """
-        rows = self._conn.execute("""SELECT address,type,line_text_hex,
-            line_data_hex FROM lines WHERE address IN 
-            (SELECT rowid from lines_text_tokens_fts 
-            WHERE lines_text_tokens_fts MATCH ?)""",
-            (match_query,))
+        return self._lines_where(line_query.match_text_fts(match_query),fields)
 
-        return self._iter_proxy(
-                (Line(row[0],row[1],hex_to_data(row[2]),hex_to_data(row[3])) 
-                    for row in rows))
-
-    def match_data_fts(self,match_query):
+    def match_text_tokens_fts(self,match_query,fields=None):
         """
         Return all lines that match a certain match_query
         Supports fts4 query syntax.
         """
-        rows = self._conn.execute("""SELECT address,type,line_text_hex,
-            line_data_hex FROM lines WHERE address IN 
-            (SELECT rowid from lines_data_fts WHERE lines_data_fts MATCH ?)""",
-            (match_query,))
+        return self._lines_where(line_query.match_text_tokens_fts(match_query),
+                fields)
 
-        return self._iter_proxy(
-            (Line(row[0],row[1],hex_to_data(row[2]),hex_to_data(row[3])) 
-                for row in rows))
+    def match_data_fts(self,match_query,fields=None):
+        """
+        Return all lines that match a certain match_query
+        Supports fts4 query syntax.
+        """
+        return self._lines_where(line_query.match_data_fts(match_query),fields)
 
-    def lines_text(self,match_query):
+    def lines_text(self,match_query,fields=None):
         """
         Return all lines that contain certain text inside of them.
         Supports fts4 query syntax.
         """
         query = '"{}"'.format(data_to_hex(match_query))
-        return self.match_text_fts(query)
+        return self.match_text_fts(query,fields)
 
-    def lines_text_tokens(self,match_query):
+    def lines_text_tokens(self,match_query,fields=None):
         """
         Return all lines that contain certain text tokens inside of them.
         Supports fts4 query syntax.
         """
         query = '"{}"'.format(match_query)
-        return self.match_text_tokens_fts(query)
+        return self.match_text_tokens_fts(query,fields)
+
+    def _get_num_lines(self):
+        """
+        Get the amount of lines. The statistics of the query planner are used
+        if the sdb was analyzed.
+        """
+        if self._num_lines is not None:
+            return self._num_lines
+
+        try:
+            row = self._conn.execute("""SELECT stat FROM sqlite_stat1
+                WHERE tbl = 'lines' LIMIT 1""").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        if row is not None:
+            self._num_lines = int(row[0].split()[0])
+        else:
+            self._num_lines = self._conn.execute(
+                    'SELECT COUNT(*) FROM lines').fetchone()[0]
+        return self._num_lines
+
+    def _token_documents(self,token):
+        """
+        Get the amount of lines that contain a text token (lowercase), using
+        an fts4aux table over lines_text_tokens_fts.
+        """
+        try:
+            return self._token_documents_cache[token]
+        except KeyError:
+            pass
+
+        self._conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS
+            temp.lines_text_tokens_terms
+            USING fts4aux(main,lines_text_tokens_fts)""")
+        row = self._conn.execute("""SELECT documents
+            FROM temp.lines_text_tokens_terms
+            WHERE term = ? AND col = '*'""",(token,)).fetchone()
+        documents = 0 if row is None else row[0]
+        self._token_documents_cache[token] = documents
+        return documents
+
+    def lines_regex(self,regex,fields=None,prefilter=True):
+        """
+        Return all lines whose text matches a regular expression (A pattern
+        string or a compiled pattern), using re.search.
+        If prefilter is True, the regular expression only runs on candidate
+        lines that contain a token of its literal text, found using the fts
+        tables (See line_query.text_regex_prefilter).
+        """
+        return self._lines_where(line_query.text_regex(regex,prefilter),fields)
 
-    def match_lines_data_hex(self,match_query):
+    def match_lines_data_hex(self,match_query,fields=None):
         """
         Return all lines that contain certain data hex
         Supports fts4 query syntax
         """
-        return self.match_data_fts(match_query)
+        return self.match_data_fts(match_query,fields)
 
-    def lines_data(self,data):
+    def lines_data(self,data,fields=None):
         """
         Get all lines with certain data.
         """
         data_hex = data_to_hex(data)
-        return self.match_data_fts('"{}"'.format(data_hex))
+        return self.match_data_fts('"{}"'.format(data_hex),fields)
 
-    def lines_in_range(self,start_address,end_address):
+    def lines_in_range(self,start_address,end_address,fields=None):
         """
         Get all lines in a given range of addresses, inclusive.
         """
-        rows = self._conn.execute("""SELECT address,type,line_text_hex,
-            line_data_hex FROM lines WHERE address >= ? AND address <= ?""",
-            (start_address,end_address,))
+        return self._lines_where(
+                line_query.address_in_range(start_address,end_address),fields)
 
-        return self._iter_proxy(
-            (Line(row[0],row[1],hex_to_data(row[2]),hex_to_data(row[3])) 
-                for row in rows))
-
-    def lines_above(self,line_address,dist):
+    def lines_above(self,line_address,count,fields=None):
         """
-        Get amount lines above line (Including the line itself)
+        Get count lines above line (Including the line itself)
         """
-        return self.lines_in_range(line_address - dist, line_address)
+        return self._lines_where(
+                line_query.line_context(line_address,count,0),fields)
 
+    def lines_below(self,line_address,count,fields=None):
+        """
+        Get count lines below line (Including the line itself)
+        """
+        return self._lines_where(
+                line_query.line_context(line_address,0,count),fields)
 
-    def lines_below(self,line_address,dist):
+    def lines_around(self,line_address,count,fields=None):
         """
-        Get amount lines below line (Including the line itself)
+        Get count lines above and count lines below line (Including the line
+        itself)
         """
-        return self.lines_in_range(line_address, line_address + dist)
+        return self._lines_where(
+                line_query.line_context(line_address,count,count),fields)
 
-    def lines_around(self,line_address,dist):
+    def lines_context(self,line_addresses,before,after=None,fields=None):
         """
-        Get amount lines below line (Including the line itself)
+        Get the lines around many lines: before lines above every line, the
+        line itself and after lines below it (By default as many as before).
+        Returns a dictionary: line address -> list of lines, ordered by
+        address.
         """
-        return self.lines_in_range(line_address - dist, 
-                line_address + dist)
+        if after is None:
+            after = before
+        self._check_fields(fields)
+        row_to_line = self._get_row_to_line(fields)
+        lower_sql,lower_params = line_query.context_bound_sql(
+                'batch.line',(),before,True)
+        upper_sql,upper_params = line_query.context_bound_sql(
+                'batch.line',(),after,False)
+
+        res = {}
+        for batch in iter_batches(line_addresses):
+            for address in batch:
+                res[address] = []
+            # The bounds of the context of every line, and then the lines
+            # between them:
+            rows = self._conn.execute("""WITH batch(line) AS (VALUES {}),
+                bounds(line,low_address,high_address) AS
+                (SELECT line, {}, {} FROM batch)
+                SELECT bounds.line,{} FROM bounds INNER JOIN lines ON
+                lines.address >= bounds.low_address AND
+                lines.address <= bounds.high_address
+                ORDER BY bounds.line,lines.address""".format(
+                    ','.join(['(?)'] * len(batch)),lower_sql,upper_sql,
+                    self._get_line_columns(fields)),
+                tuple(batch) + lower_params + upper_params)
+            for row in rows:
+                res[row[0]].append(row_to_line(row[1:]))
+
+        return res
 
     
     def close(self):
         self._conn.close()
+        if self._image is not None:
+            self._image.close()
+        if self._cache is not None:
+            self._cache.close()
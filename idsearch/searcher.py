@@ -3,15 +3,19 @@ from .search_db import SearchDB
 from .exceptions import IDBUtilError, SearchDBError
 from .func_iter import FuncIter
 
-def load_sdb(sdb_path):
+def load_sdb(sdb_path,lazy_lines=False,query_builder=False):
     """
     Load SearchDB for the current database.
+    If lazy_lines is True, the text and data of lines are decoded only when
+    accessed.
+    If query_builder is True, lines are returned as LineQuery objects, that
+    can be filtered further in sql using the conditions of line_query.
     """
     if not os.path.isfile(sdb_path):
         raise IDBUtilError('sdb {} does not exist. You need to generate '
             'an index first!'.format(sdb_path))
 
-    return SearchDB(sdb_path,FuncIter)
+    return SearchDB(sdb_path,FuncIter,lazy_lines,query_builder)
 
 
 
@@ -0,0 +1,150 @@
+import os
+import re
+import mmap
+import bisect
+import struct
+
+from .exceptions import SearchDBError
+
+# A segment image is a flat file with the data of all the segments, that is
+# mapped into memory and scanned without copying it.
+# The file starts with a header: IMAGE_MAGIC and the amount of segments,
+# followed by the segment map: A (start_address,end_address,offset) entry for
+# every segment, where offset is the position of the segment's data in the
+# file. Bytes of a segment that are not inside any line are zero.
+
+IMAGE_MAGIC = 'IDSIMG01'
+HEADER_STRUCT = struct.Struct('<8sI')
+SEGMENT_STRUCT = struct.Struct('<QQQ')
+
+def gen_image_path(sdb_path):
+    """
+    If sdb is c:\\temp\\my_proj.sdb, the image will be c:\\temp\\my_proj.simg
+    """
+    return os.path.splitext(sdb_path)[0] + '.simg'
+
+
+def write_image(image_path,segments,line_rows):
+    """
+    Write a segment image. segments is a list of (start_address,end_address)
+    pairs that do not overlap. line_rows is an iterable of (address,data)
+    pairs, like lines or runs of lines. Data outside of all the segments is
+    ignored.
+    """
+    segments = sorted(segments)
+    seg_starts = [start for start,_ in segments]
+    offset = HEADER_STRUCT.size + SEGMENT_STRUCT.size * len(segments)
+    seg_offsets = []
+    for start,end in segments:
+        seg_offsets.append(offset)
+        offset += end - start
+
+    with open(image_path,'wb') as f:
+        f.write(HEADER_STRUCT.pack(IMAGE_MAGIC,len(segments)))
+        for (start,end),seg_offset in zip(segments,seg_offsets):
+            f.write(SEGMENT_STRUCT.pack(start,end,seg_offset))
+        # Gaps are left as holes, that read as zeros:
+        f.truncate(offset)
+
+        for address,data in line_rows:
+            # The data may cross a few segments:
+            while len(data) > 0:
+                index = bisect.bisect_right(seg_starts,address) - 1
+                if (index < 0) or (address >= segments[index][1]):
+                    if index + 1 >= len(segments):
+                        break
+                    # Skip to the next segment:
+                    skip = segments[index + 1][0] - address
+                    address += skip
+                    data = data[skip:]
+                    continue
+                start,end = segments[index]
+                f.seek(seg_offsets[index] + address - start)
+                f.write(data[:end - address])
+                data = data[end - address:]
+                address = end
+
+
+class SegmentImage(object):
+    """
+    A segment image, mapped into memory. Addresses of the segments are
+    translated to offsets in the mapped file using the segment map.
+    """
+    def __init__(self,image_path):
+        """
+        Map the segment image at image_path into memory.
+        """
+        if not os.path.isfile(image_path):
+            raise SearchDBError('Segment image {} does not exist'\
+                    .format(image_path))
+
+        self._file = open(image_path,'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(),0,
+                    access=mmap.ACCESS_READ)
+        except (mmap.error,ValueError):
+            self._file.close()
+            raise SearchDBError('Segment image {} is invalid'\
+                    .format(image_path))
+
+        magic = None
+        if len(self._map) >= HEADER_STRUCT.size:
+            magic,num_segments = HEADER_STRUCT.unpack_from(self._map)
+        if magic != IMAGE_MAGIC:
+            self.close()
+            raise SearchDBError('Segment image {} is invalid'\
+                    .format(image_path))
+
+        # Segments are (start_address,end_address,offset) tuples, sorted by
+        # start_address:
+        self.segments = [SEGMENT_STRUCT.unpack_from(self._map,
+            HEADER_STRUCT.size + SEGMENT_STRUCT.size * i)
+            for i in xrange(num_segments)]
+        self._seg_starts = [segment[0] for segment in self.segments]
+
+    def close(self):
+        """
+        Unmap the segment image.
+        """
+        self._map.close()
+        self._file.close()
+
+    def read(self,address,size):
+        """
+        Read the data at an address. The data is cut at the end of the
+        segment. Returns None for an address outside of all the segments.
+        """
+        index = bisect.bisect_right(self._seg_starts,address) - 1
+        if index < 0:
+            return None
+        start,end,offset = self.segments[index]
+        if address >= end:
+            return None
+        data_start = offset + address - start
+        return self._map[data_start:data_start + min(size,end - address)]
+
+    def find_data(self,data):
+        """
+        Find all the occurrences of some data in the segments (Including
+        overlapping occurrences). Yields their addresses.
+        """
+        if len(data) == 0:
+            return
+        for start,end,offset in self.segments:
+            seg_end = offset + end - start
+            pos = self._map.find(data,offset,seg_end)
+            while pos >= 0:
+                yield start + pos - offset
+                pos = self._map.find(data,pos + 1,seg_end)
+
+    def find_regex(self,regex):
+        """
+        Find all the matches of a regular expression (A pattern string or a
+        compiled pattern) in the segments. Yields the addresses of the
+        matches.
+        """
+        if isinstance(regex,basestring):
+            regex = re.compile(regex,re.DOTALL)
+        for start,end,offset in self.segments:
+            for match in regex.finditer(self._map,offset,offset + end - start):
+                yield start + match.start() - offset
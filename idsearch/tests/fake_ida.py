@@ -0,0 +1,398 @@
+"""
+Fake IDA api modules (idc, idaapi, idautils).
+Allows to run the indexer outside of IDA, against a simulated IDB.
+
+Usage:
+
+    idb = FakeIDB()
+    idb.add_segment(...)
+    install(idb)
+
+    # Only now import modules that use the IDA api:
+    from idsearch.idb_indexer import index_idb
+"""
+import re
+import sys
+import types
+import collections
+from bisect import bisect_right
+
+BADADDR = 0xffffffff
+
+# Function attributes:
+FUNCATTR_END = 4
+
+# Operand types:
+o_void = 0
+o_reg = 1
+o_mem = 2
+o_phrase = 3
+o_displ = 4
+o_imm = 5
+o_near = 7
+
+REGISTERS = ['eax','ecx','edx','ebx','esp','ebp','esi','edi']
+
+
+def parse_operand(text):
+    """
+    Guess the (op_type,text,value) of an operand from its text.
+    """
+    if text in REGISTERS:
+        return (o_reg,text,REGISTERS.index(text))
+    if text.startswith('['):
+        if ('+' in text) or ('-' in text):
+            return (o_displ,text,0)
+        return (o_phrase,text,0)
+    match = re.match('^-?[0-9][0-9A-F]*h?$',text)
+    if match is not None:
+        value = int(text.rstrip('h'),16 if text.endswith('h') else 10)
+        # Like IDA, negative values are given as unsigned:
+        return (o_imm,text,value & 0xffffffff)
+    match = re.search('_([0-9A-F]+)$',text)
+    if match is not None:
+        op_type = o_near if re.search('(sub|loc)_',text) else o_mem
+        return (op_type,text,int(match.group(1),16))
+    return (o_mem,text,0)
+
+
+class FakeHead(object):
+    def __init__(self,address,text,data,is_code,size=None):
+        self.address = address
+        self.text = text
+        self.data = data
+        self.is_code = is_code
+        if size is None:
+            size = len(data)
+        self.size = size
+        # Code references without flow (Jumps, calls):
+        self.jump_refs = []
+        # Does execution flow to the next head?
+        self.flows = is_code
+        # Data references:
+        self.data_refs = []
+        # Operands of the instruction, as (op_type,text,value) tuples. None
+        # means that they are parsed from the text:
+        self.operands = None
+
+    def get_operands(self):
+        if self.operands is not None:
+            return self.operands
+        if ' ' not in self.text:
+            return []
+        return [parse_operand(op_text.strip())
+                for op_text in self.text.split(' ',1)[1].split(',')]
+
+
+class FakeChunk(object):
+    def __init__(self,start,end):
+        self.startEA = start
+        self.endEA = end
+
+
+class FakeFunction(object):
+    def __init__(self,address,name,chunks):
+        self.startEA = address
+        self.name = name
+        self.chunks = [FakeChunk(start,end) for start,end in chunks]
+
+
+class FakeFuncTailIterator(object):
+    """
+    Iterates over the chunks of a function, like
+    idaapi.func_tail_iterator_t.
+    """
+    def __init__(self,func):
+        self._chunks = func.chunks
+        self._index = 0
+
+    def main(self):
+        self._index = 0
+        return len(self._chunks) > 0
+
+    def chunk(self):
+        return self._chunks[self._index]
+
+    def next(self):
+        self._index += 1
+        return self._index < len(self._chunks)
+
+
+class FakeIDB(object):
+    def __init__(self,idb_path='fake.idb'):
+        self.idb_path = idb_path
+        # Segments (start,end) pairs:
+        self.segments = []
+        # Heads by address:
+        self.heads = {}
+        # Sorted addresses of heads:
+        self._sorted_heads = None
+        # Functions by address:
+        self.functions = {}
+        # Amount of calls to every api function:
+        self.calls = collections.Counter()
+        # Exit code given to idc.Exit:
+        self.exit_code = None
+
+    ###################################################################
+    # Building the fake IDB:
+
+    def add_segment(self,start,end):
+        self.segments.append((start,end))
+        self.segments.sort()
+
+    def add_head(self,address,text,data,is_code,size=None):
+        head = FakeHead(address,text,data,is_code,size)
+        self.heads[address] = head
+        self._sorted_heads = None
+        return head
+
+    def add_function(self,address,name,chunks=None):
+        """
+        Add a function. chunks is a list of (start,end) pairs. The first chunk
+        is the main chunk of the function.
+        """
+        if chunks is None:
+            chunks = [(address,self._func_end(address))]
+        self.functions[address] = FakeFunction(address,name,chunks)
+
+    def _func_end(self,address):
+        """
+        Find the end of a function that starts at address: The end of the
+        first head that does not flow to the next head.
+        """
+        head = self.heads[address]
+        while head.flows:
+            next_addr = head.address + head.size
+            if next_addr not in self.heads:
+                break
+            head = self.heads[next_addr]
+        return head.address + head.size
+
+    def _get_sorted_heads(self):
+        if self._sorted_heads is None:
+            self._sorted_heads = sorted(self.heads)
+        return self._sorted_heads
+
+    ###################################################################
+    # idautils:
+
+    def Segments(self):
+        self.calls['Segments'] += 1
+        return [start for start,end in self.segments]
+
+    def CodeRefsFrom(self,ea,flow):
+        self.calls['CodeRefsFrom'] += 1
+        head = self.heads[ea]
+        refs = list(head.jump_refs)
+        if flow and head.flows:
+            refs.append(ea + head.size)
+        return refs
+
+    def DataRefsFrom(self,ea):
+        self.calls['DataRefsFrom'] += 1
+        return list(self.heads[ea].data_refs)
+
+    def Functions(self):
+        self.calls['Functions'] += 1
+        return sorted(self.functions)
+
+    ###################################################################
+    # idc:
+
+    def SegStart(self,ea):
+        self.calls['SegStart'] += 1
+        for start,end in self.segments:
+            if start <= ea < end:
+                return start
+        return BADADDR
+
+    def SegEnd(self,ea):
+        self.calls['SegEnd'] += 1
+        for start,end in self.segments:
+            if start <= ea < end:
+                return end
+        return BADADDR
+
+    def NextHead(self,ea,maxea=BADADDR):
+        self.calls['NextHead'] += 1
+        sorted_heads = self._get_sorted_heads()
+        index = bisect_right(sorted_heads,ea)
+        if index >= len(sorted_heads) or sorted_heads[index] >= maxea:
+            return BADADDR
+        return sorted_heads[index]
+
+    def GetDisasm(self,ea):
+        self.calls['GetDisasm'] += 1
+        return self.heads[ea].text
+
+    def GetManyBytes(self,ea,size):
+        self.calls['GetManyBytes'] += 1
+        data = self.heads[ea].data
+        if len(data) == 0:
+            return None
+        return data[:size]
+
+    def ItemSize(self,ea):
+        self.calls['ItemSize'] += 1
+        return self.heads[ea].size
+
+    def GetFunctionAttr(self,ea,attr):
+        self.calls['GetFunctionAttr'] += 1
+        if attr != FUNCATTR_END:
+            raise NotImplementedError('Unsupported attribute {}'.format(attr))
+        return self.functions[ea].chunks[0].endEA
+
+    def GetFunctionName(self,ea):
+        self.calls['GetFunctionName'] += 1
+        return self.functions[ea].name
+
+    def GetMnem(self,ea):
+        self.calls['GetMnem'] += 1
+        return self.heads[ea].text.split(' ')[0]
+
+    def GetOpType(self,ea,n):
+        self.calls['GetOpType'] += 1
+        operands = self.heads[ea].get_operands()
+        if n >= len(operands):
+            return o_void
+        return operands[n][0]
+
+    def GetOpnd(self,ea,n):
+        self.calls['GetOpnd'] += 1
+        operands = self.heads[ea].get_operands()
+        if n >= len(operands):
+            return ''
+        return operands[n][1]
+
+    def GetOperandValue(self,ea,n):
+        self.calls['GetOperandValue'] += 1
+        operands = self.heads[ea].get_operands()
+        if n >= len(operands):
+            return -1
+        return operands[n][2]
+
+    def Exit(self,code):
+        self.calls['Exit'] += 1
+        self.exit_code = code
+
+    ###################################################################
+    # idaapi:
+
+    def ua_mnem(self,ea):
+        self.calls['ua_mnem'] += 1
+        head = self.heads.get(ea)
+        if (head is None) or (not head.is_code):
+            return None
+        return head.text.split(' ')[0]
+
+    def isCode(self,ea):
+        self.calls['isCode'] += 1
+        # Like the real api, we get a TypeError for nonexistent lines:
+        if ea not in self.heads:
+            raise TypeError('Nonexistent line')
+        return self.heads[ea].is_code
+
+    def get_func(self,ea):
+        self.calls['get_func'] += 1
+        return self.functions.get(ea)
+
+    def func_tail_iterator_t(self,func):
+        self.calls['func_tail_iterator_t'] += 1
+        return FakeFuncTailIterator(func)
+
+
+# Names of api functions inside every fake module:
+IDAUTILS_FUNCS = ['Segments','CodeRefsFrom','DataRefsFrom','Functions']
+IDC_FUNCS = ['SegStart','SegEnd','NextHead','GetDisasm','GetManyBytes',
+        'ItemSize','GetFunctionAttr','GetFunctionName','GetMnem','GetOpType',
+        'GetOpnd','GetOperandValue','Exit']
+IDAAPI_FUNCS = ['ua_mnem','isCode','get_func','func_tail_iterator_t']
+
+
+def _get_module(name):
+    """
+    Get a fake module from sys.modules, or create it.
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        module = types.ModuleType(name)
+        sys.modules[name] = module
+    return module
+
+
+def install(idb):
+    """
+    Install fake idc, idaapi and idautils modules that operate on a given
+    FakeIDB. Calling install again replaces the current FakeIDB.
+    """
+    idautils = _get_module('idautils')
+    for func_name in IDAUTILS_FUNCS:
+        setattr(idautils,func_name,getattr(idb,func_name))
+
+    idc = _get_module('idc')
+    for func_name in IDC_FUNCS:
+        setattr(idc,func_name,getattr(idb,func_name))
+    idc.FUNCATTR_END = FUNCATTR_END
+    idc.o_void = o_void
+    idc.BADADDR = BADADDR
+
+    idaapi = _get_module('idaapi')
+    for func_name in IDAAPI_FUNCS:
+        setattr(idaapi,func_name,getattr(idb,func_name))
+    idaapi.BADADDR = BADADDR
+    idaapi.cvar = types.ModuleType('cvar')
+    idaapi.cvar.database_idb = idb.idb_path
+
+
+def gen_fake_idb(num_segments,lines_per_segment,func_size=16,
+        idb_path='fake.idb'):
+    """
+    Generate a fake IDB with a large segment map.
+    Every segment contains code lines (4 bytes each), grouped into functions
+    of func_size lines, followed by a few data lines that reference code
+    and data.
+    """
+    idb = FakeIDB(idb_path)
+    seg_size = 0x100000
+    for seg_index in range(num_segments):
+        seg_start = 0x400000 + seg_index * seg_size
+        idb.add_segment(seg_start,seg_start + seg_size)
+
+        addr = seg_start
+        for line_index in range(lines_per_segment):
+            func_offset = line_index % func_size
+            if func_offset == func_size - 1:
+                head = idb.add_head(addr,'retn','\xc3\x90\x90\x90',True)
+                head.flows = False
+            elif func_offset == 2:
+                # Reference the data at the end of the segment:
+                data_addr = seg_start + lines_per_segment * 4
+                head = idb.add_head(addr,'lea eax, off_{:X}'.format(data_addr),
+                        '\x8d\x05\x00\x00',True)
+                head.data_refs.append(data_addr)
+            elif func_offset == 1:
+                # Call the start of the current function (Recursion):
+                head = idb.add_head(addr,'call sub_{:X}'.format(addr - 4),
+                        '\xe8\x00\x00\x00',True)
+                head.jump_refs.append(addr - 4)
+            else:
+                head = idb.add_head(addr,'mov eax, {:X}h'.format(line_index),
+                        '\xb8' + chr(line_index & 0xff) + '\x00\x00',True)
+            addr += head.size
+
+        code_end = addr
+        for func_start in range(seg_start,code_end,func_size * 4):
+            idb.add_function(func_start,'sub_{:X}'.format(func_start))
+
+        # A pointer to code, and a pointer to the pointer:
+        head = idb.add_head(addr,'dd offset sub_{:X}'.format(seg_start),
+                '\x00\x00\x40\x00',False)
+        head.data_refs.append(seg_start)
+        head = idb.add_head(addr + 4,'dd offset off_{:X}'.format(addr),
+                '\x00\x00\x40\x00',False)
+        head.data_refs.append(addr)
+        # Uninitialized data:
+        idb.add_head(addr + 8,'db ?','',False,size=1)
+
+    return idb
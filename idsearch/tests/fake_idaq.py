@@ -0,0 +1,76 @@
+"""
+Stub "IDA" command for testing the batch indexer.
+Runs the standalone indexer against a fake IDB, instead of running IDA.
+
+Run as follows:
+
+python fake_idaq.py <idb_path>
+
+The idb file contains a description of the fake IDB:
+- "<num_segments> <lines_per_segment>": Generate a fake IDB of this size.
+- "fail": Indexing fails.
+- "flaky": Indexing fails on the first attempt only.
+- "partial": Indexing exits successfully, but leaves a partial sdb.
+"""
+import os
+import sys
+
+if __name__ == '__main__':
+    # Allow importing idsearch when running as a script:
+    sys.path.insert(0,os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),'..','..'))
+
+from idsearch.tests.fake_ida import FakeIDB, install, gen_fake_idb
+
+class FailingIDB(FakeIDB):
+    """
+    A fake IDB where indexing fails.
+    """
+    def Segments(self):
+        raise RuntimeError('Fake indexing failure')
+
+
+class PartialIDB(FailingIDB):
+    """
+    A fake IDB where indexing fails, but IDA exits successfully.
+    """
+    def Exit(self,code):
+        super(PartialIDB,self).Exit(0)
+
+
+def gen_idb_by_desc(idb_path):
+    """
+    Generate a fake IDB by the description inside the idb file.
+    """
+    with open(idb_path,'rb') as f:
+        desc = f.read().strip()
+
+    if desc == 'fail':
+        return FailingIDB(idb_path)
+
+    if desc == 'partial':
+        return PartialIDB(idb_path)
+
+    if desc == 'flaky':
+        # Fail only on the first attempt:
+        flag_path = idb_path + '.attempted'
+        if not os.path.isfile(flag_path):
+            open(flag_path,'wb').close()
+            return FailingIDB(idb_path)
+        desc = '1 16'
+
+    num_segments,lines_per_segment = [int(x) for x in desc.split()]
+    return gen_fake_idb(num_segments,lines_per_segment,idb_path=idb_path)
+
+
+def main():
+    idb_path = sys.argv[1]
+    idb = gen_idb_by_desc(idb_path)
+    install(idb)
+
+    from idsearch.standalone_index import run
+    run()
+    sys.exit(idb.exit_code)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Generation of sdbs of old versions, to test that they can still be searched.
+"""
+from idsearch.usqlite3 import sqlite3
+from idsearch.types import data_to_hex
+
+
+def gen_hex_sdb(sdb_path,lines,xrefs,functions):
+    """
+    Generate an sdb of version SDBVersions.HEX.
+    lines is a list of (addr,line_type,line_text,line_data) tuples.
+    xrefs is a list of (xref_type,line_from,line_to) tuples.
+    functions is a list of (address,name,line_addresses) tuples.
+    """
+    conn = sqlite3.connect(sdb_path)
+
+    conn.execute("""CREATE TABLE funcs (
+        address INTEGER PRIMARY KEY,
+        name TEXT NOT NULL)""")
+
+    conn.execute("""CREATE TABLE lines (
+        address INTEGER PRIMARY KEY,
+        type INTEGER,
+        line_text_hex TEXT NOT NULL,
+        line_data_hex TEXT NOT NULL)""")
+
+    conn.execute("""CREATE VIRTUAL TABLE lines_text_fts USING fts4(
+        content="lines",  line_text_hex)""")
+
+    conn.execute("""CREATE VIRTUAL TABLE lines_text_tokens_fts USING fts4(
+        content="lines",  line_text)""")
+
+    conn.execute("""CREATE VIRTUAL TABLE lines_data_fts USING fts4(
+        content="lines", line_data_hex)""")
+
+    conn.execute("""CREATE TABLE funcs_lines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        line REFERENCES lines(address),
+        func REFERENCES funcs(address))""")
+
+    conn.execute("""CREATE TABLE xrefs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        xref_type INTEGER,
+        line_from REFERENCES lines(id),
+        line_to REFERENCES lines(id))""")
+
+    conn.executemany("""INSERT INTO lines
+        (address,type,line_text_hex,line_data_hex) VALUES (?, ?, ?, ?)""",
+        ((addr,line_type,data_to_hex(line_text),data_to_hex(line_data))
+            for addr,line_type,line_text,line_data in lines))
+
+    conn.executemany("""INSERT INTO xrefs (xref_type,line_from,line_to)
+        VALUES (?, ?, ?)""",xrefs)
+
+    for address,name,line_addresses in functions:
+        conn.execute('INSERT INTO funcs (address,name) VALUES (?, ?)',
+                (address,name))
+        conn.executemany('INSERT INTO funcs_lines (line,func) VALUES (?, ?)',
+                ((line_addr,address) for line_addr in line_addresses))
+
+    conn.execute("""INSERT INTO lines_text_fts(rowid,line_text_hex)
+        SELECT address, line_text_hex FROM lines""")
+    conn.executemany("""INSERT INTO lines_text_tokens_fts(rowid,line_text)
+        VALUES (?,?)""",((addr,line_text)
+            for addr,line_type,line_text,line_data in lines))
+    conn.execute("""INSERT INTO lines_data_fts(rowid,line_data_hex)
+        SELECT address, line_data_hex FROM lines""")
+
+    conn.commit()
+    conn.close()
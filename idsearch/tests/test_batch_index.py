@@ -0,0 +1,133 @@
+import unittest
+
+import os
+import sys
+import shutil
+import tempfile
+
+from idsearch.batch_index import find_idbs, batch_index, gen_sdb_path, \
+    CommandLauncher, Manifest, IndexStatus, ida_launcher
+from idsearch.search_db import SearchDB
+
+# Stub IDA command that indexes fake IDBs:
+FAKE_IDAQ_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        'fake_idaq.py')
+
+
+class CountingLauncher(CommandLauncher):
+    """
+    A launcher that counts the launches of every IDB.
+    """
+    def __init__(self,command_prefix):
+        super(CountingLauncher,self).__init__(command_prefix)
+        self.launches = []
+
+    def launch(self,idb_path):
+        self.launches.append(idb_path)
+        return super(CountingLauncher,self).launch(idb_path)
+
+
+class TestBatchIndex(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        self.manifest_path = os.path.join(self.my_dir,'manifest.json')
+        self.idbs_dir = os.path.join(self.my_dir,'idbs')
+        os.makedirs(os.path.join(self.idbs_dir,'sub'))
+
+    def tearDown(self):
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def write_idb(self,name,desc):
+        """
+        Write a fake idb file with a description for fake_idaq.
+        """
+        idb_path = os.path.join(self.idbs_dir,name)
+        with open(idb_path,'wb') as f:
+            f.write(desc)
+        return idb_path
+
+    def run_batch(self,launcher,**kwargs):
+        return batch_index(find_idbs([self.idbs_dir]),launcher,
+                Manifest(self.manifest_path),poll_interval=0.01,**kwargs)
+
+    def test_find_idbs(self):
+        self.write_idb('a.idb','1 16')
+        self.write_idb(os.path.join('sub','b.i64'),'1 16')
+        self.write_idb('notes.txt','')
+        idb_paths = find_idbs([self.idbs_dir])
+        self.assertEqual(sorted(os.path.basename(p) for p in idb_paths),
+                ['a.idb','b.i64'])
+
+    def test_batch(self):
+        good_paths = [self.write_idb('a.idb','1 16'),
+            self.write_idb('b.idb','2 32'),
+            self.write_idb(os.path.join('sub','c.i64'),'1 8')]
+        flaky_path = self.write_idb('flaky.idb','flaky')
+        bad_path = self.write_idb('bad.idb','fail')
+
+        launcher = CountingLauncher([sys.executable,FAKE_IDAQ_PATH])
+        failed = self.run_batch(launcher,max_workers=2,max_attempts=2)
+        self.assertEqual(failed,[bad_path])
+        self.assertEqual(launcher.launches.count(flaky_path),2)
+        self.assertEqual(launcher.launches.count(bad_path),2)
+
+        for idb_path in good_paths + [flaky_path]:
+            sdb = SearchDB(gen_sdb_path(idb_path))
+            self.assertGreater(sum(1 for _ in sdb.all_lines()),0)
+            sdb.close()
+
+        manifest = Manifest(self.manifest_path)
+        self.assertEqual(manifest.get_status(good_paths[0]),IndexStatus.DONE)
+        self.assertEqual(manifest.get_status(flaky_path),IndexStatus.DONE)
+        self.assertEqual(manifest.get_entry(flaky_path)['attempts'],2)
+        self.assertEqual(manifest.get_status(bad_path),IndexStatus.FAILED)
+        self.assertEqual(manifest.get_entry(bad_path)['error'],'Exit code 1')
+
+        # Up to date IDBs are skipped on the next run:
+        launcher = CountingLauncher([sys.executable,FAKE_IDAQ_PATH])
+        failed = self.run_batch(launcher,max_attempts=1)
+        self.assertEqual(failed,[bad_path])
+        self.assertEqual(launcher.launches,[bad_path])
+
+    def test_idb_written_on_exit(self):
+        idb_path = self.write_idb('a.idb','1 16')
+        launcher = CountingLauncher([sys.executable,FAKE_IDAQ_PATH])
+        self.assertEqual(self.run_batch(launcher),[])
+
+        # IDA writes the IDB after the sdb when it exits, so the sdb is
+        # older:
+        idb_mtime = os.path.getmtime(idb_path)
+        os.utime(gen_sdb_path(idb_path),(idb_mtime - 10,idb_mtime - 10))
+        self.assertEqual(self.run_batch(launcher),[])
+        self.assertEqual(launcher.launches,[idb_path])
+
+        # Indexed again when the IDB changes:
+        with open(idb_path,'ab') as f:
+            f.write(' ')
+        self.assertEqual(self.run_batch(launcher),[])
+        self.assertEqual(launcher.launches,[idb_path] * 2)
+
+    def test_partial(self):
+        idb_path = self.write_idb('a.idb','partial')
+        launcher = CountingLauncher([sys.executable,FAKE_IDAQ_PATH])
+        self.assertEqual(self.run_batch(launcher,max_attempts=2),[idb_path])
+        # Retried in the same batch:
+        self.assertEqual(launcher.launches,[idb_path] * 2)
+        self.assertEqual(Manifest(self.manifest_path).get_entry(idb_path)\
+                ['error'],'sdb is partial')
+
+    def test_ida_launcher(self):
+        launcher = ida_launcher('idaq.exe',os.path.join('a b','script.py'))
+        self.assertEqual(launcher.command('my.idb'),['idaq.exe','-A',
+            '-S"{}"'.format(os.path.join('a b','script.py')),'my.idb'])
+
+    def test_timeout(self):
+        idb_path = self.write_idb('a.idb','1 16')
+        launcher = CommandLauncher([sys.executable,'-c',
+            'import time; time.sleep(30)'])
+        failed = self.run_batch(launcher,max_attempts=1,timeout=0.2)
+        self.assertEqual(failed,[idb_path])
+        self.assertTrue(Manifest(self.manifest_path).get_entry(idb_path)\
+                ['error'].startswith('Timeout'))
@@ -0,0 +1,148 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.line_query import line_type_is, has_xrefs_from
+from idsearch.types import LineTypes, XrefTypes
+from idsearch.exceptions import SearchDBError
+from idsearch.tests.legacy_sdb import gen_hex_sdb
+
+# Example rows: A function with a call and a loop, and a called function.
+EXAMPLE_LINES = [
+    (0x1000, LineTypes.CODE, 'push ebp', '\x55'),
+    (0x1001, LineTypes.CODE, 'mov ebp, esp', '\x8b\xec'),
+    (0x1003, LineTypes.CODE, 'call sub_2000', '\xe8\xf8\x0f\x00\x00'),
+    (0x1008, LineTypes.CODE, 'xor ecx, ecx', '\x31\xc9'),
+    (0x100a, LineTypes.CODE, 'dec ecx', '\x49'),
+    (0x100b, LineTypes.CODE, 'jnz short loc_100a', '\x75\xfd'),
+    (0x100d, LineTypes.CODE, 'pop ebp', '\x5d'),
+    (0x100e, LineTypes.CODE, 'retn', '\xc3'),
+    (0x2000, LineTypes.CODE, 'mov eax, 1', '\xb8\x01\x00\x00\x00'),
+    (0x2005, LineTypes.CODE, 'retn', '\xc3'),
+    (0x3000, LineTypes.DATA, 'dd 0', '\x00\x00\x00\x00'),
+]
+
+EXAMPLE_XREFS = [
+    (XrefTypes.CODE_FLOW, 0x1000, 0x1001),
+    (XrefTypes.CODE_FLOW, 0x1001, 0x1003),
+    (XrefTypes.CODE_JUMP, 0x1003, 0x2000),
+    (XrefTypes.CODE_FLOW, 0x1003, 0x1008),
+    (XrefTypes.CODE_FLOW, 0x1008, 0x100a),
+    (XrefTypes.CODE_FLOW, 0x100a, 0x100b),
+    (XrefTypes.CODE_JUMP, 0x100b, 0x100a),
+    (XrefTypes.CODE_FLOW, 0x100b, 0x100d),
+    (XrefTypes.CODE_FLOW, 0x100d, 0x100e),
+    (XrefTypes.CODE_FLOW, 0x2000, 0x2005),
+]
+
+EXAMPLE_FUNCS = [
+    (0x1000, 'start', [(0x1000,0x100f)]),
+    (0x2000, 'sub_2000', [(0x2000,0x2006)]),
+]
+
+EXAMPLE_BLOCKS = [(0x1000,0x100a),(0x100a,0x100d),(0x100d,0x100f),
+        (0x2000,0x2006)]
+
+
+class TestBlocks(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        self.sdb_path = my_sdb_path
+        sdbgen = SDBGen(my_sdb_path)
+        sdbgen.add_lines(EXAMPLE_LINES)
+        sdbgen.add_xrefs(EXAMPLE_XREFS)
+        sdbgen.add_functions(EXAMPLE_FUNCS)
+        sdbgen.fill_lines_fts()
+        sdbgen.fill_blocks()
+        sdbgen.close()
+        self.sdb = SearchDB(my_sdb_path)
+
+    def tearDown(self):
+        self.sdb.close()
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def starts(self,blocks):
+        return [block.start_address for block in blocks]
+
+    def test_all_blocks(self):
+        self.assertEqual([(b.start_address,b.end_address)
+            for b in self.sdb.all_blocks()],EXAMPLE_BLOCKS)
+
+    def test_fill_ranges(self):
+        self.sdb.close()
+        sdbgen = SDBGen(self.sdb_path,update=True)
+        # Without the loop, the first function is one block:
+        sdbgen.delete_xrefs_from([0x100b])
+        sdbgen.add_xrefs([(XrefTypes.CODE_FLOW, 0x100b, 0x100d)])
+        sdbgen.fill_blocks([(0x100b,0x100c),(0x100a,0x100b)])
+        # A range without changes keeps the blocks:
+        sdbgen.fill_blocks([(0x2001,0x2002)])
+        sdbgen.close()
+        self.sdb = SearchDB(self.sdb_path)
+        self.assertEqual([(b.start_address,b.end_address)
+            for b in self.sdb.all_blocks()],[(0x1000,0x100f),(0x2000,0x2006)])
+
+    def test_block_by_line(self):
+        self.assertEqual(self.sdb.block_by_line(0x1003).start_address,0x1000)
+        self.assertEqual(self.sdb.block_by_line(0x100b).start_address,0x100a)
+        self.assertEqual(self.sdb.block_by_line(0x100a).end_address,0x100d)
+        self.assertIsNone(self.sdb.block_by_line(0x3000))
+        self.assertIsNone(self.sdb.block_by_line(0x100))
+
+    def test_lines_in_block(self):
+        self.assertEqual([line.address for line in
+            self.sdb.lines_in_block(0x100a)],[0x100a,0x100b])
+        self.assertEqual(list(self.sdb.lines_in_block(0x1001)),[])
+
+    def test_code_flow_block(self):
+        # The blocks table agrees with following the xrefs:
+        for address,line_type,_,_ in EXAMPLE_LINES:
+            if line_type != LineTypes.CODE:
+                continue
+            block = self.sdb.block_by_line(address)
+            self.assertEqual(
+                [line.address for line in self.sdb.code_flow_block(address)],
+                [line.address for line in
+                    self.sdb.lines_in_block(block.start_address)])
+
+    def test_blocks_text(self):
+        self.assertEqual(self.starts(self.sdb.blocks_text_tokens(
+            ['dec ecx','jnz'])),[0x100a])
+        self.assertEqual(self.starts(self.sdb.blocks_text_tokens(
+            ['push','call'])),[0x1000])
+        self.assertEqual(self.starts(self.sdb.blocks_text_tokens(
+            ['push','retn'])),[])
+        self.assertEqual(self.starts(self.sdb.blocks_text_tokens(['retn'])),
+                [0x100d,0x2000])
+        self.assertEqual(self.starts(self.sdb.blocks_text(['mov eax'])),
+                [0x2000])
+
+    def test_blocks_with_all(self):
+        self.assertEqual(self.starts(self.sdb.blocks_with_all(
+            [line_type_is(LineTypes.CODE),
+                has_xrefs_from([XrefTypes.CODE_JUMP])])),[0x1000,0x100a])
+        self.assertEqual(len(list(self.sdb.blocks_with_all([]))),
+                len(EXAMPLE_BLOCKS))
+
+    def test_no_blocks(self):
+        hex_sdb_path = os.path.join(self.my_dir,'hex.sdb')
+        gen_hex_sdb(hex_sdb_path,EXAMPLE_LINES,EXAMPLE_XREFS,[])
+        hex_sdb = SearchDB(hex_sdb_path)
+        try:
+            with self.assertRaises(SearchDBError):
+                hex_sdb.all_blocks()
+            with self.assertRaises(SearchDBError):
+                hex_sdb.blocks_text(['retn'])
+        finally:
+            hex_sdb.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+import unittest
+
+import os
+import shutil
+import random
+import tempfile
+import binascii
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.byte_search import BytePattern, DATA_PAGE_SIZE, \
+        DATA_CHUNK_PAGES, iter_region_runs, iter_page_chunks
+from idsearch.types import LineTypes
+from idsearch.exceptions import SearchDBError
+from idsearch.tests.legacy_sdb import gen_hex_sdb
+
+# A long run of data, crossing a few data pages:
+LONG_DATA = ''.join(chr((i * 7) & 0xff) for i in xrange(DATA_PAGE_SIZE * 2))
+# Bytes that cross the boundary between the first two pages:
+BOUNDARY_DATA = LONG_DATA[DATA_PAGE_SIZE - 2:DATA_PAGE_SIZE + 3]
+
+EXAMPLE_LINES = [
+    (0x1000, LineTypes.CODE, 'push ebp', '\x55'),
+    (0x1001, LineTypes.CODE, 'mov ebp, esp', '\x8b\xec'),
+    (0x1003, LineTypes.CODE, 'call sub_2000', '\xe8\xf8\x0f\x00\x00'),
+    (0x1008, LineTypes.CODE, 'test eax, eax', '\x85\xc0'),
+    (0x100a, LineTypes.CODE, 'pop ebp', '\x5d'),
+    (0x100b, LineTypes.CODE, 'retn', '\xc3'),
+    (0x2000, LineTypes.CODE, 'call sub_1000', '\xe8\xfb\xef\xff\xff'),
+    (0x2005, LineTypes.CODE, 'test eax, eax', '\x85\xc0'),
+    (0x2007, LineTypes.CODE, 'retn', '\xc3'),
+    (0x3000, LineTypes.DATA, 'db 0', '\x00'),
+    (0x3001, LineTypes.DATA, 'db 0', '\x00'),
+    (0x3002, LineTypes.DATA, 'db 0', '\x00'),
+    (0x3003, LineTypes.DATA, 'db 0', '\x00'),
+    (0x5000, LineTypes.DATA, 'db long', LONG_DATA),
+]
+
+
+def brute_force(pattern):
+    """
+    Find a pattern in the data of every run of EXAMPLE_LINES.
+    """
+    runs = {}
+    run_start = None
+    for address,_,_,data in EXAMPLE_LINES:
+        if (run_start is None) or \
+                (run_start + len(runs[run_start]) != address):
+            run_start = address
+            runs[run_start] = ''
+        runs[run_start] += data
+
+    regex = BytePattern(pattern).regex
+    return sorted(address + match.start()
+            for address,data in runs.iteritems()
+            for match in regex.finditer(data))
+
+
+class TestBytePattern(unittest.TestCase):
+    def test_parse(self):
+        pattern = BytePattern('E8 ?? ?? ?? ?? 85 C0')
+        self.assertEqual(pattern.size,7)
+        # Only exact ngrams are indexed:
+        self.assertEqual([offset for offset,_ in pattern.ngrams],[])
+        pattern = BytePattern('8bec e8??')
+        self.assertEqual(pattern.size,4)
+        self.assertEqual([offset for offset,_ in pattern.ngrams],[0])
+
+    def test_invalid(self):
+        for pattern in ['','E','E8 9','E8 XX','E8 ???']:
+            with self.assertRaises(SearchDBError):
+                BytePattern(pattern)
+
+    def test_find(self):
+        pattern = BytePattern('0? 0?')
+        self.assertEqual(pattern.find(0x100,'\x01\x02\x03','\x04'),
+                [0x100,0x101,0x102])
+        self.assertEqual(pattern.find(0x100,'\x01\x02\x03',''),
+                [0x100,0x101])
+
+
+class TestPageChunks(unittest.TestCase):
+    def test_region_runs(self):
+        runs = [(0x10,'abcdef'),(0x20,'gh'),(0x30,'ij')]
+        self.assertEqual(list(iter_region_runs(runs,[0x12,0x14,0x21])),
+                [(0,0x10,'ab'),(1,0x12,'cd'),(2,0x14,'ef'),(2,0x20,'g'),
+                    (3,0x21,'h'),(3,0x30,'ij')])
+        self.assertEqual(list(iter_region_runs(runs,[])),
+                [(0,0x10,'abcdef'),(0,0x20,'gh'),(0,0x30,'ij')])
+
+    def test_chunks(self):
+        region_runs = [(0,0x1000,'\x01' * (DATA_PAGE_SIZE + 1)),
+                (0,0x8000,'\x02\x02\x02'),
+                (1,0x9000,'\x03' * (DATA_PAGE_SIZE * DATA_CHUNK_PAGES + 1))]
+        chunks = list(iter_page_chunks(region_runs,5))
+        # Chunks do not cross regions, and have at most DATA_CHUNK_PAGES
+        # pages:
+        self.assertEqual([[row[:2] for row in page_rows]
+            for page_rows,_ in chunks[:1]],
+            [[(5,0x1000),(6,0x1000 + DATA_PAGE_SIZE),(7,0x8000)]])
+        self.assertEqual([len(page_rows) for page_rows,_ in chunks],
+                [3,DATA_CHUNK_PAGES,1])
+        self.assertEqual(chunks[1][0][0][0],8)
+        self.assertEqual(chunks[2][0][0][:2],(8 + DATA_CHUNK_PAGES,
+            0x9000 + DATA_PAGE_SIZE * DATA_CHUNK_PAGES))
+        # Posting lists only have pages of their chunk:
+        self.assertEqual(list(chunks[0][1]['\x01' * 3]),[5])
+        self.assertEqual(list(chunks[0][1]['\x02' * 3]),[7])
+        self.assertEqual(len(chunks[1][1]['\x03' * 3]),DATA_CHUNK_PAGES)
+        self.assertEqual(dict(chunks[2][1]),{})
+
+
+class TestByteSearch(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        sdbgen = SDBGen(my_sdb_path)
+        sdbgen.add_lines(EXAMPLE_LINES)
+        sdbgen.fill_lines_fts()
+        sdbgen.fill_data_pages()
+        sdbgen.close()
+        self.sdb = SearchDB(my_sdb_path)
+
+    def tearDown(self):
+        self.sdb.close()
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def test_across_lines(self):
+        self.assertEqual(self.sdb.data_pattern_addresses(
+            'E8 ?? ?? ?? ?? 85 C0'),[0x1003,0x2000])
+        self.assertEqual(self.sdb.data_pattern_addresses('55 8B EC E8'),
+                [0x1000])
+        # Runs are not joined over gaps:
+        self.assertEqual(self.sdb.data_pattern_addresses('C3 E8'),[])
+
+    def test_wildcards(self):
+        self.assertEqual(self.sdb.data_pattern_addresses('E8 F? 0?'),
+                [0x1003])
+        self.assertEqual(self.sdb.data_pattern_addresses('e8 ?? ?? ?? ff'),
+                [0x2000])
+
+    def test_overlapping(self):
+        self.assertEqual(self.sdb.data_pattern_addresses('00 00 00'),
+                [0x3000,0x3001])
+
+    def test_page_boundary(self):
+        pattern = binascii.hexlify(BOUNDARY_DATA)
+        self.assertIn(0x5000 + DATA_PAGE_SIZE - 2,
+                self.sdb.data_pattern_addresses(pattern))
+        self.assertEqual(self.sdb.data_pattern_addresses(pattern),
+                brute_force(pattern))
+
+    def test_brute_force(self):
+        for pattern in ['E8','85 C0','00 00','?? ?? C3','8B EC ?8','0E 15 1C',
+                '00 07 0E ?? 1C','FF ?? 0? 0?','55 ?B EC E8 F8 0F 00 00 85']:
+            self.assertEqual(self.sdb.data_pattern_addresses(pattern),
+                    brute_force(pattern))
+            self.assertEqual(self.sdb.data_pattern_addresses(pattern,
+                use_index=False),brute_force(pattern))
+
+    def test_lines_data_pattern(self):
+        self.assertEqual([line.address for line in
+            self.sdb.lines_data_pattern('?? 85 C0')],[0x1003,0x2000])
+        self.assertEqual([line.text for line in
+            self.sdb.lines_data_pattern('00 00 C3')],[])
+        self.assertEqual([line.address for line in
+            self.sdb.lines_data_pattern(binascii.hexlify(BOUNDARY_DATA),
+                fields=['address'])],[0x5000])
+
+    def test_segments(self):
+        segments_sdb_path = os.path.join(self.my_dir,'segments.sdb')
+        sdbgen = SDBGen(segments_sdb_path)
+        sdbgen.add_lines(EXAMPLE_LINES)
+        sdbgen.add_segments([(0x1000,0x1008,'a'),(0x1008,0x100c,'b')])
+        sdbgen.fill_data_pages()
+        sdbgen.close()
+        sdb = SearchDB(segments_sdb_path)
+        try:
+            # Matches do not cross segments:
+            self.assertEqual(sdb.data_pattern_addresses('00 00 85'),[])
+            self.assertEqual(sdb.data_pattern_addresses('85 C0 5D'),[0x1008])
+            self.assertEqual(sdb.data_pattern_addresses('00 00 00'),
+                    [0x3000,0x3001])
+        finally:
+            sdb.close()
+
+    def test_long_pattern(self):
+        long_sdb_path = os.path.join(self.my_dir,'long.sdb')
+        rand = random.Random(0)
+        data = ''.join(chr(rand.randrange(0x100)) for _ in xrange(0x2000))
+        sdbgen = SDBGen(long_sdb_path)
+        sdbgen.add_lines([(0x1000, LineTypes.DATA, 'db random', data)])
+        sdbgen.fill_data_pages()
+        sdbgen.close()
+        sdb = SearchDB(long_sdb_path)
+        try:
+            # More distinct ngrams than sql variables in one query:
+            pattern = binascii.hexlify(data[0x100:0x1100])
+            self.assertGreater(len(set(key for _,key in
+                BytePattern(pattern).ngrams)),1000)
+            self.assertEqual(sdb.data_pattern_addresses(pattern),[0x1100])
+        finally:
+            sdb.close()
+
+    def test_no_data_pages(self):
+        hex_sdb_path = os.path.join(self.my_dir,'hex.sdb')
+        gen_hex_sdb(hex_sdb_path,EXAMPLE_LINES,[],[])
+        hex_sdb = SearchDB(hex_sdb_path)
+        try:
+            with self.assertRaises(SearchDBError):
+                hex_sdb.data_pattern_addresses('85 C0')
+        finally:
+            hex_sdb.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,12 @@
 import os
 import shutil
+import tempfile
 
 import unittest
 from idsearch.types import LineTypes, XrefTypes
 from idsearch.gen_db import SDBGen
+from idsearch.partial_sdb import gen_partial_path, is_sdb_partial
+from idsearch.exceptions import GenDBError
 from idsearch.types import data_to_hex, hex_to_data
 
 class TestDBGen(unittest.TestCase):
@@ -56,10 +59,128 @@ class TestDBGen(unittest.TestCase):
         sdbgen.add_line(0x051FECB4, LineTypes.CODE,'li r25,0','\x3B\x20\x00\x00')
         sdbgen.add_line(0x051FECB8, LineTypes.CODE,
                 'addi r24, r1, 0x40+var_28','\x3B\x01\x00\x18')
-        sdbgen.add_function(0x051fecb4,'my_func',[0x051fecb4,0x051fecb8])
+        sdbgen.add_function(0x051fecb4,'my_func',[(0x051fecb4,0x051fecbc)])
         sdbgen.fill_lines_fts()
         sdbgen.close()
 
+    def test_add_lines_bulk(self):
+        sdbgen = SDBGen(':memory:',batch_opers=3)
+        sdbgen.add_lines((0x1000 + i*4, LineTypes.CODE, 'nop', '\x90')
+                for i in range(10))
+        sdbgen.add_xrefs((XrefTypes.CODE_FLOW, 0x1000 + i*4, 0x1004 + i*4)
+                for i in range(9))
+        sdbgen.add_functions([(0x1000,'my_func',[(0x1000,0x1008)]),
+            (0x1008,'my_func2',[(0x1008,0x100c),(0x1020,0x1028)])])
+        sdbgen.flush()
+
+        conn = sdbgen._conn
+        self.assertEqual(
+            conn.execute('SELECT COUNT(*) FROM lines').fetchone()[0],10)
+        self.assertEqual(
+            conn.execute('SELECT COUNT(*) FROM xrefs').fetchone()[0],9)
+        self.assertEqual(
+            conn.execute('SELECT COUNT(*) FROM funcs').fetchone()[0],2)
+        self.assertEqual(
+            conn.execute('SELECT COUNT(*) FROM funcs_chunks').fetchone()[0],3)
+        sdbgen.fill_lines_fts()
+        sdbgen.close()
+
+
+    def test_close_optimize(self):
+        sdbgen = SDBGen(':memory:')
+        # Fill the fts index in a few parts, to create a few fts segments:
+        for i in range(4):
+            rows = [(0x1000 + i*0x100 + j, LineTypes.CODE, 'nop', '\x90')
+                    for j in range(16)]
+            sdbgen.add_lines(rows)
+            sdbgen.fill_lines_fts([row[0] for row in rows])
+
+        conn = sdbgen._conn
+        self.assertGreater(conn.execute(
+            'SELECT COUNT(*) FROM lines_data_fts_segdir').fetchone()[0],1)
+        sdbgen.optimize()
+        for fts_table in ['lines_text_fts','lines_text_tokens_fts',
+                'lines_data_fts']:
+            self.assertEqual(conn.execute(
+                'SELECT COUNT(*) FROM {}_segdir'.format(fts_table))\
+                        .fetchone()[0],1)
+        self.assertGreater(conn.execute(
+            'SELECT COUNT(*) FROM sqlite_stat1').fetchone()[0],0)
+        sdbgen.close()
+
+    def test_merge(self):
+        sdbgen = SDBGen(':memory:')
+        for i in range(4):
+            rows = [(0x1000 + i*0x100 + j, LineTypes.CODE, 'nop', '\x90')
+                    for j in range(16)]
+            sdbgen.add_lines(rows)
+            sdbgen.fill_lines_fts([row[0] for row in rows])
+
+        conn = sdbgen._conn
+        get_num_segments = lambda:conn.execute(
+            'SELECT COUNT(*) FROM lines_data_fts_segdir').fetchone()[0]
+        num_segments = get_num_segments()
+        sdbgen.merge()
+        self.assertLess(get_num_segments(),num_segments)
+        self.assertEqual(conn.execute("""SELECT COUNT(*) FROM lines_data_fts
+            WHERE lines_data_fts MATCH '90'""").fetchone()[0],64)
+        sdbgen.close(optimize=False)
+
+    def test_partial(self):
+        my_dir = tempfile.mkdtemp()
+        try:
+            sdb_path = os.path.join(my_dir,'mydb.sdb')
+            sdbgen = SDBGen(sdb_path)
+            self.assertTrue(is_sdb_partial(sdb_path))
+            sdbgen.close()
+            self.assertFalse(is_sdb_partial(sdb_path))
+
+            sdbgen = SDBGen(sdb_path,update=True)
+            sdbgen.add_lines([(0x1000, LineTypes.CODE, 'nop', '\x90')])
+            self.assertTrue(is_sdb_partial(sdb_path))
+            # An interrupted update:
+            sdbgen._conn.close()
+            with self.assertRaises(GenDBError):
+                SDBGen(sdb_path,update=True)
+            self.assertTrue(os.path.isfile(gen_partial_path(sdb_path)))
+        finally:
+            shutil.rmtree(my_dir)
+
+    def test_pragmas(self):
+        sdbgen = SDBGen(':memory:',pragmas=[('synchronous','OFF'),
+            ('cache_size',-1024)])
+        conn = sdbgen._conn
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0],0)
+        self.assertEqual(conn.execute('PRAGMA cache_size').fetchone()[0],-1024)
+        sdbgen.close()
+
+    def test_deferred_indexes(self):
+        sdbgen = SDBGen(':memory:')
+        conn = sdbgen._conn
+        get_indexes = lambda:set(row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND name NOT LIKE 'sqlite_%'"))
+
+        sdbgen.add_lines([(0x1000, LineTypes.CODE, 'nop', '\x90'),
+            (0x1001, LineTypes.CODE, 'nop', '\x90')])
+        # Duplicated rows are only detected when the indexes are created:
+        sdbgen.add_xrefs([(XrefTypes.CODE_FLOW, 0x1000, 0x1001)] * 2)
+        sdbgen.add_function(0x1000,'my_func',[(0x1000,0x1002)] * 2)
+        self.assertEqual(get_indexes(),set())
+
+        sdbgen.create_indexes()
+        self.assertIn('index_xrefs',get_indexes())
+        self.assertEqual(conn.execute(
+            'SELECT COUNT(*) FROM xrefs').fetchone()[0],1)
+        self.assertEqual(conn.execute(
+            'SELECT COUNT(*) FROM funcs_chunks').fetchone()[0],1)
+        sdbgen.close()
+
+        sdbgen = SDBGen(':memory:',defer_indexes=False)
+        self.assertIn('index_xrefs',set(row[0] for row in sdbgen._conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")))
+        sdbgen.close()
+
 
 class TestDataToHex(unittest.TestCase):
     def test_basic(self):
@@ -71,4 +192,12 @@ class TestDataToHex(unittest.TestCase):
         self.assertEqual(hex_to_data(data_to_hex('1234')),'1234')
         self.assertEqual(data_to_hex(hex_to_data('31 32 33')),'31 32 33')
 
+    def test_all_bytes(self):
+        data = ''.join(chr(i) for i in range(256))
+        self.assertEqual(data_to_hex(data),
+                ' '.join('{:02x}'.format(i) for i in range(256)))
+        self.assertEqual(hex_to_data(data_to_hex(data)),data)
+        self.assertEqual(hex_to_data('4E 80 04 21'),'\x4e\x80\x04\x21')
 
+    def test_unicode(self):
+        self.assertEqual(data_to_hex(u'li r25'),'6c 69 20 72 32 35')
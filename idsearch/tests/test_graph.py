@@ -0,0 +1,199 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.graph import Graph
+from idsearch.types import LineTypes, XrefTypes
+from idsearch.tests.legacy_sdb import gen_hex_sdb
+
+# Example call graph: 0x1000 calls 0x2000 and 0x3000, 0x2000 and 0x3000 call
+# each other, 0x4000 calls itself and 0x5000 calls nothing. 0x6000 has a loop.
+EXAMPLE_LINES = [
+    (0x1000, LineTypes.CODE, 'call sub_2000', '\xe8'),
+    (0x1005, LineTypes.CODE, 'call sub_3000', '\xe8'),
+    (0x100a, LineTypes.CODE, 'retn', '\xc3'),
+    (0x2000, LineTypes.CODE, 'call sub_3000', '\xe8'),
+    (0x2005, LineTypes.CODE, 'retn', '\xc3'),
+    (0x3000, LineTypes.CODE, 'call sub_2000', '\xe8'),
+    (0x3005, LineTypes.CODE, 'retn', '\xc3'),
+    (0x4000, LineTypes.CODE, 'call sub_4000', '\xe8'),
+    (0x4005, LineTypes.CODE, 'retn', '\xc3'),
+    (0x5000, LineTypes.CODE, 'retn', '\xc3'),
+    (0x6000, LineTypes.CODE, 'xor ecx, ecx', '\x31\xc9'),
+    (0x6002, LineTypes.CODE, 'dec ecx', '\x49'),
+    (0x6003, LineTypes.CODE, 'jnz short loc_6002', '\x75\xfd'),
+    (0x6005, LineTypes.CODE, 'retn', '\xc3'),
+]
+
+EXAMPLE_XREFS = [
+    (XrefTypes.CODE_JUMP, 0x1000, 0x2000),
+    (XrefTypes.CODE_FLOW, 0x1000, 0x1005),
+    (XrefTypes.CODE_JUMP, 0x1005, 0x3000),
+    (XrefTypes.CODE_FLOW, 0x1005, 0x100a),
+    (XrefTypes.CODE_JUMP, 0x2000, 0x3000),
+    (XrefTypes.CODE_FLOW, 0x2000, 0x2005),
+    (XrefTypes.CODE_JUMP, 0x3000, 0x2000),
+    (XrefTypes.CODE_FLOW, 0x3000, 0x3005),
+    (XrefTypes.CODE_JUMP, 0x4000, 0x4000),
+    (XrefTypes.CODE_FLOW, 0x4000, 0x4005),
+    (XrefTypes.CODE_FLOW, 0x6000, 0x6002),
+    (XrefTypes.CODE_FLOW, 0x6002, 0x6003),
+    (XrefTypes.CODE_JUMP, 0x6003, 0x6002),
+    (XrefTypes.CODE_FLOW, 0x6003, 0x6005),
+]
+
+EXAMPLE_FUNCS = [
+    (0x1000, 'start', [(0x1000,0x100b)]),
+    (0x2000, 'sub_2000', [(0x2000,0x2006)]),
+    (0x3000, 'sub_3000', [(0x3000,0x3006)]),
+    (0x4000, 'sub_4000', [(0x4000,0x4006)]),
+    (0x5000, 'sub_5000', [(0x5000,0x5001)]),
+    (0x6000, 'sub_6000', [(0x6000,0x6006)]),
+]
+
+
+class TestGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = Graph([(1,2),(2,3),(3,1),(3,4),(4,5),(6,6)],[7])
+
+    def test_nodes(self):
+        self.assertEqual(self.graph.nodes(),[1,2,3,4,5,6,7])
+        self.assertEqual(len(self.graph),7)
+        self.assertEqual(self.graph.num_edges(),6)
+        self.assertIn(7,self.graph)
+        self.assertNotIn(8,self.graph)
+
+    def test_neighbors(self):
+        self.assertEqual(sorted(self.graph.successors(3)),[1,4])
+        self.assertEqual(self.graph.predecessors(1),[3])
+        self.assertEqual(self.graph.successors(7),[])
+        self.assertEqual(self.graph.successors(8),[])
+
+    def test_reachable(self):
+        self.assertEqual(sorted(self.graph.reachable(1)),[1,2,3,4,5])
+        self.assertEqual(sorted(self.graph.reachable(1,max_depth=2)),[1,2,3])
+        self.assertEqual(sorted(self.graph.reachable(4,reverse=True)),
+                [1,2,3,4])
+        self.assertEqual(self.graph.reachable(7),[7])
+        self.assertEqual(self.graph.reachable(8),[])
+
+    def test_callers_callees(self):
+        self.assertEqual(self.graph.callees(1),[2])
+        self.assertEqual(sorted(self.graph.callees(1,depth=3)),[1,2,3,4])
+        self.assertEqual(self.graph.callers(4),[3])
+        self.assertEqual(sorted(self.graph.callers(4,depth=2)),[2,3])
+        self.assertEqual(self.graph.callees(6),[6])
+        self.assertEqual(self.graph.callees(7),[])
+
+    def test_shortest_path(self):
+        self.assertEqual(self.graph.shortest_path(1,5),[1,2,3,4,5])
+        self.assertEqual(self.graph.shortest_path(3,2),[3,1,2])
+        self.assertEqual(self.graph.shortest_path(1,1),[1])
+        self.assertIsNone(self.graph.shortest_path(5,1))
+        self.assertIsNone(self.graph.shortest_path(1,8))
+
+    def test_scc(self):
+        self.assertEqual(sorted(self.graph.strongly_connected_components()),
+                [[1,2,3],[4],[5],[6],[7]])
+
+
+class TestSearchGraph(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        self.fill_sdb(my_sdb_path)
+        self.sdb = SearchDB(my_sdb_path)
+
+    def tearDown(self):
+        self.sdb.close()
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def fill_sdb(self,sdb_path):
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(EXAMPLE_LINES)
+        sdbgen.add_xrefs(EXAMPLE_XREFS)
+        sdbgen.add_functions(EXAMPLE_FUNCS)
+        sdbgen.close()
+
+    def test_xref_graph(self):
+        graph = self.sdb.xref_graph()
+        self.assertEqual(graph.num_edges(),len(EXAMPLE_XREFS))
+        self.assertEqual(sorted(graph.successors(0x1000)),[0x1005,0x2000])
+        self.assertEqual(graph.shortest_path(0x1000,0x100a),
+                [0x1000,0x1005,0x100a])
+        self.assertIsNone(graph.shortest_path(0x2000,0x1000))
+
+        graph = self.sdb.xref_graph([XrefTypes.CODE_FLOW])
+        self.assertEqual(sorted(graph.reachable(0x1000)),
+                [0x1000,0x1005,0x100a])
+
+    def test_call_graph(self):
+        graph = self.sdb.call_graph()
+        self.assertEqual(graph.nodes(),
+                [0x1000,0x2000,0x3000,0x4000,0x5000,0x6000])
+        self.assertEqual(sorted(graph.callees(0x1000)),[0x2000,0x3000])
+        self.assertEqual(sorted(graph.callers(0x3000)),[0x1000,0x2000])
+        self.assertEqual(sorted(graph.reachable(0x2000)),[0x2000,0x3000])
+        self.assertEqual(sorted(graph.strongly_connected_components()),
+                [[0x1000],[0x2000,0x3000],[0x4000],[0x5000],[0x6000]])
+
+    def xref_tuples(self,xrefs):
+        return sorted((x.xref_type,x.line_from,x.line_to) for x in xrefs)
+
+    def test_xrefs_transitive(self):
+        self.assertEqual(self.xref_tuples(
+            self.sdb.xrefs_to_transitive(0x3000)),
+                [(XrefTypes.CODE_FLOW,0x1000,0x1005),
+                    (XrefTypes.CODE_JUMP,0x1000,0x2000),
+                    (XrefTypes.CODE_JUMP,0x1005,0x3000),
+                    (XrefTypes.CODE_JUMP,0x2000,0x3000),
+                    (XrefTypes.CODE_JUMP,0x3000,0x2000)])
+        self.assertEqual(self.xref_tuples(self.sdb.xrefs_to_transitive(0x3000,
+            max_depth=1)),
+                [(XrefTypes.CODE_JUMP,0x1005,0x3000),
+                    (XrefTypes.CODE_JUMP,0x2000,0x3000)])
+        self.assertEqual(len(list(self.sdb.xrefs_to_transitive(0x3000,
+            xref_types=[XrefTypes.CODE_JUMP]))),4)
+
+        self.assertEqual(self.xref_tuples(
+            self.sdb.xrefs_from_transitive(0x6000)),
+                [(XrefTypes.CODE_FLOW,0x6000,0x6002),
+                    (XrefTypes.CODE_FLOW,0x6002,0x6003),
+                    (XrefTypes.CODE_FLOW,0x6003,0x6005),
+                    (XrefTypes.CODE_JUMP,0x6003,0x6002)])
+        self.assertEqual(len(list(self.sdb.xrefs_from_transitive(0x6000,
+            max_depth=2))),2)
+        self.assertEqual(list(self.sdb.xrefs_from_transitive(0x5000)),[])
+
+    def test_code_flow_block(self):
+        def block(address):
+            return [line.address for line in self.sdb.code_flow_block(address)]
+
+        # Calls do not end blocks:
+        self.assertEqual(block(0x1005),[0x1000,0x1005,0x100a])
+        self.assertEqual(block(0x6000),[0x6000])
+        self.assertEqual(block(0x6002),[0x6002,0x6003])
+        self.assertEqual(block(0x6003),[0x6002,0x6003])
+        self.assertEqual(block(0x6005),[0x6005])
+        self.assertEqual(block(0x5000),[0x5000])
+
+
+class TestSearchGraphHex(TestSearchGraph):
+    """
+    Run the same tests against an sdb of the old HEX version.
+    """
+    def fill_sdb(self,sdb_path):
+        gen_hex_sdb(sdb_path,EXAMPLE_LINES,EXAMPLE_XREFS,
+                [(address,name,[addr for addr,_,_,_ in EXAMPLE_LINES
+                    if any(start <= addr < end for start,end in chunks)])
+                    for address,name,chunks in EXAMPLE_FUNCS])
+
+
+if __name__ == '__main__':
+    unittest.main()
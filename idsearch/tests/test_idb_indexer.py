@@ -0,0 +1,142 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from idsearch.tests.fake_ida import FakeIDB, install, gen_fake_idb
+
+# The fake IDA api must be installed before importing the indexer:
+install(FakeIDB())
+
+from idsearch.idb_indexer import index_idb
+from idsearch.search_db import SearchDB
+from idsearch.types import LineTypes, XrefTypes, OperandTypes
+
+
+def make_small_idb():
+    """
+    Create a small fake IDB with all kinds of xrefs.
+    """
+    idb = FakeIDB()
+    idb.add_segment(0x1000,0x2000)
+    idb.add_head(0x1000,'push    ebp','\x55',True)
+    head = idb.add_head(0x1001,'mov eax, off_1010','\xa1\x10\x10\x00\x00',True)
+    head.data_refs.append(0x1010)
+    head = idb.add_head(0x1006,'jmp short loc_1000','\xeb\xf8',True)
+    head.jump_refs.append(0x1000)
+    head.flows = False
+    idb.add_head(0x1008,'retn','\xc3',True).flows = False
+    head = idb.add_head(0x1010,'dd offset loc_1000','\x00\x10\x00\x00',False)
+    head.data_refs.append(0x1000)
+    head = idb.add_head(0x1014,'dd offset off_1010','\x10\x10\x00\x00',False)
+    head.data_refs.append(0x1010)
+    # Reference to a nonexistent line:
+    head = idb.add_head(0x1018,'dd 5000h','\x00\x50\x00\x00',False)
+    head.data_refs.append(0x5000)
+    idb.add_function(0x1000,'my_func',[(0x1000,0x1009)])
+    # A chunked function that shares a line with my_func:
+    idb.add_function(0x1008,'chunked_func',[(0x1008,0x1009),(0x1014,0x1018)])
+    return idb
+
+
+class TestIndexIDB(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        self.sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+
+    def tearDown(self):
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def test_small_idb(self):
+        install(make_small_idb())
+        index_idb(self.sdb_path)
+
+        sdb = SearchDB(self.sdb_path)
+        try:
+            lines = list(sdb.all_lines())
+            self.assertEqual(len(lines),7)
+            line = sdb.get_line(0x1000)
+            self.assertEqual(line.text,'push ebp')
+            self.assertEqual(line.data,'\x55')
+            self.assertEqual(line.line_type,LineTypes.CODE)
+            self.assertEqual(sdb.get_line(0x1010).line_type,LineTypes.DATA)
+
+            xrefs = set((x.xref_type,x.line_from,x.line_to)
+                    for x in sdb.all_xrefs())
+            self.assertEqual(xrefs,set([
+                (XrefTypes.CODE_FLOW,0x1000,0x1001),
+                (XrefTypes.CODE_FLOW,0x1001,0x1006),
+                (XrefTypes.CODE_TO_DATA,0x1001,0x1010),
+                (XrefTypes.CODE_JUMP,0x1006,0x1000),
+                (XrefTypes.DATA_TO_CODE,0x1010,0x1000),
+                (XrefTypes.DATA_TO_DATA,0x1014,0x1010),
+            ]))
+
+            funcs = list(sdb.funcs_by_line(0x1006))
+            self.assertEqual(len(funcs),1)
+            self.assertEqual(funcs[0].name,'my_func')
+
+            funcs = list(sdb.funcs_by_line(0x1008))
+            self.assertEqual(set(f.name for f in funcs),
+                    set(['my_func','chunked_func']))
+            self.assertEqual(len(list(sdb.funcs_by_line(0x1010))),0)
+
+            lines = list(sdb.lines_in_func(0x1008))
+            self.assertEqual(sorted(l.address for l in lines),[0x1008,0x1014])
+            self.assertEqual(len(list(sdb.lines_in_func(0x1000))),4)
+
+            self.assertEqual([line.address for line in
+                sdb.lines_by_mnemonic('MOV')],[0x1001])
+            self.assertEqual([(o.index,o.op_type,o.text,o.value)
+                for o in sdb.get_operands(0x1001)],
+                [(0,OperandTypes.REG,'eax',0),
+                    (1,OperandTypes.MEM,'off_1010',0x1010)])
+            self.assertEqual(sdb.get_operands(0x1010),[])
+
+            # The jump to the start of my_func is considered a call:
+            self.assertEqual([(b.start_address,b.end_address)
+                for b in sdb.all_blocks()],[(0x1000,0x1008),(0x1008,0x1009)])
+        finally:
+            sdb.close()
+
+    def test_image(self):
+        install(make_small_idb())
+        image_path = os.path.join(self.my_dir,'mydb.simg')
+        index_idb(self.sdb_path,image_path)
+
+        sdb = SearchDB(self.sdb_path)
+        try:
+            image = sdb.open_image(image_path)
+            self.assertEqual(image.segments[0][:2],(0x1000,0x2000))
+            self.assertEqual(image.read(0x1000,0x10),
+                    '\x55\xa1\x10\x10\x00\x00\xeb\xf8\xc3' + '\x00' * 7)
+            self.assertEqual(list(sdb.image_find_data('\xeb\xf8\xc3')),
+                    [0x1006])
+        finally:
+            sdb.close()
+
+    def test_single_pass(self):
+        idb = gen_fake_idb(num_segments=8,lines_per_segment=512)
+        install(idb)
+        index_idb(self.sdb_path)
+
+        num_heads = len(idb.heads)
+        # Every line is visited once:
+        self.assertEqual(idb.calls['GetDisasm'],num_heads)
+        self.assertEqual(idb.calls['NextHead'],num_heads)
+        # Every line is disassembled once, and every xref target at most once
+        # more:
+        num_targets = len(set(ref for head in idb.heads.itervalues()
+            for ref in head.jump_refs + head.data_refs))
+        self.assertLessEqual(idb.calls['ua_mnem'],num_heads + num_targets)
+
+        sdb = SearchDB(self.sdb_path)
+        try:
+            self.assertEqual(sum(1 for _ in sdb.all_lines()),num_heads)
+            self.assertEqual(sum(1 for _ in sdb.all_functions()),
+                    len(idb.functions))
+        finally:
+            sdb.close()
@@ -0,0 +1,199 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from idsearch.tests.fake_ida import FakeIDB, install, gen_fake_idb
+
+# The fake IDA api must be installed before importing the indexer:
+install(FakeIDB())
+
+from idsearch.idb_util import gen_sdb
+from idsearch.gen_db import sql_data_to_hex
+from idsearch.partial_sdb import gen_partial_path, is_sdb_partial
+from idsearch.search_db import SearchDB
+from idsearch.usqlite3 import sqlite3
+from idsearch.exceptions import IDBUtilError
+
+
+def dump_sdb(sdb_path):
+    """
+    Get all the contents of an sdb, in a comparable form.
+    """
+    sdb = SearchDB(sdb_path)
+    try:
+        lines = sorted((l.address,l.line_type,l.text,l.data)
+                for l in sdb.all_lines())
+        xrefs = sorted((x.xref_type,x.line_from,x.line_to)
+                for x in sdb.all_xrefs())
+        funcs = sorted((f.address,f.name,
+            tuple(sorted(l.address for l in sdb.lines_in_func(f.address))))
+                for f in sdb.all_functions())
+        operands = [(o.line,o.index,o.op_type,o.text,o.value)
+                for l in lines for o in sdb.get_operands(l[0])]
+        return (lines,xrefs,funcs,operands)
+    finally:
+        sdb.close()
+
+
+def dump_data_pages(sdb_path,start_address,end_address):
+    """
+    Get the ids and addresses of the data pages in a range of addresses.
+    """
+    conn = sqlite3.connect(sdb_path)
+    try:
+        return conn.execute("""SELECT id,address FROM data_pages
+            WHERE address >= ? AND address < ? ORDER BY id""",
+            (start_address,end_address)).fetchall()
+    finally:
+        conn.close()
+
+
+def check_fts_integrity(sdb_path):
+    """
+    Run the integrity-check of all the fts tables of an sdb.
+    """
+    conn = sqlite3.connect(sdb_path)
+    conn.create_function('data_to_hex',1,sql_data_to_hex)
+    try:
+        for fts_table in ['lines_text_fts','lines_text_tokens_fts',
+                'lines_data_fts']:
+            conn.execute("INSERT INTO {0}({0}) VALUES('integrity-check')"\
+                    .format(fts_table))
+    finally:
+        conn.close()
+
+
+class TestGenSDB(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        self.sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        self.full_sdb_path = os.path.join(self.my_dir,'full.sdb')
+
+    def tearDown(self):
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def test_overwrite(self):
+        install(gen_fake_idb(num_segments=1,lines_per_segment=32))
+        gen_sdb(self.sdb_path)
+        with self.assertRaises(IDBUtilError):
+            gen_sdb(self.sdb_path)
+        gen_sdb(self.sdb_path,overwrite=True)
+
+    def test_exists_keeps_image(self):
+        install(gen_fake_idb(num_segments=1,lines_per_segment=32))
+        image_path = os.path.join(self.my_dir,'mydb.simg')
+        gen_sdb(self.sdb_path,image=True)
+        self.assertTrue(os.path.isfile(image_path))
+        # Nothing is generated, so the image is kept:
+        with self.assertRaises(IDBUtilError):
+            gen_sdb(self.sdb_path)
+        self.assertTrue(os.path.isfile(image_path))
+        # The image is removed when the sdb is generated again without it:
+        gen_sdb(self.sdb_path,overwrite=True)
+        self.assertFalse(os.path.isfile(image_path))
+
+    def test_incremental_unchanged(self):
+        idb = gen_fake_idb(num_segments=4,lines_per_segment=256)
+        install(idb)
+        gen_sdb(self.sdb_path)
+        before = dump_sdb(self.sdb_path)
+
+        idb.calls.clear()
+        gen_sdb(self.sdb_path,incremental=True)
+        self.assertEqual(dump_sdb(self.sdb_path),before)
+        # Every line was read once, to calculate the checksums:
+        self.assertEqual(idb.calls['GetDisasm'],len(idb.heads))
+
+    def test_incremental_partial(self):
+        install(gen_fake_idb(num_segments=2,lines_per_segment=64))
+        gen_sdb(self.full_sdb_path)
+        # An sdb whose update was interrupted:
+        with open(self.sdb_path,'wb') as f:
+            f.write('half written sdb')
+        open(gen_partial_path(self.sdb_path),'wb').close()
+
+        gen_sdb(self.sdb_path,incremental=True)
+        self.assertFalse(is_sdb_partial(self.sdb_path))
+        self.assertEqual(dump_sdb(self.sdb_path),dump_sdb(self.full_sdb_path))
+
+    def test_incremental_changed(self):
+        idb = gen_fake_idb(num_segments=4,lines_per_segment=256)
+        install(idb)
+        gen_sdb(self.sdb_path)
+        first_pages = dump_data_pages(self.sdb_path,*idb.segments[0])
+
+        # Change the second segment:
+        seg_start = idb.segments[1][0]
+        head = idb.heads[seg_start + 8]
+        head.text = 'xor eax, eax'
+        head.data = '\x31\xc0\x90\x90'
+        idb.heads[seg_start + 12].jump_refs.append(seg_start)
+        del idb.heads[seg_start + 16]
+        idb._sorted_heads = None
+        idb.functions[seg_start].name = 'renamed_func'
+        # Change a function in the third segment:
+        func_addr = idb.segments[2][0] + 0x40
+        idb.add_function(func_addr,'chunked_func',
+                [(func_addr,func_addr + 8),(func_addr + 0x80,func_addr + 0x84)])
+        # A jump from the changed segment, and a function that is not
+        # called anymore, change the blocks of the third segment:
+        idb.heads[idb.segments[1][0] + 20].jump_refs.append(func_addr + 0x48)
+        del idb.functions[func_addr + 0x40]
+        # Remove the last segment:
+        seg_start,seg_end = idb.segments.pop()
+        for addr in list(idb.heads):
+            if seg_start <= addr < seg_end:
+                del idb.heads[addr]
+        for addr in list(idb.functions):
+            if seg_start <= addr < seg_end:
+                del idb.functions[addr]
+        idb._sorted_heads = None
+
+        idb.calls.clear()
+        gen_sdb(self.sdb_path,incremental=True)
+        # Only the changed segment was read twice:
+        seg_start,seg_end = idb.segments[1]
+        changed_heads = sum(1 for addr in idb.heads
+                if seg_start <= addr < seg_end)
+        self.assertEqual(idb.calls['GetDisasm'],
+                len(idb.heads) + changed_heads)
+
+        # The result is the same as indexing from scratch:
+        gen_sdb(self.full_sdb_path)
+        self.assertEqual(dump_sdb(self.sdb_path),dump_sdb(self.full_sdb_path))
+        check_fts_integrity(self.sdb_path)
+        # The data pages of the unchanged segment were kept:
+        self.assertEqual(dump_data_pages(self.sdb_path,*idb.segments[0]),
+                first_pages)
+
+        sdb = SearchDB(self.sdb_path)
+        try:
+            self.assertEqual(len(list(sdb.lines_text('xor eax'))),1)
+            self.assertEqual(len(list(sdb.lines_by_mnemonic('xor'))),1)
+            self.assertEqual(len(list(sdb.lines_data('\x31\xc0'))),1)
+            full_sdb = SearchDB(self.full_sdb_path)
+            try:
+                self.assertEqual([(b.start_address,b.end_address)
+                    for b in sdb.all_blocks()],
+                    [(b.start_address,b.end_address)
+                        for b in full_sdb.all_blocks()])
+                for pattern in ['31 C0 90','B8 ?? 00 00 E8','C3 90 90 90']:
+                    self.assertEqual(sdb.data_pattern_addresses(pattern),
+                            full_sdb.data_pattern_addresses(pattern))
+            finally:
+                full_sdb.close()
+            self.assertEqual(len(list(sdb.lines_text_tokens('renamed_func'))),0)
+            funcs = list(sdb.funcs_by_line(idb.segments[1][0]))
+            self.assertEqual(funcs[0].name,'renamed_func')
+        finally:
+            sdb.close()
+
+    def test_incremental_new(self):
+        install(gen_fake_idb(num_segments=2,lines_per_segment=64))
+        gen_sdb(self.sdb_path,incremental=True)
+        gen_sdb(self.full_sdb_path)
+        self.assertEqual(dump_sdb(self.sdb_path),dump_sdb(self.full_sdb_path))
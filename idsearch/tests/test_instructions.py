@@ -0,0 +1,125 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.line_query import mnemonic_is, has_operand, has_immediate, \
+    text_tokens
+from idsearch.types import LineTypes, OperandTypes
+from idsearch.exceptions import SearchDBError
+from idsearch.tests.legacy_sdb import gen_hex_sdb
+
+EXAMPLE_LINES = [
+    (0x1000, LineTypes.CODE, 'mov eax, 67452301h', '\xb8\x01\x23\x45\x67'),
+    (0x1005, LineTypes.CODE, 'call eax', '\xff\xd0'),
+    (0x1007, LineTypes.CODE, 'call sub_2000', '\xe8\xf4\x0f\x00\x00'),
+    (0x100c, LineTypes.CODE, 'cmp eax, 0FFFFFFFFh', '\x83\xf8\xff'),
+    (0x100f, LineTypes.CODE, 'retn', '\xc3'),
+    (0x2000, LineTypes.CODE, 'add eax, [ebp+67452301h]',
+        '\x03\x85\x01\x23\x45\x67'),
+    (0x2006, LineTypes.CODE, 'retn', '\xc3'),
+    (0x3000, LineTypes.DATA, 'dd 67452301h', '\x01\x23\x45\x67'),
+]
+
+EXAMPLE_INSTRUCTIONS = [
+    (0x1000, 'mov', [(OperandTypes.REG,'eax',0),
+        (OperandTypes.IMM,'67452301h',0x67452301)]),
+    (0x1005, 'call', [(OperandTypes.REG,'eax',0)]),
+    (0x1007, 'call', [(OperandTypes.NEAR,'sub_2000',0x2000)]),
+    (0x100c, 'CMP', [(OperandTypes.REG,'eax',0),
+        (OperandTypes.IMM,'0FFFFFFFFh',0xffffffffffffffff)]),
+    (0x100f, 'retn', []),
+    (0x2000, 'add', [(OperandTypes.REG,'eax',0),
+        (OperandTypes.DISPL,'[ebp+67452301h]',0x67452301)]),
+    (0x2006, 'retn', []),
+]
+
+
+class TestInstructions(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        sdbgen = SDBGen(my_sdb_path)
+        sdbgen.add_lines(EXAMPLE_LINES)
+        sdbgen.add_instructions(EXAMPLE_INSTRUCTIONS)
+        sdbgen.fill_lines_fts()
+        sdbgen.close()
+        self.sdb = SearchDB(my_sdb_path,FuncIter,query_builder=True)
+
+    def tearDown(self):
+        self.sdb.close()
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def addresses(self,lines):
+        return sorted(line.address for line in lines)
+
+    def test_lines_by_mnemonic(self):
+        self.assertEqual(self.addresses(self.sdb.lines_by_mnemonic('call')),
+                [0x1005,0x1007])
+        # Mnemonics are not case sensitive:
+        self.assertEqual(self.addresses(self.sdb.lines_by_mnemonic('cmp')),
+                [0x100c])
+        self.assertEqual(self.addresses(self.sdb.lines_by_mnemonic('RETN')),
+                [0x100f,0x2006])
+        self.assertEqual(self.addresses(self.sdb.lines_by_mnemonic('jmp')),[])
+
+    def test_lines_with_immediate(self):
+        # Only immediate operands, not displacements or data:
+        self.assertEqual(self.addresses(
+            self.sdb.lines_with_immediate(0x67452301)),[0x1000])
+        self.assertEqual(self.addresses(
+            self.sdb.lines_with_immediate(2**64 - 1)),[0x100c])
+        self.assertEqual(self.addresses(self.sdb.lines_with_immediate(-1)),
+                [0x100c])
+
+    def test_lines_with_operand(self):
+        self.assertEqual(self.addresses(self.sdb.lines_with_operand(
+            value=0x67452301)),[0x1000,0x2000])
+        self.assertEqual(self.addresses(self.sdb.lines_with_operand(
+            op_index=1,op_type=OperandTypes.REG)),[])
+        self.assertEqual(self.addresses(self.sdb.lines_with_operand(
+            text='eax')),[0x1000,0x1005,0x100c,0x2000])
+
+    def test_conds(self):
+        # Calls whose first operand is a register:
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            mnemonic_is('call') & has_operand(0,OperandTypes.REG))),[0x1005])
+        self.assertEqual(self.addresses(self.sdb.lines_text_tokens('eax')\
+                .filter(has_immediate(0x67452301) | mnemonic_is('add'))),
+                [0x1000,0x2000])
+        self.assertEqual(self.addresses(self.sdb.lines_by_mnemonic('retn')\
+                .filter(~has_operand())),[0x100f,0x2006])
+
+    def test_get_operands(self):
+        operands = self.sdb.get_operands(0x1000)
+        self.assertEqual([(o.line,o.index,o.op_type,o.text,o.value)
+            for o in operands],[
+                (0x1000,0,OperandTypes.REG,'eax',0),
+                (0x1000,1,OperandTypes.IMM,'67452301h',0x67452301)])
+        self.assertEqual(self.sdb.get_operands(0x100f),[])
+        self.assertEqual(self.sdb.get_operands(0x3000),[])
+
+    def test_no_instructions(self):
+        hex_sdb_path = os.path.join(self.my_dir,'hex.sdb')
+        gen_hex_sdb(hex_sdb_path,EXAMPLE_LINES,[],[])
+        hex_sdb = SearchDB(hex_sdb_path)
+        try:
+            with self.assertRaises(SearchDBError):
+                list(hex_sdb.lines_by_mnemonic('call'))
+            with self.assertRaises(SearchDBError):
+                hex_sdb.get_operands(0x1000)
+            with self.assertRaises(SearchDBError):
+                list(hex_sdb.query().filter(text_tokens('call') &
+                    has_immediate(0)))
+        finally:
+            hex_sdb.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+import unittest
+
+import os
+import re
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.searcher import load_sdb
+from idsearch.line_query import LineQuery, line_type_is, address_in_range, \
+    in_function, has_xrefs_from, has_xrefs_to, text_contains, text_tokens, \
+    data_contains, text_regex, text_regex_prefilter
+from idsearch.types import LineTypes, XrefTypes
+from idsearch.exceptions import SearchDBError
+from idsearch.tests.legacy_sdb import gen_hex_sdb
+
+# Example rows:
+EXAMPLE_LINES = [
+    (0x1000, LineTypes.CODE, 'push ebp', '\x55'),
+    (0x1001, LineTypes.CODE, 'mov ebp, esp', '\x8b\xec'),
+    (0x1003, LineTypes.CODE, 'call sub_2000', '\xe8\xf8\x0f\x00\x00'),
+    (0x1008, LineTypes.CODE, 'pop ebp', '\x5d'),
+    (0x1009, LineTypes.CODE, 'retn', '\xc3'),
+    (0x2000, LineTypes.CODE, 'mov eax, ds:dword_3000', '\xa1\x00\x30\x00\x00'),
+    (0x2005, LineTypes.CODE, 'retn', '\xc3'),
+    (0x3000, LineTypes.DATA, 'dword_3000 dd 0', '\x00\x00\x00\x00'),
+    (0x3004, LineTypes.DATA, 'db 0C3h', '\xc3'),
+]
+
+EXAMPLE_XREFS = [
+    (XrefTypes.CODE_FLOW, 0x1000, 0x1001),
+    (XrefTypes.CODE_FLOW, 0x1001, 0x1003),
+    (XrefTypes.CODE_JUMP, 0x1003, 0x2000),
+    (XrefTypes.CODE_FLOW, 0x1003, 0x1008),
+    (XrefTypes.CODE_FLOW, 0x1008, 0x1009),
+    (XrefTypes.CODE_FLOW, 0x2000, 0x2005),
+    (XrefTypes.CODE_TO_DATA, 0x2000, 0x3000),
+]
+
+EXAMPLE_FUNCS = [
+    (0x1000, 'start', [(0x1000,0x100a)]),
+    (0x2000, 'sub_2000', [(0x2000,0x2006)]),
+]
+
+
+class TestLineQuery(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        self.fill_sdb(my_sdb_path)
+        self.sdb = SearchDB(my_sdb_path,FuncIter,query_builder=True)
+
+    def tearDown(self):
+        self.sdb.close()
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def fill_sdb(self,sdb_path):
+        sdbgen = SDBGen(sdb_path)
+        sdbgen.add_lines(EXAMPLE_LINES)
+        sdbgen.add_xrefs(EXAMPLE_XREFS)
+        sdbgen.add_functions(EXAMPLE_FUNCS)
+        sdbgen.fill_lines_fts()
+        sdbgen.close()
+
+    def addresses(self,lines):
+        return sorted(line.address for line in lines)
+
+    def test_query(self):
+        query = self.sdb.query()
+        self.assertIsInstance(query,LineQuery)
+        self.assertEqual(len(list(query)),len(EXAMPLE_LINES))
+
+    def test_load_sdb(self):
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        sdb = load_sdb(my_sdb_path)
+        try:
+            lines = sdb.lines_text_tokens('retn')
+            self.assertNotIsInstance(lines,LineQuery)
+            self.assertEqual(self.addresses(lines),[0x1009,0x2005])
+        finally:
+            sdb.close()
+
+        sdb = load_sdb(my_sdb_path,query_builder=True)
+        try:
+            self.assertIsInstance(sdb.lines_text_tokens('retn'),LineQuery)
+        finally:
+            sdb.close()
+
+    def test_conds(self):
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            line_type_is(LineTypes.DATA))),[0x3000,0x3004])
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            address_in_range(0x1001,0x1008))),[0x1001,0x1003,0x1008])
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            in_function(0x2000))),[0x2000,0x2005])
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            has_xrefs_from([XrefTypes.CODE_JUMP,XrefTypes.CODE_TO_DATA]))),
+            [0x1003,0x2000])
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            has_xrefs_to())),[0x1001,0x1003,0x1008,0x1009,0x2000,0x2005,
+                0x3000])
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            text_contains('retn'))),[0x1009,0x2005])
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            text_tokens('ebp'))),[0x1000,0x1001,0x1008])
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            data_contains('\xc3'))),[0x1009,0x2005,0x3004])
+
+    def test_text_regex(self):
+        for prefilter in [True,False]:
+            self.assertEqual(self.addresses(self.sdb.query().filter(
+                text_regex(r'^mov \w+, ',prefilter))),[0x1001,0x2000])
+            self.assertEqual(self.addresses(self.sdb.query().filter(
+                text_regex(r'(call|mov) .*dword_\d+',prefilter))),[0x2000])
+            self.assertEqual(self.addresses(self.sdb.query().filter(
+                text_regex(re.compile('POP EBP',re.IGNORECASE),prefilter))),
+                [0x1008])
+            self.assertEqual(self.addresses(self.sdb.query().filter(
+                text_regex('[0-9]+h$',prefilter) & line_type_is(
+                    LineTypes.DATA))),[0x3004])
+            self.assertEqual(self.addresses(self.sdb.query().filter(
+                text_regex('ebp, esp, ',prefilter))),[])
+
+        # Lines that match the prefilter are a superset:
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            text_regex_prefilter(r'mov \w+, ds:',self.sdb))),[0x2000])
+        self.assertEqual(self.addresses(self.sdb.query().filter(
+            text_regex_prefilter(r'(call|push) e',self.sdb))),
+            [0x1000,0x1003])
+        # Too common, or no literal text:
+        self.assertIsNone(text_regex_prefilter('ebp.',self.sdb))
+        self.assertIsNone(text_regex_prefilter('p.p',self.sdb))
+
+    def test_compose(self):
+        # Chained filters, combined conditions and methods of SearchDB:
+        lines = self.sdb.lines_data('\xc3')\
+                .filter(line_type_is(LineTypes.CODE))\
+                .filter(~in_function(0x2000))
+        self.assertEqual(self.addresses(lines),[0x1009])
+
+        lines = self.sdb.lines_in_func(0x1000).filter(
+                text_tokens('call') | has_xrefs_to([XrefTypes.CODE_JUMP]))
+        self.assertEqual(self.addresses(lines),[0x1003])
+
+        lines = self.sdb.query().filter(
+                has_xrefs_to([XrefTypes.CODE_JUMP]) & text_contains('eax'))
+        self.assertEqual(self.addresses(lines),[0x2000])
+
+    def test_python_fallback(self):
+        lines = self.sdb.query()\
+                .filter(lambda line:line.text.startswith('mov'))\
+                .filter(in_function(0x1000))
+        self.assertEqual(self.addresses(lines),[0x1001])
+
+        self.assertEqual(sorted(self.sdb.lines_text('retn')\
+                .map(lambda line:line.address)),[0x1009,0x2005])
+        self.assertEqual(len(list(self.sdb.query()\
+                .unique(lambda line:line.text))),len(EXAMPLE_LINES) - 1)
+
+    def test_any_all(self):
+        func_lines = self.sdb.lines_in_func(0x1000)
+        self.assertTrue(func_lines.any(text_tokens('call')))
+        self.assertFalse(func_lines.any(line_type_is(LineTypes.DATA)))
+        self.assertTrue(func_lines.all(line_type_is(LineTypes.CODE)))
+        self.assertFalse(func_lines.all(has_xrefs_from()))
+        self.assertTrue(func_lines.any(lambda line:line.text == 'retn'))
+
+        # Conditions after a python filter:
+        query = self.sdb.query().filter(lambda line:len(line.data) == 1)
+        self.assertTrue(query.all(text_contains('p') | text_contains('db')
+            | text_contains('retn')))
+        self.assertFalse(query.any(text_contains('call')))
+
+    def test_set_algebra(self):
+        retn_lines = self.sdb.lines_text('retn')
+        ebp_lines = self.sdb.lines_text_tokens('ebp')
+        func_lines = self.sdb.lines_in_func(0x1000)
+
+        self.assertEqual(self.addresses(
+            func_lines & self.sdb.lines_data('\xc3')),[0x1009])
+        self.assertEqual(self.addresses(retn_lines | ebp_lines),
+                [0x1000,0x1001,0x1008,0x1009,0x2005])
+        self.assertEqual(self.addresses(func_lines - ebp_lines),
+                [0x1003,0x1009])
+        self.assertEqual(self.addresses(
+            (retn_lines | ebp_lines) - in_function(0x2000)),
+            [0x1000,0x1001,0x1008,0x1009])
+        self.assertEqual(self.addresses(
+            self.sdb.query().filter(line_type_is(LineTypes.DATA))
+            | self.sdb.lines_in_func(0x2000)),[0x2000,0x2005,0x3000,0x3004])
+
+        # Python filters:
+        mov_lines = self.sdb.query().filter(lambda l:l.text.startswith('mov'))
+        self.assertEqual(self.addresses(func_lines & mov_lines),[0x1001])
+        self.assertEqual(self.addresses(mov_lines - func_lines),[0x2000])
+        with self.assertRaises(SearchDBError):
+            func_lines | mov_lines
+        with self.assertRaises(SearchDBError):
+            func_lines - mov_lines
+
+    def test_within_function_of(self):
+        # Lines that return from functions that call another function:
+        lines = self.sdb.lines_text('retn').within_function_of(
+                self.sdb.lines_text_tokens('call'))
+        self.assertEqual(self.addresses(lines),[0x1009])
+
+        # Lines of functions that read data:
+        lines = self.sdb.query().within_function_of(
+                self.sdb.query().filter(has_xrefs_from(
+                    [XrefTypes.CODE_TO_DATA])))
+        self.assertEqual(self.addresses(lines),[0x2000,0x2005])
+
+        self.assertEqual(list(self.sdb.query().within_function_of(
+            self.sdb.query().filter(line_type_is(LineTypes.DATA)))),[])
+
+
+class TestLineQueryHex(TestLineQuery):
+    """
+    Run the same tests against an sdb of the old HEX version.
+    """
+    def fill_sdb(self,sdb_path):
+        gen_hex_sdb(sdb_path,EXAMPLE_LINES,EXAMPLE_XREFS,
+                [(address,name,[addr for addr,_,_,_ in EXAMPLE_LINES
+                    if any(start <= addr < end for start,end in chunks)])
+                    for address,name,chunks in EXAMPLE_FUNCS])
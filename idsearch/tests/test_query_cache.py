@@ -0,0 +1,238 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.func_iter import FuncIter
+from idsearch.query_cache import QueryCache, gen_cache_path, get_sdb_stamp, \
+        query_key
+from idsearch.line_query import text_contains
+from idsearch.types import LineTypes
+from idsearch.exceptions import SearchDBError
+
+EXAMPLE_LINES = [
+    (0x1000, LineTypes.CODE, 'push ebp', '\x55'),
+    (0x1001, LineTypes.CODE, 'mov ebp, esp', '\x8b\xec'),
+    (0x1003, LineTypes.CODE, 'call sub_2000', '\xe8\xf8\x0f\x00\x00'),
+    (0x1008, LineTypes.CODE, 'test eax, eax', '\x85\xc0'),
+    (0x100a, LineTypes.CODE, 'retn', '\xc3'),
+    (0x2000, LineTypes.CODE, 'call sub_1000', '\xe8\xfb\xef\xff\xff'),
+    (0x2005, LineTypes.CODE, 'test eax, eax', '\x85\xc0'),
+    (0x2007, LineTypes.CODE, 'retn', '\xc3'),
+]
+
+def line_tuples(lines):
+    return [(line.address,line.line_type,line.text,line.data)
+            for line in lines]
+
+class CountingConn(object):
+    """
+    A proxy of an sqlite connection, that counts the executed queries.
+    """
+    def __init__(self,conn):
+        self._conn = conn
+        self.num_queries = 0
+
+    def execute(self,*args):
+        self.num_queries += 1
+        return self._conn.execute(*args)
+
+    def close(self):
+        self._conn.close()
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.my_dir,'my.scache')
+
+    def tearDown(self):
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def test_gen_cache_path(self):
+        self.assertEqual(gen_cache_path(os.path.join('a.b','my.sdb')),
+                os.path.join('a.b','my.scache'))
+
+    def test_query_key(self):
+        self.assertEqual(query_key('a  =\n ?',(1,)),query_key('a = ?',[1]))
+        self.assertNotEqual(query_key('a = ?',(1,)),query_key('a = ?',(2,)))
+        self.assertNotEqual(query_key('a = ?',(1,)),query_key('a = ?',('1',)))
+
+    def test_persistent(self):
+        cache = QueryCache(self.cache_path,'1')
+        cache.put('a',[1,2**64 - 1,0])
+        cache.put('b',[])
+        self.assertIsNone(cache.get('c'))
+        cache.close()
+
+        cache = QueryCache(self.cache_path,'1')
+        self.assertEqual(cache.get('a'),[1,2**64 - 1,0])
+        self.assertEqual(cache.get('b'),[])
+        cache.close()
+
+        # Results of another state of the sdb are dropped:
+        cache = QueryCache(self.cache_path,'2')
+        self.assertIsNone(cache.get('a'))
+        cache.put('a',[3])
+        cache.set_stamp('3')
+        self.assertIsNone(cache.get('a'))
+        cache.close()
+
+    def test_evict(self):
+        # Room for 4 addresses:
+        cache = QueryCache(self.cache_path,'1',max_size=32)
+        try:
+            cache.put('a',[1])
+            cache.put('b',[2,3])
+            cache.get('a')
+            cache.put('c',[4])
+            self.assertEqual(cache.get_size(),32)
+            # b is the least recently used:
+            cache.put('d',[5])
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.get('a'),[1])
+            self.assertEqual(cache.get_size(),24)
+            # Too large to cache:
+            cache.put('e',range(5))
+            self.assertIsNone(cache.get('e'))
+            self.assertEqual(cache.get('c'),[4])
+
+            cache.clear()
+            self.assertEqual(cache.get_size(),0)
+        finally:
+            cache.close()
+
+    def test_invalid(self):
+        with open(self.cache_path,'wb') as f:
+            f.write('not an sqlite file' * 0x100)
+        with self.assertRaises(SearchDBError):
+            QueryCache(self.cache_path,'1')
+
+
+class TestSearchCache(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        self.sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        sdbgen = SDBGen(self.sdb_path)
+        sdbgen.add_lines(EXAMPLE_LINES)
+        sdbgen.fill_lines_fts()
+        sdbgen.fill_data_pages()
+        sdbgen.close()
+
+    def tearDown(self):
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def open_sdb(self,**kwargs):
+        sdb = SearchDB(self.sdb_path,**kwargs)
+        sdb.open_cache()
+        sdb._conn = CountingConn(sdb._conn)
+        return sdb
+
+    def test_lines(self):
+        sdb = self.open_sdb()
+        try:
+            lines = line_tuples(sdb.lines_text('test eax'))
+            self.assertEqual([line[0] for line in lines],
+                    [0x1008,0x2005])
+            # A search that was not fully iterated is not cached:
+            next(sdb.lines_text_tokens('retn'))
+        finally:
+            sdb.close()
+
+        sdb = self.open_sdb()
+        try:
+            self.assertEqual(line_tuples(sdb.lines_text('test eax')),lines)
+            # Only the lines at the cached addresses were fetched:
+            self.assertEqual(sdb._conn.num_queries,1)
+            self.assertEqual([line.address for line in
+                sdb.lines_text('test eax',fields=['address'])],
+                [0x1008,0x2005])
+            self.assertEqual(sdb._conn.num_queries,1)
+            self.assertEqual([line.text for line in
+                sdb.lines_text('test eax',fields=['text'])],
+                ['test eax, eax'] * 2)
+
+            num_queries = sdb._conn.num_queries
+            self.assertEqual([line.address for line in
+                sdb.lines_text_tokens('retn')],[0x100a,0x2007])
+            # The search ran on the lines table:
+            self.assertEqual(sdb._conn.num_queries,num_queries + 1)
+        finally:
+            sdb.close()
+
+    def test_combined(self):
+        sdb = self.open_sdb(iter_proxy=FuncIter,query_builder=True)
+        try:
+            def query():
+                return (sdb.lines_text_tokens('call') |
+                        sdb.lines_text_tokens('retn'))\
+                                .filter(text_contains('sub_1000') |
+                                        text_contains('retn'))
+            self.assertEqual([line.address for line in query()],
+                    [0x100a,0x2000,0x2007])
+            num_queries = sdb._conn.num_queries
+            self.assertEqual([line.address for line in query()],
+                    [0x100a,0x2000,0x2007])
+            self.assertEqual(sdb._conn.num_queries,num_queries + 1)
+
+            # Pipelines with python filters are cached by name:
+            for _ in xrange(2):
+                self.assertEqual([line.address for line in sdb.cached_lines(
+                    'calls',sdb.all_lines().filter(
+                        lambda line:line.text.startswith('call')))],
+                    [0x1003,0x2000])
+            self.assertEqual([line.address for line in
+                sdb.cached_lines('calls',None,fields=['address'])],
+                [0x1003,0x2000])
+        finally:
+            sdb.close()
+
+    def test_data_pattern(self):
+        sdb = self.open_sdb()
+        try:
+            self.assertEqual(sdb.data_pattern_addresses('85 c0 ?3'),
+                    [0x1008,0x2005])
+            num_queries = sdb._conn.num_queries
+            self.assertEqual(sdb.data_pattern_addresses('85C0 ?3'),
+                    [0x1008,0x2005])
+            self.assertEqual(sdb._conn.num_queries,num_queries)
+        finally:
+            sdb.close()
+
+    def test_invalidate(self):
+        sdb = self.open_sdb()
+        try:
+            stamp = get_sdb_stamp(self.sdb_path)
+            self.assertEqual(len(list(sdb.lines_text_tokens('retn'))),2)
+
+            sdbgen = SDBGen(self.sdb_path,update=True)
+            sdbgen.add_lines([(0x3000, LineTypes.CODE, 'retn', '\xc3')])
+            sdbgen.fill_lines_fts([0x3000])
+            sdbgen.close()
+            self.assertNotEqual(get_sdb_stamp(self.sdb_path),stamp)
+
+            self.assertEqual([line.address for line in
+                sdb.lines_text_tokens('retn')],[0x100a,0x2007,0x3000])
+        finally:
+            sdb.close()
+
+    def test_no_cache(self):
+        sdb = SearchDB(self.sdb_path)
+        try:
+            self.assertEqual(len(list(sdb.lines_text('test eax'))),2)
+            self.assertEqual(len(list(sdb.cached_lines('a',
+                sdb.lines_text('test eax')))),2)
+        finally:
+            sdb.close()
+        self.assertFalse(os.path.isfile(gen_cache_path(self.sdb_path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+import re
+
+from idsearch.regex_text import required_text, literal_tokens, \
+    regex_pattern, sql_regexp
+
+
+class TestRegexText(unittest.TestCase):
+    def test_required_text(self):
+        self.assertEqual(required_text(r'mov\s+\w+, \[rsp\+[0-9a-f]+h\]'),
+                ['mov',', [rsp+','h]'])
+        self.assertEqual(required_text(r'^call (sub|loc)_'),
+                ['call ',[['sub'],['loc']],'_'])
+        self.assertEqual(required_text('ab(cd)+e?f*'),['ab','cd'])
+        self.assertEqual(required_text('x*|y'),[[[],['y']]])
+        # A common prefix of alternatives:
+        self.assertEqual(required_text('(push|pop) ebp'),
+                [[['push'],['pop']],' ebp'])
+        self.assertEqual(required_text(re.compile('(?i)Push')),['Push'])
+
+    def test_literal_tokens(self):
+        self.assertEqual(literal_tokens(', [rsp+'),['rsp'])
+        self.assertEqual(literal_tokens(' [ebp+var_'),['ebp','var'])
+        self.assertEqual(literal_tokens('mov eax'),[])
+
+    def test_regexp(self):
+        self.assertEqual(regex_pattern('a.b'),'a.b')
+        self.assertEqual(regex_pattern(re.compile('a.b',re.I | re.S)),
+                '(?is)a.b')
+        self.assertEqual(sql_regexp('(?i)EB.','push ebp'),1)
+        self.assertEqual(sql_regexp('^ebp','push ebp'),0)
+        self.assertEqual(sql_regexp('ebp',None),0)
+
+
+if __name__ == '__main__':
+    unittest.main()
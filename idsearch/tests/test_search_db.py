@@ -5,28 +5,46 @@ import shutil
 import tempfile
 
 from idsearch.gen_db import SDBGen
-from idsearch.search_db import SearchDB
-from idsearch.types import LineTypes, XrefTypes
+from idsearch.search_db import SearchDB, get_lines_version
+from idsearch.types import LineTypes, XrefTypes, SDBVersions
+from idsearch.exceptions import SearchDBError
+from idsearch.usqlite3 import sqlite3
 from idsearch.types import hex_to_data, data_to_hex
+from idsearch.tests.legacy_sdb import gen_hex_sdb
+
+# Example rows:
+EXAMPLE_LINES = [
+    (0x051FECB4, LineTypes.CODE,'li r25,0','\x3B\x20\x00\x00'),
+    (0x051FECB8, LineTypes.CODE,'addi r24, r1, 0x40+var_28','\x3B\x01\x00\x18'),
+    (0x051FECBC, LineTypes.CODE, 'bctrl','\x4e\x80\x04\x21'),
+    (0x051FECC0, LineTypes.CODE, 'li r4,-1','\x38\x80\xff\xff'),
+    (0x051FECC4, LineTypes.CODE, 'li r5,-1','\x38\xA0\xff\xff'),
+    (0xFF000000, LineTypes.CODE, 'empty',''),
+]
+
+EXAMPLE_XREFS = [(XrefTypes.CODE_FLOW,0x051fecb4,0x051fecb8)]
 
 def fill_sdb(sdb_path):
     """
     Fill the database with some example rows.
     """
     sdbgen = SDBGen(sdb_path)
-    sdbgen.add_line(0x051FECB4, LineTypes.CODE,'li r25,0','\x3B\x20\x00\x00')
-    sdbgen.add_line(0x051FECB8, LineTypes.CODE,
-            'addi r24, r1, 0x40+var_28','\x3B\x01\x00\x18')
-    sdbgen.add_line(0x051FECBC, LineTypes.CODE, 'bctrl','\x4e\x80\x04\x21')
-    sdbgen.add_line(0x051FECC0, LineTypes.CODE, 'li r4,-1','\x38\x80\xff\xff')
-    sdbgen.add_line(0x051FECC4, LineTypes.CODE, 'li r5,-1','\x38\xA0\xff\xff')
-    sdbgen.add_line(0xFF000000, LineTypes.CODE, 'empty','')
-
-    sdbgen.add_xref(XrefTypes.CODE_FLOW,0x051fecb4,0x051fecb8)
-    sdbgen.add_function(0x051fecb4,'my_func',[0x051fecb4,0x051fecb8])
+    for line in EXAMPLE_LINES:
+        sdbgen.add_line(*line)
+
+    for xref in EXAMPLE_XREFS:
+        sdbgen.add_xref(*xref)
+    sdbgen.add_function(0x051fecb4,'my_func',[(0x051fecb4,0x051fecbc)])
     sdbgen.fill_lines_fts()
     sdbgen.close()
 
+def fill_hex_sdb(sdb_path):
+    """
+    Fill an sdb of version SDBVersions.HEX with the same example rows.
+    """
+    gen_hex_sdb(sdb_path,EXAMPLE_LINES,EXAMPLE_XREFS,
+            [(0x051fecb4,'my_func',xrange(0x051fecb4,0x051fecbc))])
+
 
 class TestSearchDB(unittest.TestCase):
     def setUp(self):
@@ -83,6 +101,25 @@ class TestSearchDB(unittest.TestCase):
         self.assertEqual(xref.line_to,0x051fecb8)
         self.assertEqual(xref.xref_type,XrefTypes.CODE_FLOW)
 
+    def test_xrefs_many(self):
+        xrefs = self.sdb.xrefs_from_many([0x051fecb4,0x051fecb8,0x051fecb4])
+        self.assertEqual(sorted(xrefs.keys()),[0x051fecb4,0x051fecb8])
+        self.assertEqual([x.line_to for x in xrefs[0x051fecb4]],[0x051fecb8])
+        self.assertEqual(xrefs[0x051fecb8],[])
+
+        xrefs = self.sdb.xrefs_to_many(xrange(0x051fecb0,0x051fecc0))
+        self.assertEqual(len(xrefs),0x10)
+        self.assertEqual([x.line_from for x in xrefs[0x051fecb8]],
+                [0x051fecb4])
+        self.assertEqual(sum(len(x) for x in xrefs.values()),1)
+
+        # More addresses than one batch:
+        xrefs = self.sdb.xrefs_to_many(xrange(0x051fe000,0x051ff000))
+        self.assertEqual(len(xrefs),0x1000)
+        self.assertEqual(sum(len(x) for x in xrefs.values()),1)
+
+        self.assertEqual(self.sdb.xrefs_to_many([]),{})
+
     def test_lines_in_func(self):
 
         lines = list(self.sdb.lines_in_func(0x051fecb4))
@@ -98,6 +135,24 @@ class TestSearchDB(unittest.TestCase):
         func = funcs[0]
         self.assertEqual(func.address,0x051fecb4)
 
+    def test_funcs_by_lines(self):
+        funcs = self.sdb.funcs_by_lines([0x051fecb4,0x051fecb8,0x051fecbc])
+        self.assertEqual([f.name for f in funcs[0x051fecb4]],['my_func'])
+        self.assertEqual([f.address for f in funcs[0x051fecb8]],[0x051fecb4])
+        self.assertEqual(funcs[0x051fecbc],[])
+
+    def test_get_lines(self):
+        addresses = [row[0] for row in EXAMPLE_LINES]
+        lines = self.sdb.get_lines(addresses + [0x1234])
+        self.assertEqual(sorted(lines.keys()),sorted(addresses))
+        for address,line_type,text,data in EXAMPLE_LINES:
+            self.assertEqual(lines[address].text,text)
+            self.assertEqual(lines[address].data,data)
+
+        lines = self.sdb.get_lines(addresses,fields=['data'])
+        self.assertEqual(lines[0x051FECBC].data,'\x4e\x80\x04\x21')
+        self.assertEqual(lines[0x051FECBC].address,None)
+
 
     def test_lines_text(self):
         lines = list(self.sdb.lines_text('li'))
@@ -144,6 +199,17 @@ class TestSearchDB(unittest.TestCase):
         self.assertEqual(len(lines),1)
 
 
+    def test_lines_regex(self):
+        lines = list(self.sdb.lines_regex(r'^li r\d+,-1$'))
+        self.assertEqual([line.address for line in lines],
+                [0x051fecc0,0x051fecc4])
+
+        lines = list(self.sdb.lines_regex(r'r2[0-9],\d'))
+        self.assertEqual(len(lines),1)
+
+        lines = list(self.sdb.lines_regex('bctrl|r4,',prefilter=False))
+        self.assertEqual(len(lines),2)
+
     def test_match_lines_data_hex(self):
 
         lines = list(self.sdb.match_lines_data_hex('4E'))
@@ -176,12 +242,157 @@ class TestSearchDB(unittest.TestCase):
             len(list(self.sdb.lines_in_range(0x051fecbe,0x051fecbc))),0)
 
     def test_lines_around(self):
+        def addresses(lines):
+            return [line.address for line in lines]
+
         self.assertEqual(
-            len(list(self.sdb.lines_around(0x051fecbc,4))),3)
+            len(list(self.sdb.lines_around(0x051fecbc,1))),3)
         self.assertEqual(
-            len(list(self.sdb.lines_above(0x051fecbc,4))),2)
+            len(list(self.sdb.lines_above(0x051fecbc,1))),2)
         self.assertEqual(
-            len(list(self.sdb.lines_below(0x051fecbc,4))),2)
+            len(list(self.sdb.lines_below(0x051fecbc,1))),2)
+
+        # Counts are of lines, not of addresses:
+        self.assertEqual(addresses(self.sdb.lines_below(0x051fecc4,1)),
+                [0x051fecc4,0xff000000])
+        self.assertEqual(addresses(self.sdb.lines_above(0x051fecbc,4)),
+                [0x051fecb4,0x051fecb8,0x051fecbc])
+        self.assertEqual(addresses(self.sdb.lines_below(0x051fecbc,2)),
+                [0x051fecbc,0x051fecc0,0x051fecc4])
+        self.assertEqual(addresses(self.sdb.lines_above(0x051fecbc,0)),
+                [0x051fecbc])
+        # An address between lines:
+        self.assertEqual(addresses(self.sdb.lines_around(0x051fecba,1)),
+                [0x051fecb8,0x051fecbc])
+
+    def test_lines_context(self):
+        context = self.sdb.lines_context([0x051fecb4,0x051fecc4,0x10],1)
+        self.assertEqual(sorted(context.keys()),[0x10,0x051fecb4,0x051fecc4])
+        self.assertEqual([l.address for l in context[0x051fecb4]],
+                [0x051fecb4,0x051fecb8])
+        self.assertEqual([l.address for l in context[0x051fecc4]],
+                [0x051fecc0,0x051fecc4,0xff000000])
+        self.assertEqual([l.address for l in context[0x10]],[0x051fecb4])
+        self.assertEqual(context[0x051fecc4][1].text,'li r5,-1')
+
+        context = self.sdb.lines_context([0x051fecbc],2,0,fields=['address'])
+        self.assertEqual([l.address for l in context[0x051fecbc]],
+                [0x051fecb4,0x051fecb8,0x051fecbc])
+        self.assertIsNone(context[0x051fecbc][0].text)
+
+    def test_fields(self):
+        lines = list(self.sdb.all_lines(fields=['address']))
+        self.assertEqual(sorted(l.address for l in lines),
+                sorted(row[0] for row in EXAMPLE_LINES))
+        self.assertTrue(all(l.text is None and l.data is None for l in lines))
+
+        line = self.sdb.get_line(0x051fecb4,fields=['address','data'])
+        self.assertEqual(line.data,'\x3B\x20\x00\x00')
+        self.assertEqual(line.text,None)
+        self.assertEqual(line.line_type,None)
+
+        lines = list(self.sdb.lines_text('r25',fields=['text']))
+        self.assertEqual([l.text for l in lines],['li r25,0'])
+        self.assertEqual([l.address for l in self.sdb.lines_data(
+            '\x4e\x80',fields=['address'])],[0x051fecbc])
+        self.assertEqual(len(list(self.sdb.lines_in_func(0x051fecb4,
+            fields=['address']))),2)
+
+        with self.assertRaises(SearchDBError):
+            self.sdb.all_lines(fields=['address','line_text'])
+
+
+class TestSearchHexDB(TestSearchDB):
+    """
+    Run the same tests against an sdb of the old HEX version.
+    """
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        fill_hex_sdb(my_sdb_path)
+
+        self.sdb = SearchDB(my_sdb_path)
+
+
+class TestSearchLazyDB(TestSearchDB):
+    """
+    Run the same tests with lazy lines.
+    """
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        fill_sdb(my_sdb_path)
+
+        self.sdb = SearchDB(my_sdb_path,lazy_lines=True)
+
+    def test_lazy_line(self):
+        line = self.sdb.get_line(0x051fecb4)
+        self.assertEqual(line.text,'li r25,0')
+        self.assertEqual(line.data,'\x3B\x20\x00\x00')
+        line.text = 'nop'
+        self.assertEqual(line.text,'nop')
+
+
+class TestSearchHexLazyDB(TestSearchLazyDB):
+    """
+    Run the same tests with lazy lines, against an sdb of the old HEX
+    version.
+    """
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        fill_hex_sdb(my_sdb_path)
+
+        self.sdb = SearchDB(my_sdb_path,lazy_lines=True)
+
+
+class TestSearchQueryBuilder(TestSearchDB):
+    """
+    Run the same tests in query builder mode.
+    """
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        my_sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        fill_sdb(my_sdb_path)
+
+        self.sdb = SearchDB(my_sdb_path,query_builder=True)
+
+
+class TestSearchDBVersion(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        self.sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+        fill_sdb(self.sdb_path)
+
+    def tearDown(self):
+        # Remote temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def test_current_version(self):
+        conn = sqlite3.connect(self.sdb_path)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        data_type = conn.execute('SELECT typeof(line_data) FROM lines')\
+                .fetchone()[0]
+        conn.close()
+        self.assertEqual(version,SDBVersions.CURRENT)
+        self.assertEqual(data_type,'blob')
+
+    def test_lines_version(self):
+        self.assertEqual(get_lines_version(SDBVersions.HEX),SDBVersions.HEX)
+        for version in xrange(SDBVersions.RAW,SDBVersions.CURRENT + 1):
+            self.assertEqual(get_lines_version(version),SDBVersions.RAW)
+
+    def test_unsupported_version(self):
+        conn = sqlite3.connect(self.sdb_path)
+        conn.execute('PRAGMA user_version = 1000')
+        conn.close()
+        with self.assertRaises(SearchDBError):
+            SearchDB(self.sdb_path)
 
 
 class TestSearchFTS(unittest.TestCase):
@@ -0,0 +1,138 @@
+import unittest
+
+import os
+import re
+import shutil
+import tempfile
+
+from idsearch.gen_db import SDBGen
+from idsearch.search_db import SearchDB
+from idsearch.segment_image import SegmentImage, write_image, gen_image_path
+from idsearch.types import LineTypes
+from idsearch.exceptions import SearchDBError
+
+EXAMPLE_LINES = [
+    (0x1000, LineTypes.CODE, 'push ebp', '\x55'),
+    (0x1001, LineTypes.CODE, 'mov ebp, esp', '\x8b\xec'),
+    (0x1003, LineTypes.CODE, 'call sub_2000', '\xe8\xf8\x0f\x00\x00'),
+    (0x1008, LineTypes.CODE, 'test eax, eax', '\x85\xc0'),
+    # A gap of unexplored bytes:
+    (0x100c, LineTypes.CODE, 'retn', '\xc3'),
+    (0x2000, LineTypes.CODE, 'call sub_1000', '\xe8\xfb\xef\xff\xff'),
+    (0x2005, LineTypes.CODE, 'test eax, eax', '\x85\xc0'),
+    (0x2007, LineTypes.CODE, 'retn', '\xc3'),
+    (0x3000, LineTypes.DATA, 'db 0', '\x00'),
+]
+
+EXAMPLE_SEGMENTS = [
+    (0x1000, 0x1010, 'a'),
+    (0x2000, 0x2008, 'b'),
+]
+
+
+class TestSegmentImage(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        self.image_path = os.path.join(self.my_dir,'my.simg')
+
+    def tearDown(self):
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def test_gen_image_path(self):
+        self.assertEqual(gen_image_path(os.path.join('a.b','my.sdb')),
+                os.path.join('a.b','my.simg'))
+
+    def test_write_image(self):
+        write_image(self.image_path,[(0x2000,0x2004),(0x1000,0x1004)],
+                [(0x1000,'\x01\x02'),(0x1003,'\x03\x04\x05'),
+                    (0x1ffe,'\x08\x09\x00\x06'),(0x3000,'\x07')])
+        image = SegmentImage(self.image_path)
+        try:
+            self.assertEqual([segment[:2] for segment in image.segments],
+                    [(0x1000,0x1004),(0x2000,0x2004)])
+            # Data is cut at the end of the segment:
+            self.assertEqual(image.read(0x1000,0x10),'\x01\x02\x00\x03')
+            self.assertEqual(image.read(0x2000,2),'\x00\x06')
+            self.assertIsNone(image.read(0x1004,1))
+            self.assertIsNone(image.read(0x100,1))
+            # Matches do not cross segments:
+            self.assertEqual(list(image.find_data('\x00')),
+                    [0x1002,0x2000,0x2002,0x2003])
+            self.assertEqual(list(image.find_data('\x03\x00')),[])
+            self.assertEqual(list(image.find_regex('\x06|\x01')),
+                    [0x1000,0x2001])
+        finally:
+            image.close()
+
+    def test_invalid(self):
+        with self.assertRaises(SearchDBError):
+            SegmentImage(self.image_path)
+        for contents in ['','IDS','IDSIMG02\x00\x00\x00\x00']:
+            with open(self.image_path,'wb') as f:
+                f.write(contents)
+            with self.assertRaises(SearchDBError):
+                SegmentImage(self.image_path)
+
+
+class TestSearchImage(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory:
+        self.my_dir = tempfile.mkdtemp()
+        self.sdb_path = os.path.join(self.my_dir,'mydb.sdb')
+
+    def tearDown(self):
+        # Remove temporary directory:
+        shutil.rmtree(self.my_dir)
+
+    def gen_sdb(self,segments):
+        sdbgen = SDBGen(self.sdb_path)
+        sdbgen.add_lines(EXAMPLE_LINES)
+        sdbgen.add_segments(segments)
+        sdbgen.write_image(gen_image_path(self.sdb_path))
+        sdbgen.close()
+        return SearchDB(self.sdb_path)
+
+    def test_segments(self):
+        sdb = self.gen_sdb(EXAMPLE_SEGMENTS)
+        try:
+            self.assertEqual(list(sdb.image_find_data('\x85\xc0')),
+                    [0x1008,0x2005])
+            # The gap is zeros:
+            self.assertEqual(list(sdb.image_find_data('\xc0\x00\x00\xc3')),
+                    [0x1009])
+            # Lines outside of the segments are not in the image:
+            self.assertIsNone(sdb.open_image().read(0x3000,1))
+            self.assertEqual(list(sdb.image_find_regex(
+                re.compile('\xe8.{4}\x85\xc0',re.DOTALL))),[0x1003,0x2000])
+        finally:
+            sdb.close()
+
+    def test_data_runs(self):
+        # Without segments, every run of data is a segment:
+        sdb = self.gen_sdb([])
+        try:
+            image = sdb.open_image()
+            self.assertEqual([segment[:2] for segment in image.segments],
+                    [(0x1000,0x100a),(0x100c,0x100d),(0x2000,0x2008),
+                        (0x3000,0x3001)])
+            self.assertEqual(list(sdb.image_find_data('\xc3')),
+                    [0x100c,0x2007])
+        finally:
+            sdb.close()
+
+    def test_no_image(self):
+        sdbgen = SDBGen(self.sdb_path)
+        sdbgen.add_lines(EXAMPLE_LINES)
+        sdbgen.close()
+        sdb = SearchDB(self.sdb_path)
+        try:
+            with self.assertRaises(SearchDBError):
+                list(sdb.image_find_data('\xc3'))
+        finally:
+            sdb.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
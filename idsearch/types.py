@@ -1,3 +1,5 @@
+import binascii
+
 
 class LineTypes(object):
     CODE = 0
@@ -10,39 +12,165 @@ class XrefTypes(object):
     DATA_TO_DATA = 3
     DATA_TO_CODE = 4
 
+class OperandTypes(object):
+    # Same as the o_* operand types of IDA:
+    VOID = 0
+    REG = 1
+    MEM = 2
+    PHRASE = 3
+    DISPL = 4
+    IMM = 5
+    FAR = 6
+    NEAR = 7
+
+class SDBVersions(object):
+    # Line text and data are stored as space separated hex. Function lines are
+    # stored in the funcs_lines table:
+    HEX = 0
+    # Line text and data are stored raw, as TEXT and BLOB. Hex forms exist
+    # only inside the fts index. Functions are stored as chunks:
+    RAW = 1
+    # Like RAW. Also stores segment checksums, and allows deleting rows from
+    # the fts index, so the sdb can be updated incrementally:
+    SEGMENTS = 2
+    # Like SEGMENTS. Also stores the basic blocks of the code lines, derived
+    # from the xrefs:
+    BLOCKS = 3
+    # Like BLOCKS. Also stores the data of the lines in pages, with an ngram
+    # index for byte pattern search:
+    DATA_PAGES = 4
+    # Like DATA_PAGES. Also stores the mnemonic and operands of every code
+    # line:
+    INSTRUCTIONS = 5
+
+    # Version of newly generated sdbs:
+    CURRENT = INSTRUCTIONS
+
 ############################################################################
 
+# The records are created for every row of a search result, so they use
+# __slots__ instead of a per instance __dict__:
+
 class Xref(object):
+    __slots__ = ('xref_type','line_from','line_to')
+
     def __init__(self,xref_type,line_from,line_to):
         self.xref_type = xref_type
         self.line_from = line_from
         self.line_to = line_to
 
 class Line(object):
+    __slots__ = ('address','line_type','text','data')
+
     def __init__(self,address,line_type,text,data):
         self.address = address
         self.line_type = line_type
         self.text = text
         self.data = data
 
+class LazyLine(object):
+    """
+    A Line that keeps the raw column values of its row. text and data are
+    decoded only on first access, using decode_text and decode_data.
+    A decode function of None means that the raw value is already decoded.
+    """
+    __slots__ = ('address','line_type','_text','_data',
+            '_decode_text','_decode_data')
+
+    def __init__(self,address,line_type,raw_text,raw_data,
+            decode_text=None,decode_data=None):
+        self.address = address
+        self.line_type = line_type
+        self._text = raw_text
+        self._data = raw_data
+        self._decode_text = decode_text
+        self._decode_data = decode_data
+
+    @property
+    def text(self):
+        if self._decode_text is not None:
+            self._text = self._decode_text(self._text)
+            self._decode_text = None
+        return self._text
+
+    @text.setter
+    def text(self,text):
+        self._text = text
+        self._decode_text = None
+
+    @property
+    def data(self):
+        if self._decode_data is not None:
+            self._data = self._decode_data(self._data)
+            self._decode_data = None
+        return self._data
+
+    @data.setter
+    def data(self,data):
+        self._data = data
+        self._decode_data = None
+
 class Function(object):
+    __slots__ = ('address','name')
+
     def __init__(self,address,name):
         self.address = address
         self.name = name
 
+class Block(object):
+    """
+    A basic block: A range of addresses, start_address inclusive and
+    end_address exclusive.
+    """
+    __slots__ = ('start_address','end_address')
+
+    def __init__(self,start_address,end_address):
+        self.start_address = start_address
+        self.end_address = end_address
+
+class Operand(object):
+    """
+    An operand of the instruction of a code line. index is the position of
+    the operand in the instruction, starting from 0. value is the immediate,
+    address or displacement of the operand, depending on op_type.
+    """
+    __slots__ = ('line','index','op_type','text','value')
+
+    def __init__(self,line,index,op_type,text,value):
+        self.line = line
+        self.index = index
+        self.op_type = op_type
+        self.text = text
+        self.value = value
+
 ###########################################################################
 
+def int_to_sdb(value):
+    """
+    Convert a 64 bit value to the signed integer that sqlite stores for it.
+    Values are given by IDA as unsigned, and some of them do not fit.
+    """
+    value &= 2**64 - 1
+    if value >= 2**63:
+        value -= 2**64
+    return value
 
 def data_to_hex(data):
     """
     Convert data to space separated hex bytes.
     """
-    return " ".join(map(lambda c:c.encode('hex').lower(),data))
+    if len(data) == 0:
+        return ''
+
+    data_hex = binascii.hexlify(data)
+    # Every byte takes 3 characters: Two hex digits and a space:
+    res = bytearray(' ' * (len(data) * 3 - 1))
+    res[0::3] = data_hex[0::2]
+    res[1::3] = data_hex[1::2]
+    return str(res)
 
 def hex_to_data(data_hex):
     """
     Convert space separated hex bytes to data.
     """
-    return ''.join(
-        map(lambda chex:chex.decode('hex'),data_hex.split(' '))
-    )
+    return binascii.unhexlify(data_hex.replace(' ',''))
@@ -10,6 +10,7 @@ This will create an index for the IDB at <idb_path>.sdb
 import logging
 import os
 import idc
+import idaapi
 from idsearch.idb_util import gen_sdb
 
 logger = logging.getLogger('idsearch')
@@ -38,14 +39,17 @@ def run():
 
     logger.info('Run was called')
 
+    # Exit code of IDA. Nonzero means that indexing failed:
+    exit_code = 1
     try:
         logger.info('Calling index_idb')
         gen_sdb(sdb_path=None,overwrite=True)
         logger.info('Indexing completed successfully!')
+        exit_code = 0
     except:
         logger.exception('Unhandled exception inside run().')
     finally:
-        idc.Exit(0)
+        idc.Exit(exit_code)
 
 
 